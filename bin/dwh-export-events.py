@@ -4,6 +4,10 @@
 """ Export events script for DataWareHouse portal.
 
 This script exports the events log from the past 24 hours (by default).
+
+If the incremental mode is enabled in the configuration ("intraday" section), it exports instead
+the events produced since its previous run, and is meant to be scheduled on a short period
+(hourly for instance).
 """
 
 import ConfigParser
@@ -59,6 +59,10 @@ if __name__ == '__main__':
     parser = pycstbox.cli.get_argument_parser(
         description=__doc__
     )
+    parser.add_argument(
+        '--full', action='store_true',
+        help='upload all the definitions, and not only the ones added or modified since last upload'
+    )
     args = parser.parse_args()
 
     pycstbox.log.set_loglevel_from_args(log, args)
@@ -83,7 +87,7 @@ if __name__ == '__main__':
             devices_cfg = pycstbox.devcfg.DeviceNetworkConfiguration(autoload=True)
             vars_metadata = json.load(file(pycstbox.config.make_config_file_path(VARS_METATDATA_FILE_NAME)))
 
-            error = process.run(process_cfg, devices_cfg, vars_metadata)
+            error = process.run(process_cfg, devices_cfg, vars_metadata, full=args.full)
 
         except Exception as e:      #pylint: disable=W0703
             log.exception(e)
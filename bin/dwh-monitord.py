@@ -5,39 +5,34 @@
 """
 
 import ConfigParser
+import errno
 import os
+import select
+import signal
 import sys
-import json
+import threading
 import time
 
-import requests
-
 import pycstbox.log as log
 import pycstbox.cli
 import pycstbox.config
 
 from pycstbox.dwh import CONFIG_FILE_NAME
-from pycstbox.dwh.process import ProcessConfiguration
-from pycstbox.dwh.pending_jobs_queue import PendingJobsQueue
+from pycstbox.dwh.process import ProcessConfiguration, pending_jobs_queue
+from pycstbox.dwh.pending_jobs_queue import BACKEND_SQLITE
+from pycstbox.dwh.job_monitor import JobStatusPoller, JobCheckScheduler, StoredJobCheckScheduler, FileChangeWatcher
+from pycstbox.dwh.job_monitor import JOB_STATUS, STATUS_COMPLETED, queue_report
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
 SCRIPT_NAME = os.path.splitext(os.path.basename(__file__))[0]
 
+REPORT_STALE_AGE = 24 * 3600
+""" Age (in seconds) of the jobs reported as stale, if no maximum age is configured """
+
 
 class Worker(object):
-    TERMINATE_CHECK_PERIOD = 1
-
-    JOB_STATUS = {
-        1: "in process",
-        0: "completed",
-        -1: "bad file format",
-        -2: "missing variable name",
-        -3: "unknown variable name",
-        -4: "database connection failure",
-        -5: "incoherent data error",
-        -6: "invalid data"
-    }
+    JOB_STATUS = JOB_STATUS
 
     def __init__(self, cfg, debug=False, **kwargs):
         if cfg.status_monitoring_period <= 0:
@@ -51,67 +46,133 @@ class Worker(object):
         if debug:
             self._log.setLevel(log.DEBUG)
 
-        self._terminated = False
+        self._terminated = threading.Event()
+        # self-pipe used to wake up the worker when terminate is requested, including from a signal handler
+        self._wakeup_r, self._wakeup_w = os.pipe()
 
     def run(self):
         site_code = self._cfg.site_code
         period = int(self._cfg.status_monitoring_period)
-        auth = (self._cfg.login, self._cfg.password)
 
-        query = self._cfg.job_status_url
+        poller = JobStatusPoller(self._cfg)
+        if self._debug:
+            poller.log_setLevel(log.DEBUG)
+        queue = pending_jobs_queue(self._cfg)
+        if uses_stored_schedule(self._cfg):
+            # the check times are stored with the jobs, and the due ones are obtained from the queue
+            scheduler = StoredJobCheckScheduler.from_config(self._cfg, queue=queue)
+        else:
+            scheduler = JobCheckScheduler.from_config(self._cfg)
+        queue_watcher = FileChangeWatcher(queue.path)
+        queue_check_period = self._cfg.monitor[ProcessConfiguration.Props.QUEUE_CHECK_PERIOD]
 
         self._log.info('started (site_code=%s period=%d secs)', site_code, period)
 
-        last_check = 0
-
-        while True:
-            now = time.time()
-            if now - last_check >= period:
-                queue = PendingJobsQueue()
-                for job_id in queue.items():
-                    if self._debug:
-                        self._log.debug('requesting status of site/job %s/%s', self._cfg.site_code, job_id)
-
-                    resp = requests.get(url=query % (site_code, job_id), auth=auth)
-
-                    if resp.ok:
-                        if self._debug:
-                            self._log.debug('got reply : %s', resp.text)
-
-                        reply = json.loads(resp.text)
-
-                        completion_code = reply['code']
-
-                        if completion_code == 0:    # completed
-                            # log it and remove the job from the queue
-                            log.info('job %s completed ok', job_id)
-                            queue.remove(job_id)
-                        elif completion_code < 0:
-                            # solid error => log it and remove the job from the queue
-                            try:
-                                code_msg = reply['status']
-                            except KeyError:
-                                code_msg = "unknown code"
-                            log.error('job %s failed with code %d (%s)', job_id, completion_code, code_msg)
-                            queue.remove(job_id)
+        try:
+            while not self._terminated.is_set():
+                now = time.time()
+                if queue_watcher.changed():
+                    # pick up the jobs added since the previous scan
+                    queue.load()
+                    scheduler.sync(queue.items(), now, queue.job_info)
+
+                due = scheduler.due_jobs(now)
+                expired = scheduler.expired_jobs(now)
+                if due or expired:
+                    self.check_jobs(poller, scheduler, queue, due, expired)
+
+                # sleep until the next scheduled check, watching for queue changes in the meantime
+                timeout = queue_check_period
+                next_check = scheduler.next_check_time()
+                if next_check is not None:
+                    timeout = max(0, min(timeout, next_check - time.time()))
+                self._wait(timeout)
+
+            self._log.info('terminate request detected')
+
+        finally:
+            poller.close()
+            queue.close()
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
 
-                        # otherwise the job is still pending. Just leave it a is
+        self._log.info('worker thread terminated')
 
-                    else:
-                        log.error("server replied with : %d - %s", resp.status_code, resp.reason)
+    def check_jobs(self, poller, scheduler, queue, job_ids, expired=()):
+        """ Queries the status of the given pending jobs, and removes the completed ones from the queue.
+
+        Jobs still in process are rescheduled. Expired ones are given up and removed from the queue
+        too. The queue is updated once, after all the statuses have been obtained.
+
+        :param JobStatusPoller poller: the job status poller
+        :param JobCheckScheduler scheduler: the job checks scheduler
+        :param queue: the pending jobs queue
+        :param job_ids: the ids of the jobs to be checked
+        :param expired: the ids of the jobs to be given up
+        """
+        completed = []
+        checks = []
+        for job_id in expired:
+            self._log.error('job %s given up after being pending for too long', job_id)
+            completed.append(job_id)
+
+        for status in poller.poll(job_ids):
+            if status.code == STATUS_COMPLETED:
+                # log it and remove the job from the queue
+                self._log.info('job %s completed ok', status.job_id)
+                completed.append(status.job_id)
+            elif status.is_final:
+                # solid error => log it and remove the job from the queue
+                self._log.error('job %s failed with code %d (%s)', status.job_id, status.code, status.message)
+                completed.append(status.job_id)
+            else:
+                # the job is still pending (or its status is unknown) => check it again later
+                scheduler.reschedule(status.job_id, time.time())
+                checks.append((status.job_id, status.code, scheduler.job_next_check(status.job_id)))
+                continue
+
+            scheduler.remove(status.job_id)
+
+        # keep track of the checks, for the storage backends supporting it
+        queue.record_checks(checks)
+        queue.remove_all(completed)
+
+    def _wait(self, timeout):
+        """ Waits for the given time, or until terminate is requested.
+
+        The waiting is done with a single select on the wake up pipe, since Event.wait with a timeout
+        is implemented with a polling loop under Python 2.
+        """
+        try:
+            select.select([self._wakeup_r], [], [], timeout)
+        except select.error as e:
+            # interrupted by a signal
+            if e.args[0] != errno.EINTR:
+                raise
 
-                last_check = now
+    def terminate(self):
+        self._terminated.set()
+        os.write(self._wakeup_w, 'x')
 
-            if self._terminated:
-                self._log.info('terminate request detected')
-                break
 
-            time.sleep(self.TERMINATE_CHECK_PERIOD)
+def uses_stored_schedule(cfg):
+    """ Tells if the pending jobs are stored with their metadata, which is required for storing
+    their check schedule and producing reports.
+    """
+    return cfg.jobs_queue[ProcessConfiguration.Props.BACKEND] == BACKEND_SQLITE
 
-        self._log.info('worker thread terminated')
 
-    def terminate(self):
-        self._terminated = True
+def print_report(cfg):
+    """ Prints the report of the pending jobs.
+    """
+    cfg_monitor = cfg.monitor
+    stale_age = cfg_monitor[ProcessConfiguration.Props.MAX_AGE] or REPORT_STALE_AGE
+    queue = pending_jobs_queue(cfg)
+    try:
+        for line in queue_report(queue, stale_age):
+            print(line)
+    finally:
+        queue.close()
 
 
 if __name__ == '__main__':
@@ -124,6 +185,11 @@ if __name__ == '__main__':
     parser = pycstbox.cli.get_argument_parser(
         description=__doc__
     )
+    parser.add_argument(
+        '--report',
+        action='store_true',
+        help="print a report of the pending jobs and exit (requires the sqlite jobs queue backend)"
+    )
     args = parser.parse_args()
 
     pycstbox.log.set_loglevel_from_args(_logger, args)
@@ -142,7 +208,16 @@ if __name__ == '__main__':
     else:
         _logger.debug('--> %s:', process_cfg.as_dict())
 
+        if args.report:
+            if not uses_stored_schedule(process_cfg):
+                _logger.fatal('reports require the %s jobs queue backend', BACKEND_SQLITE)
+                sys.exit(1)
+            print_report(process_cfg)
+            sys.exit(0)
+
         worker = Worker(process_cfg, args.debug)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: worker.terminate())
         worker.run()
 
         _logger.info('process terminated')
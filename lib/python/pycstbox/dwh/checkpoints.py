@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Checkpoints of the events export jobs.
+
+A checkpoint keeps the archive (or the archive parts) built by a job, together with their content
+hash and the list of the parts already accepted by the server. It is stored under the id of the
+job backlog entry, so that a job which failed during the upload can be resumed by the next run
+of the export process, without extracting and compressing the events again. The checkpoint is
+discarded when the backlog entry is completed.
+
+Each checkpoint is a directory, containing the archive files and a JSON state file.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+STATE_FILE_NAME = 'checkpoint.json'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha1(path):
+    """ Returns the SHA1 hash of a file content.
+
+    :param str path: the path of the file
+    :rtype: str
+    """
+    sha1 = hashlib.sha1()
+    with file(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(HASH_BLOCK_SIZE), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class ExportCheckpoint(object):
+    """ The persisted state of an export job.
+    """
+    NAME = 'name'
+    SHA1 = 'sha1'
+    SIZE = 'size'
+    JOB_ID = 'job_id'
+
+    def __init__(self, path, dates, events_count, parts):
+        """
+        :param str path: the path of the checkpoint directory
+        :param list dates: the dates exported by the job
+        :param int events_count: the count of exported events
+        :param list parts: the archive parts, as dictionaries containing the name, the content hash,
+            the size and the server job id (None if not uploaded yet) of each one
+        """
+        self.path = path
+        self.dates = sorted(dates)
+        self.events_count = events_count
+        self.parts = parts
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a checkpoint from its directory.
+
+        :raises IOError: if the state file cannot be read
+        :raises ValueError: if the state file is not valid
+        """
+        with file(os.path.join(path, STATE_FILE_NAME), 'rt') as fp:
+            state = json.load(fp)
+        try:
+            return cls(
+                path,
+                [datetime.datetime.strptime(d, '%Y-%m-%d').date() for d in state['dates']],
+                state['events_count'],
+                state['parts']
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError('invalid checkpoint state (%s)' % e)
+
+    def save(self):
+        """ Saves the state, replacing the state file atomically.
+        """
+        state = {
+            'dates': [d.isoformat() for d in self.dates],
+            'events_count': self.events_count,
+            'parts': self.parts
+        }
+        tmp_path = os.path.join(self.path, STATE_FILE_NAME + '.tmp')
+        with file(tmp_path, 'wt') as fp:
+            json.dump(state, fp)
+        os.rename(tmp_path, os.path.join(self.path, STATE_FILE_NAME))
+
+    def part_path(self, name):
+        """ Returns the path of an archive part file. """
+        return os.path.join(self.path, name)
+
+    def is_valid_for(self, dates):
+        """ Tells if the checkpoint can be used for resuming a job, i.e. if it covers the same dates,
+        and if its archive files are still there with their original content.
+
+        :param list dates: the dates exported by the job
+        :rtype: bool
+        """
+        if sorted(dates) != self.dates:
+            return False
+        for part in self.parts:
+            path = self.part_path(part[self.NAME])
+            if part[self.JOB_ID] is not None:
+                # already uploaded, and thus not needed anymore
+                continue
+            if not os.path.isfile(path) or os.path.getsize(path) != part[self.SIZE] \
+                    or file_sha1(path) != part[self.SHA1]:
+                return False
+        return True
+
+    def is_uploaded(self, name):
+        return self._part(name)[self.JOB_ID] is not None
+
+    def set_uploaded(self, name, job_id):
+        """ Records that a part has been accepted by the server, and saves the state.
+
+        The part file is removed, since it will not be needed anymore.
+
+        :param str name: the part name
+        :param job_id: the id of the server job processing the part
+        """
+        self._part(name)[self.JOB_ID] = job_id
+        self.save()
+        path = self.part_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _part(self, name):
+        for part in self.parts:
+            if part[self.NAME] == name:
+                return part
+        raise KeyError(name)
+
+
+class ExportCheckpoints(object):
+    """ The checkpoints of the export jobs, keyed by the id of their backlog entry.
+    """
+    DEFAULT_PATH = "/var/db/cstbox/dwh-checkpoints"
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param str path: the path of the directory the checkpoints are stored in. Will be
+            created if not present
+        """
+        if not path:
+            raise ValueError("path argument cannot be empty")
+
+        self._path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def job_dir(self, job_id):
+        """ Returns the directory of the checkpoint of a job, creating it if needed.
+
+        This is where the archive files of the job must be created.
+        """
+        path = os.path.join(self._path, str(job_id))
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        return path
+
+    def get(self, job_id):
+        """ Returns the checkpoint of a job.
+
+        :returns: the checkpoint, or None if the job has no (readable) checkpoint
+        :rtype: ExportCheckpoint
+        """
+        path = os.path.join(self._path, str(job_id))
+        if not os.path.exists(os.path.join(path, STATE_FILE_NAME)):
+            return None
+        try:
+            return ExportCheckpoint.load(path)
+        except (IOError, ValueError):
+            return None
+
+    def create(self, job_id, dates, events_count, parts):
+        """ Creates and saves the checkpoint of a job, once its archive parts have been built in its
+        directory (see :meth:`job_dir`).
+
+        :param job_id: the id of the job backlog entry
+        :param list dates: the dates exported by the job
+        :param int events_count: the count of exported events
+        :param list parts: the names of the archive parts
+        :rtype: ExportCheckpoint
+        """
+        path = self.job_dir(job_id)
+        checkpoint = ExportCheckpoint(path, dates, events_count, [
+            {
+                ExportCheckpoint.NAME: name,
+                ExportCheckpoint.SHA1: file_sha1(os.path.join(path, name)),
+                ExportCheckpoint.SIZE: os.path.getsize(os.path.join(path, name)),
+                ExportCheckpoint.JOB_ID: None
+            }
+            for name in parts
+        ])
+        checkpoint.save()
+        return checkpoint
+
+    def discard(self, job_id):
+        """ Removes the checkpoint of a job, and its archive files if any. """
+        path = os.path.join(self._path, str(job_id))
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def purge(self, keep):
+        """ Removes the checkpoints of the jobs which are not in a given collection.
+
+        :param keep: the ids of the jobs which checkpoints are kept
+        :returns: the ids of the removed checkpoints
+        :rtype: list
+        """
+        keep = set(str(job_id) for job_id in keep)
+        removed = [job_id for job_id in self.job_ids() if job_id not in keep]
+        for job_id in removed:
+            self.discard(job_id)
+        return removed
+
+    def job_ids(self):
+        """ Returns the ids of the jobs having a checkpoint, whatever its state is. """
+        return sorted(
+            name for name in os.listdir(self._path)
+            if os.path.isdir(os.path.join(self._path, name))
+        )
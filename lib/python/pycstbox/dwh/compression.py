@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Configurable compression of the uploaded archives.
+
+The standard :class:`zipfile.ZipFile` always compresses entries at the default zlib level, in the
+calling thread. :class:`CompressingZipFile` allows choosing the compression level, and compressing
+the entries in parallel in a pool of worker processes, while producing a standard ZIP archive.
+"""
+
+import collections
+import multiprocessing
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+METHOD_DEFLATE = 'deflate'
+METHOD_STORED = 'stored'
+METHODS = {
+    METHOD_DEFLATE: zipfile.ZIP_DEFLATED,
+    METHOD_STORED: zipfile.ZIP_STORED
+}
+""" Configurable compression methods, and the corresponding ZIP ones """
+
+DEFAULT_LEVEL = 6
+""" Default compression level (the zlib default one) """
+
+
+def _compress(args):
+    """ Compresses an entry content (run in the worker processes).
+
+    :param tuple args: the entry content, the compression method and level
+    :returns: a tuple containing the CRC of the content and the compressed content
+    """
+    data, compression, level = args
+    crc = zlib.crc32(data) & 0xffffffff
+    if compression == zipfile.ZIP_DEFLATED:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = co.compress(data) + co.flush()
+    return crc, data
+
+
+class _Done(object):
+    """ Result of an entry compressed in the calling process, mimicking an AsyncResult """
+    def __init__(self, value):
+        self._value = value
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self._value
+
+
+class CompressingZipFile(zipfile.ZipFile):
+    """ Write-only ZIP archive, with a configurable compression level, and optionally compressing
+    its entries in parallel.
+
+    When several workers are used, the entries added with :meth:`writestr` or :meth:`write` are
+    compressed by a pool of worker processes, and are written in the archive in the order they have
+    been added, as soon as they are compressed. The count of entries waiting to be written is
+    bounded, so that the memory usage stays under control.
+    """
+    def __init__(self, file, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=False,
+                 level=DEFAULT_LEVEL, workers=1):
+        """
+        :param file: the path of the archive, or a file-like object
+        :param str mode: the opening mode (only 'w' is supported)
+        :param int compression: the compression method of the entries
+        :param bool allowZip64: see :class:`zipfile.ZipFile`
+        :param int level: the compression level (1 to 9) of deflated entries
+        :param int workers: the count of worker processes compressing the entries (no worker
+            process is used if less than 2)
+        """
+        if mode != 'w':
+            raise ValueError('only write mode is supported')
+        self._level = level
+        self._workers = workers
+        self._pool = None
+        self._pending = collections.deque()
+        zipfile.ZipFile.__init__(self, file, mode, compression=compression, allowZip64=allowZip64)
+
+    def writestr(self, zinfo_or_arcname, bytes, compress_type=None):
+        if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo = zipfile.ZipInfo(filename=zinfo_or_arcname, date_time=time.localtime(time.time())[:6])
+            zinfo.external_attr = 0o600 << 16     # ?rw-------
+            zinfo.compress_type = self.compression
+        else:
+            zinfo = zinfo_or_arcname
+        if compress_type is not None:
+            zinfo.compress_type = compress_type
+
+        if not self.fp:
+            raise RuntimeError("Attempt to write to ZIP archive that was already closed")
+
+        zinfo.file_size = len(bytes)
+        args = (bytes, zinfo.compress_type, self._level)
+        if self._workers > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self._workers)
+            result = self._pool.apply_async(_compress, (args,))
+        else:
+            result = _Done(_compress(args))
+        self._pending.append((zinfo, result))
+
+        self._write_pending(max_pending=2 * self._workers)
+
+    def write(self, filename, arcname=None, compress_type=None):
+        """ Adds a regular file to the archive.
+        """
+        st = os.stat(filename)
+        zinfo = zipfile.ZipInfo(
+            filename=arcname or os.path.basename(filename),
+            date_time=time.localtime(st.st_mtime)[:6]
+        )
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+        zinfo.compress_type = self.compression if compress_type is None else compress_type
+        with open(filename, 'rb') as fp:
+            self.writestr(zinfo, fp.read())
+
+    def _write_pending(self, max_pending=0):
+        """ Writes the compressed pending entries, in order, waiting for them if more than
+        ''max_pending'' entries are waiting.
+        """
+        pending = self._pending
+        while pending and (len(pending) > max_pending or pending[0][1].ready()):
+            zinfo, result = pending.popleft()
+            crc, data = result.get()
+            self._write_entry(zinfo, crc, data)
+
+    def _write_entry(self, zinfo, crc, data):
+        """ Writes an already compressed entry, the same way as :meth:`zipfile.ZipFile.writestr` does.
+        """
+        zinfo.header_offset = self.fp.tell()
+        self._writecheck(zinfo)
+        self._didModify = True
+        zinfo.CRC = crc
+        zinfo.compress_size = len(data)
+        zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+        if zip64 and not self._allowZip64:
+            raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+        self.fp.write(zinfo.FileHeader(zip64))
+        self.fp.write(data)
+        if zinfo.flag_bits & 0x08:
+            # Write CRC and file sizes after the file data
+            fmt = '<LLQQ' if zip64 else '<LLLL'
+            self.fp.write(struct.pack(fmt, zipfile._DD_SIGNATURE, zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        self.fp.flush()
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
+
+    def close(self):
+        """ Writes the remaining entries and closes the archive.
+
+        The worker processes are stopped in any case.
+        """
+        try:
+            if self.fp is not None:
+                self._write_pending()
+        finally:
+            self._pending.clear()
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+        zipfile.ZipFile.close(self)
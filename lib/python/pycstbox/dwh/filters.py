@@ -41,13 +41,19 @@ The specificity of each export type are detailed in the respective class documen
 """
 
 import os
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import itertools
 import json
+import array
+import calendar
+import tempfile
+import threading
 
 from pycstbox.events import DataKeys
+from pycstbox import devcfg
 from pycstbox.devcfg import Metadata
 from pycstbox.dwh import DWHException
+from pycstbox.dwh.formatters import PointTimestampFormatter, series_value_encoder, BOOL_TO_NUM
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
@@ -59,7 +65,7 @@ DTFMT_HEADER = "%Y-%m-%dT%H:%M:%SZ"
 DTFMT_SERIES_FNAME = "%y%m%d%H%M%S"
 """ Format for the time stamp in time series file names"""
 DTFMT_POINT = "%Y-%m-%dT%H:%M:%SZ"
-""" Time stamp format for series points"""
+""" Time stamp format for series points (produced by :class:`PointTimestampFormatter`)"""
 
 SERIES_NAME_PATTERN = "%s_%s"
 """Format for the names of the series"""
@@ -68,6 +74,206 @@ SERIES_FILENAME_PATTERN = "%s.tsv"
 
 LINE_END = '\n'
 
+DEFAULT_MAX_OPEN_FILES = 256
+""" Default maximum count of series files simultaneously opened during an export"""
+DEFAULT_WRITE_BUFFER_SIZE = 64 * 1024
+""" Default size of the buffer holding the records of a series which file is not currently opened"""
+DEFAULT_BUCKETS_MEMORY_LIMIT = 32 * 1024 * 1024
+""" Default approximate memory size above which series buckets are spilled to disk"""
+
+_POINT_MEMORY_COST = 48
+""" Approximate memory cost of a bucketed point, not including the length of its value"""
+
+
+class SeriesWritersPool(object):
+    """ A pool of series output files, which limits the count of simultaneously opened ones.
+
+    Opened files are managed in a LRU way: when the limit is reached, the least recently written
+    one is closed to make room for the next one. Records written to a series which file is not
+    currently opened are buffered, and the file is re-opened in append mode only when its buffer is
+    full, or when the pool is closed.
+    """
+    def __init__(self, max_open=DEFAULT_MAX_OPEN_FILES, buffer_size=DEFAULT_WRITE_BUFFER_SIZE):
+        """
+        :param int max_open: the maximum count of simultaneously opened files
+        :param int buffer_size: the size of the buffer above which the records of a closed series
+            are flushed to its file
+
+        :raises ValueError: if max_open is not a positive integer
+        """
+        if max_open < 1:
+            raise ValueError('max_open must be a positive integer')
+
+        self._max_open = max_open
+        self._buffer_size = buffer_size
+        self._opened = OrderedDict()
+        self._buffers = {}
+        self._buffered_sizes = {}
+        self._created = set()
+
+    def write(self, path, data):
+        """ Writes data to the file of a series.
+
+        :param str path: the path of the series file
+        :param str data: the data to be written
+        """
+        try:
+            outfile = self._opened.pop(path)
+        except KeyError:
+            buf = self._buffers.setdefault(path, [])
+            buf.append(data)
+            size = self._buffered_sizes.get(path, 0) + len(data)
+            if len(self._opened) >= self._max_open and size < self._buffer_size:
+                self._buffered_sizes[path] = size
+                return
+
+            outfile = self._open(path)
+            self._flush_buffer(path, outfile)
+        else:
+            outfile.write(data)
+
+        # (re)insert the file as the most recently used one
+        self._opened[path] = outfile
+
+    def close(self):
+        """ Flushes pending buffers and closes all the files.
+        """
+        try:
+            for path in self._buffers.keys():
+                outfile = self._opened.pop(path, None) or self._open(path)
+                self._flush_buffer(path, outfile)
+                self._opened[path] = outfile
+        finally:
+            for outfile in self._opened.itervalues():
+                outfile.close()
+            self._opened.clear()
+
+    def _open(self, path):
+        """ Opens the file of a series, closing the least recently used one if the limit is reached.
+
+        The file is truncated the first time it is opened, and opened in append mode afterwards.
+        """
+        if len(self._opened) >= self._max_open:
+            _, lru_file = self._opened.popitem(last=False)
+            lru_file.close()
+
+        if path in self._created:
+            return file(path, 'at')
+        else:
+            self._created.add(path)
+            return file(path, 'wt')
+
+    def _flush_buffer(self, path, outfile):
+        outfile.write(''.join(self._buffers.pop(path)))
+        self._buffered_sizes.pop(path, None)
+
+    @property
+    def opened_count(self):
+        """ The count of currently opened files """
+        return len(self._opened)
+
+
+class SeriesBuckets(object):
+    """ Per-series buckets, accumulating the points of an events sequence so that each series
+    can be emitted as a whole.
+
+    Points are stored in compact form: time stamps as an array of seconds since the epoch, and
+    values as their already formatted representation. When the approximate memory used by the
+    buckets exceeds the configured limit, their content is formatted and spilled to a temporary
+    file, and the buckets are emptied.
+
+    The content produced for each series is identical to the records written by the
+    :class:`EventsExportFilter` interleaved export.
+    """
+    def __init__(self, memory_limit=DEFAULT_BUCKETS_MEMORY_LIMIT, spill_dir=None):
+        """
+        :param int memory_limit: the approximate memory size above which buckets are spilled
+        :param str spill_dir: the directory in which the spill file is created (system default
+            temp directory if not provided)
+        """
+        self._memory_limit = memory_limit
+        self._spill_dir = spill_dir
+        self._series = OrderedDict()
+        self._memory = 0
+        self._spill_file = None
+        self._spilled = {}
+        self._ts_formatter = PointTimestampFormatter()
+
+    def add(self, series_name, timestamp, value):
+        """ Adds a point to a series bucket.
+
+        :param str series_name: the name of the series
+        :param datetime.datetime timestamp: the time stamp of the point
+        :param str value: the formatted value of the point
+        """
+        try:
+            timestamps, values = self._series[series_name]
+        except KeyError:
+            timestamps, values = self._series[series_name] = (array.array('d'), [])
+
+        timestamps.append(calendar.timegm(timestamp.timetuple()))
+        values.append(value)
+
+        self._memory += _POINT_MEMORY_COST + len(value)
+        if self._memory > self._memory_limit:
+            self.spill()
+
+    def spill(self):
+        """ Moves the current content of the buckets to the spill file.
+        """
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(dir=self._spill_dir)
+
+        spill_file = self._spill_file
+        spill_file.seek(0, os.SEEK_END)
+        for series_name, (timestamps, values) in self._series.iteritems():
+            if not values:
+                continue
+            data = self._format_points(timestamps, values)
+            self._spilled.setdefault(series_name, []).append((spill_file.tell(), len(data)))
+            spill_file.write(data)
+            self._series[series_name] = (array.array('d'), [])
+
+        self._memory = 0
+
+    def iter_series(self):
+        """ Iterates over the series, in the order of their first point.
+
+        :returns: an iterator of tuples containing the series name and its full content
+        """
+        for series_name, (timestamps, values) in self._series.iteritems():
+            parts = []
+            for offset, length in self._spilled.get(series_name, []):
+                self._spill_file.seek(offset)
+                parts.append(self._spill_file.read(length))
+            parts.append(self._format_points(timestamps, values))
+            yield series_name, ''.join(parts)
+
+    def close(self):
+        """ Releases the resources used by the buckets.
+        """
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._series.clear()
+        self._spilled.clear()
+        self._memory = 0
+
+    def _format_points(self, timestamps, values):
+        format_ts = self._ts_formatter.format_epoch
+        return ''.join(
+            "%s\t%s%s" % (format_ts(ts), value, LINE_END)
+            for ts, value in itertools.izip(timestamps, values)
+        )
+
+    @property
+    def spilled(self):
+        """ True if the buckets have been spilled to disk at least once """
+        return self._spill_file is not None
+
+    def __len__(self):
+        return len(self._series)
+
 
 class EventsExportFilter(object):
     """ Filter for exporting an event sequence as a collection of variable series.
@@ -78,11 +284,20 @@ class EventsExportFilter(object):
       - one record per series point
       - each record contains the value time stamp and the value itself.
     """
-    def __init__(self, site_code, contact=None, prefix_with_type=True):
+    def __init__(self, site_code, contact=None, prefix_with_type=True, max_open_files=DEFAULT_MAX_OPEN_FILES,
+                 group_by_series=False, buckets_memory_limit=DEFAULT_BUCKETS_MEMORY_LIMIT, var_types=None):
         """
         :param str site_code: (mandatory) the code of the site, as provided by DataWareHouse
         :param str contact: email of the contact person for process feedback sending
         :param boolean prefix_with_type: True for prefixing the series name with the variable type
+        :param int max_open_files: the maximum count of series files simultaneously opened while
+            exporting to a directory
+        :param boolean group_by_series: True for bucketing the events per series before emitting
+            each series in a single write, instead of writing events as they come
+        :param int buckets_memory_limit: the approximate memory size above which buckets are
+            spilled to disk when events are grouped by series
+        :param var_types: the collection of the variable types to be exported. Events of other
+            types are skipped. All events are exported if not provided.
 
         :raises ValueError: if site id not provided
         """
@@ -92,6 +307,10 @@ class EventsExportFilter(object):
         self._site_code = site_code
         self._contact = contact
         self._prefix_with_type = prefix_with_type
+        self._max_open_files = max_open_files
+        self._group_by_series = group_by_series
+        self._buckets_memory_limit = buckets_memory_limit
+        self._var_types = frozenset(var_types) if var_types is not None else None
 
     def export_events(self, events, to_dir='/tmp'):
         """ Export a list of CSTBox events as the corresponding set of
@@ -113,38 +332,129 @@ class EventsExportFilter(object):
         if not os.access(to_dir, os.W_OK | os.X_OK):
             raise ValueError('cannot write to : %s' % to_dir)
 
+        if self._group_by_series:
+            return self._export_grouped_events(events, to_dir)
+
+        events = self._selected_events(events)
+
         series_files = {}
         created_files = []
         evt_count = 0
+        writers = SeriesWritersPool(max_open=self._max_open_files)
+        format_ts = PointTimestampFormatter().format_datetime
         try:
             for evt in events:
-                if self._prefix_with_type:
-                    series_name = SERIES_NAME_PATTERN % (evt.var_type, evt.var_name)
-                else:
-                    series_name = evt.var_name
+                series_name = self._series_name(evt)
+                value = evt.data[DataKeys.VALUE]
                 try:
-                    outfile = series_files[series_name]
+                    outpath, encode = series_files[series_name]
                 except KeyError:
                     outpath = os.path.join(
                         to_dir,
                         self.series_filename(series_name)
                     )
-
-                    outfile = file(outpath, 'wt')
-                    series_files[series_name] = outfile
+                    encode = series_value_encoder(value)
+                    series_files[series_name] = (outpath, encode)
                     created_files.append(outpath)
 
                 # emit the event
-                value = maybe_boolean(str(evt.data[DataKeys.VALUE]))
-                outfile.write("%s\t%s%s" % (evt.timestamp.strftime(DTFMT_POINT), value, LINE_END))
+                writers.write(outpath, "%s\t%s%s" % (format_ts(evt.timestamp), encode(value), LINE_END))
                 evt_count += 1
 
         finally:
-            for f in series_files.itervalues():
-                f.close()
+            writers.close()
 
         return evt_count, created_files
 
+    def export_events_to_archive(self, events, archive, spill_dir=None):
+        """ Export a list of CSTBox events directly as entries of a ZIP archive, without creating
+        any series file.
+
+        The points of each series are accumulated in per-series buckets (see
+        :class:`SeriesBuckets`) and written as a single archive entry, named the same way as the
+        series file produced by :meth:`export_events`. The memory used by the buckets is bounded
+        by the `buckets_memory_limit` of the filter, their content being spilled to a temporary
+        file above it.
+
+        :param list events: the list of events to be exported
+        :param zipfile.ZipFile archive: the archive to which entries are added (must be opened
+            for writing)
+        :param str spill_dir: the directory in which buckets are spilled if needed
+        :returns: a tuple containing the number of processed events, and the list of the names
+            of the created archive entries.
+        :rtype: tuple
+        """
+        entry_names = []
+        evt_count, buckets = self.bucket_events(events, spill_dir=spill_dir)
+        try:
+            for series_name, data in buckets.iter_series():
+                entry_name = self.series_filename(series_name)
+                archive.writestr(entry_name, data)
+                entry_names.append(entry_name)
+        finally:
+            buckets.close()
+
+        return evt_count, entry_names
+
+    def bucket_events(self, events, spill_dir=None):
+        """ Accumulates a list of CSTBox events in per-series buckets.
+
+        :param list events: the list of events to be bucketed
+        :param str spill_dir: the directory in which buckets are spilled if needed
+        :returns: a tuple containing the number of processed events, and the
+            :class:`SeriesBuckets` instance holding the series. It is up to the caller to close it.
+        :rtype: tuple
+        """
+        buckets = SeriesBuckets(memory_limit=self._buckets_memory_limit, spill_dir=spill_dir)
+        encoders = {}
+        evt_count = 0
+        try:
+            for evt in self._selected_events(events):
+                series_name = self._series_name(evt)
+                value = evt.data[DataKeys.VALUE]
+                try:
+                    encode = encoders[series_name]
+                except KeyError:
+                    encode = encoders[series_name] = series_value_encoder(value)
+                buckets.add(series_name, evt.timestamp, encode(value))
+                evt_count += 1
+        except:
+            buckets.close()
+            raise
+
+        return evt_count, buckets
+
+    def _export_grouped_events(self, events, to_dir):
+        created_files = []
+        evt_count, buckets = self.bucket_events(events, spill_dir=to_dir)
+        try:
+            for series_name, data in buckets.iter_series():
+                outpath = os.path.join(to_dir, self.series_filename(series_name))
+                with file(outpath, 'wt') as outfile:
+                    outfile.write(data)
+                created_files.append(outpath)
+        finally:
+            buckets.close()
+
+        return evt_count, created_files
+
+    def _selected_events(self, events):
+        """ Returns the events of the exported variable types, from the passed ones.
+        """
+        if self._var_types is None:
+            return events
+
+        var_types = self._var_types
+        return (evt for evt in events if evt.var_type in var_types)
+
+    def _series_name(self, evt):
+        """ Returns the name of the series an event belongs to.
+        """
+        if self._prefix_with_type:
+            return SERIES_NAME_PATTERN % (evt.var_type, evt.var_name)
+        else:
+            return evt.var_name
+
     @staticmethod
     def series_filename(varname):
         """ Returns the DataWareHouse name of the file containing the data for a given series and export
@@ -155,6 +465,68 @@ class EventsExportFilter(object):
         return SERIES_FILENAME_PATTERN % varname
 
 
+def _device_metadata_path(devtype):
+    """ Returns the path of the metadata file of a device type (ex: ``x2d:d10`` -> ``<home>/x2d.d/d10``)
+    or of a coordinator type (ex: ``x2d`` -> ``<home>/x2d``).
+    """
+    coord_type, _, dev_type = devtype.partition(':')
+    if dev_type:
+        return os.path.join(devcfg.METADATA_HOME, coord_type + '.d', dev_type)
+    return os.path.join(devcfg.METADATA_HOME, coord_type)
+
+
+class DeviceMetadataCache(object):
+    """ Process-wide cache of the devices metadata, keyed by the device type.
+
+    A cached entry is reloaded if the modification time of the corresponding metadata file has
+    changed since it was loaded. Entries which file cannot be found are kept until the cache is
+    cleared.
+
+    It is thread safe.
+    """
+    def __init__(self, loader=None):
+        """
+        :param loader: the function loading the metadata of a device type (default:
+        :meth:`pycstbox.devcfg.Metadata.device`)
+        """
+        self._loader = loader
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_mtime(devtype):
+        try:
+            return os.stat(_device_metadata_path(devtype)).st_mtime
+        except (OSError, TypeError, AttributeError):
+            return None
+
+    def get(self, devtype):
+        """ Returns the metadata of a device type, loading them if not yet cached or if modified.
+
+        :param str devtype: the device type
+        """
+        mtime = self._file_mtime(devtype)
+        with self._lock:
+            entry = self._entries.get(devtype)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        devmeta = self._loader(devtype) if self._loader else Metadata.device(devtype)
+        with self._lock:
+            self._entries[devtype] = (mtime, devmeta)
+        return devmeta
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+devices_metadata_cache = DeviceMetadataCache()
+""" The cache shared by default by all the variable definitions exports of the process """
+
+
 class VariableDefsExportFilter(object):
     """ Filter for exporting the variable definitions corresponding to a device
     network configuration.
@@ -215,13 +587,14 @@ class VariableDefsExportFilter(object):
     The definition file contains the JSON representation of the list of individual definitions, each one
     being modeled as a dictionary keyed by the above listed property names.
     """
-    def __init__(self, site_code, contact=None, vars_metadata=None):
+    def __init__(self, site_code, contact=None, vars_metadata=None, devices_metadata=None):
         """
         :param str site_code: (mandatory) the id of the site (aka "system id" in CSTBox context)
         :param str contact: email of the contact person for process feedback sending
         :param dict vars_metadata: an optional dictionary containing the variables matadata, specifying additional
         information such as the label, the value domain validity, the derivative domain validity,... The key of the
         dictionary must be the name of the variable
+        :param DeviceMetadataCache devices_metadata: the devices metadata cache (default: the process-wide one)
         :raises ValueError: if site id not provided
         """
         if not site_code:
@@ -229,6 +602,7 @@ class VariableDefsExportFilter(object):
 
         self._site_code = site_code
         self._contact = contact
+        self._devices_metadata = devices_metadata if devices_metadata is not None else devices_metadata_cache
         if vars_metadata:
             if not isinstance(vars_metadata, dict):
                 raise TypeError('variables metadata must be a dictionary')
@@ -337,9 +711,9 @@ class VariableDefsExportFilter(object):
                     None
                 )
 
-        # cache for devices metadata
+        # local cache for devices metadata, avoiding to check the process-wide one for each device
         devmetas = {}
-        known_vars = []
+        known_vars = set()
 
         def _add_definition(varname, output_meta):
             if self._vars_metadata and varname not in self._vars_metadata:
@@ -348,7 +722,7 @@ class VariableDefsExportFilter(object):
             if varname in known_vars:
                 raise DWHException('duplicated variable : %s' % varname)
 
-            known_vars.append(varname)
+            known_vars.add(varname)
 
             vartype = output_meta['__vartype__']
             varunit = output_meta.get('__varunits__')
@@ -361,8 +735,7 @@ class VariableDefsExportFilter(object):
             try:
                 devmeta = devmetas[devtype]
             except KeyError:
-                devmeta = Metadata.device(devtype)
-                devmetas[devtype] = devmeta
+                devmeta = devmetas[devtype] = self._devices_metadata.get(devtype)
 
             meta_pdefs = devmeta['pdefs']
             if hasattr(cfg, 'outputs'):
@@ -403,8 +776,6 @@ class VariableDefinition(namedtuple(
     def as_dict(self):
         return self.__dict__
 
-_BOOL_TO_NUM = {'true': '1', 'false': '0'}
-
 
 def maybe_boolean(value):
     """ If the value is the string representation of a boolean, return the
@@ -415,4 +786,4 @@ def maybe_boolean(value):
     :returns: boolean equivalent if boolean parameter passed
     :rtype: str
     """
-    return _BOOL_TO_NUM.get(value.lower(), value)
+    return BOOL_TO_NUM.get(value.lower(), value)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Fast formatting helpers for the series export hot loop.
+
+The output of these formatters is strictly identical to the one obtained with the generic
+formatting functions (``strftime``, ``maybe_boolean(str(value))``,...) they replace.
+"""
+
+import time
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+_SECS_PER_DAY = 24 * 3600
+
+_HOURS = ['%02d:' % h for h in xrange(24)]
+""" Pre-formatted hours part of the time stamps"""
+_MINUTES_SECONDS = ['%02d:%02dZ' % divmod(s, 60) for s in xrange(3600)]
+""" Pre-formatted minutes and seconds part of the time stamps, indexed by the second in the hour"""
+
+
+class PointTimestampFormatter(object):
+    """ Formatter of series points time stamps, producing the same result as
+    ``strftime(DTFMT_POINT)``.
+
+    The date part of the time stamp is formatted once per day and cached, and the time part is
+    assembled from pre-formatted tables indexed by the time fields. Since the points of an export
+    usually belong to the same day, the costly formatting is done only once in most cases.
+
+    Instances are not thread safe.
+    """
+    def __init__(self):
+        self._year = self._month = self._day = None
+        self._prefix = None
+        self._epoch_day = None
+        self._epoch_prefix = None
+
+    def format_datetime(self, dt):
+        """ Formats a datetime time stamp.
+
+        :param datetime.datetime dt: the time stamp
+        :rtype: str
+        """
+        if dt.day != self._day or dt.month != self._month or dt.year != self._year:
+            self._year, self._month, self._day = dt.year, dt.month, dt.day
+            self._prefix = '%04d-%02d-%02dT' % (dt.year, dt.month, dt.day)
+        return self._prefix + _HOURS[dt.hour] + _MINUTES_SECONDS[dt.minute * 60 + dt.second]
+
+    def format_epoch(self, ts):
+        """ Formats a time stamp expressed as seconds since the epoch (UTC).
+
+        :param ts: the time stamp (any fractional part is ignored)
+        :rtype: str
+        """
+        day, secs = divmod(int(ts), _SECS_PER_DAY)
+        if day != self._epoch_day:
+            self._epoch_day = day
+            self._epoch_prefix = time.strftime('%Y-%m-%dT', time.gmtime(day * _SECS_PER_DAY))
+        hour, secs = divmod(secs, 3600)
+        return self._epoch_prefix + _HOURS[hour] + _MINUTES_SECONDS[secs]
+
+
+BOOL_TO_NUM = {'true': '1', 'false': '0'}
+""" Numeric representation of the boolean strings """
+
+
+def _encode_bool(value):
+    return '1' if value else '0'
+
+
+def _encode_string(value):
+    return BOOL_TO_NUM.get(value.lower(), value)
+
+
+def _encode_other(value):
+    return _encode_string(str(value))
+
+# numbers representations cannot be confused with booleans ones, so that their str() is enough
+_ENCODERS = {
+    bool: _encode_bool,
+    int: str,
+    long: str,
+    float: str,
+    str: _encode_string
+}
+
+
+def encode_value(value):
+    """ Returns the representation of a point value, booleans (and their string representations)
+    being converted to their integer equivalent.
+
+    :param value: the value
+    :rtype: str
+    """
+    return _ENCODERS.get(type(value), _encode_other)(value)
+
+
+def series_value_encoder(sample):
+    """ Returns a value encoder specialized for the type of the values of a series, which is
+    supposed to be constant.
+
+    The returned encoder falls back to :func:`encode_value` for any value of another type, so that
+    the result is always correct.
+
+    :param sample: a value of the series, used to select the encoder
+    :returns: the encoder, to be called with the value as sole argument
+    """
+    value_type = type(sample)
+    encoder = _ENCODERS.get(value_type)
+    if encoder is None:
+        return encode_value
+
+    def _encode(value):
+        if type(value) is value_type:
+            return encoder(value)
+        return encode_value(value)
+
+    return _encode
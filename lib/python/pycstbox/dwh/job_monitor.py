@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Monitoring of the series upload jobs processed by the DataWareHouse server.
+
+Once uploaded, series archives are processed asynchronously by the server, which returns the id of
+the corresponding job. The ids of pending jobs are stored in the :class:`PendingJobsQueue`, and their
+status is queried periodically until they are completed, either successfully or not.
+"""
+
+import os
+import json
+import heapq
+import time
+import itertools
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from pycstbox.log import Loggable
+from pycstbox.dwh.process import ProcessConfiguration, server_session
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+JOB_STATUS = {
+    1: "in process",
+    0: "completed",
+    -1: "bad file format",
+    -2: "missing variable name",
+    -3: "unknown variable name",
+    -4: "database connection failure",
+    -5: "incoherent data error",
+    -6: "invalid data"
+}
+""" Meaning of the job status codes returned by the server """
+
+STATUS_COMPLETED = 0
+STATUS_IN_PROCESS = 1
+
+_Props = ProcessConfiguration.Props
+
+
+class JobStatus(namedtuple('JobStatus', 'job_id code message')):
+    """ The status of a job, as returned by the server.
+
+    The code is None if the status could not be obtained, the message giving the reason in this case.
+    """
+    __slots__ = ()
+
+    @property
+    def is_final(self):
+        """ True if the job is completed, successfully or not """
+        return self.code is not None and self.code <= STATUS_COMPLETED
+
+
+class JobStatusPoller(Loggable):
+    """ Queries the status of upload jobs, concurrently if configured so.
+
+    If the URL of the batch job status API is configured, the statuses are queried by batches of
+    jobs, which are sent as a JSON list in the body of a POST request. The server replies with a
+    JSON object, containing the status of each job keyed by its id, in the same form as the one
+    returned by the single job API. If the server replies that the batch API is not supported, the
+    poller falls back for good to one request per job.
+    """
+    #: reply status codes telling that the batch API is not supported
+    BATCH_UNSUPPORTED = (404, 405, 501)
+
+    def __init__(self, cfg):
+        """
+        :param ProcessConfiguration cfg: configuration data
+        """
+        Loggable.__init__(self, logname='job-poller')
+
+        cfg_server = cfg[_Props.SERVER]
+        cfg_auth = cfg_server.get(_Props.AUTH)
+        cfg_monitor = cfg[_Props.MONITOR]
+        cfg_urls = cfg[_Props.API_URLS]
+
+        self._concurrency = cfg_monitor[_Props.CONCURRENCY]
+        self._batch_size = cfg_monitor[_Props.BATCH_SIZE]
+        self._session = server_session(cfg, min_pool_size=self._concurrency)
+        self._timeout = (cfg_server[_Props.CONNECT_TIMEOUT], cfg_monitor[_Props.REQUEST_TIMEOUT])
+        self._auth = (cfg_auth[_Props.LOGIN], cfg_auth[_Props.PASSWORD]) if cfg_auth else None
+        self._url_template = cfg_urls[_Props.JOB_STATUS]
+        self._url_parms = {
+            'host': cfg_server[_Props.HOST],
+            'site': cfg[_Props.SITE_CODE]
+        }
+        batch_url_template = cfg_urls.get(_Props.JOBS_STATUS)
+        self._batch_url = batch_url_template % self._url_parms if batch_url_template else None
+        self._pool = None
+
+    @property
+    def batch_mode(self):
+        """ True if the statuses are queried by batches """
+        return self._batch_url is not None
+
+    def job_status(self, job_id):
+        """ Queries the status of a job.
+
+        Communication errors are logged and reported in the returned status, not raised.
+
+        :param str job_id: the job id
+        :rtype: JobStatus
+        """
+        url = self._url_template % dict(self._url_parms, job_id=job_id)
+        self.log_debug('requesting status of job %s', job_id)
+        try:
+            resp = self._session.get(url=url, auth=self._auth, timeout=self._timeout)
+        except IOError as e:
+            self.log_error('status request failed for job %s : %s', job_id, e)
+            return JobStatus(job_id, None, str(e))
+
+        if not resp.ok:
+            self.log_error("server replied with : %d - %s", resp.status_code, resp.reason)
+            return JobStatus(job_id, None, '%d - %s' % (resp.status_code, resp.reason))
+
+        self.log_debug('got reply : %s', resp.text)
+        try:
+            reply = json.loads(resp.text)
+        except ValueError:
+            reply = None
+        return self._decode_status(job_id, reply, resp.text)
+
+    def jobs_status(self, job_ids):
+        """ Queries the status of a batch of jobs, using the batch API if available.
+
+        Communication errors are logged and reported in the returned statuses, not raised.
+
+        :param list job_ids: the job ids
+        :returns: the list of the job statuses, in the same order as the ids
+        """
+        if self._batch_url is not None:
+            self.log_debug('requesting status of jobs %s', job_ids)
+            try:
+                resp = self._session.post(
+                    url=self._batch_url, data=json.dumps(job_ids), headers={'Content-Type': 'application/json'},
+                    auth=self._auth, timeout=self._timeout
+                )
+            except IOError as e:
+                self.log_error('batch status request failed : %s', e)
+                return [JobStatus(job_id, None, str(e)) for job_id in job_ids]
+
+            if resp.status_code in self.BATCH_UNSUPPORTED:
+                # concurrent batches can all get here, but the fallback is to be reported once
+                if self._batch_url is not None:
+                    self.log_warn('batch status API not supported by server (%d - %s) => querying jobs one by one',
+                                     resp.status_code, resp.reason)
+                    self._batch_url = None
+
+            elif not resp.ok:
+                self.log_error("server replied with : %d - %s", resp.status_code, resp.reason)
+                message = '%d - %s' % (resp.status_code, resp.reason)
+                return [JobStatus(job_id, None, message) for job_id in job_ids]
+
+            else:
+                self.log_debug('got reply : %s', resp.text)
+                try:
+                    replies = json.loads(resp.text)
+                    if not isinstance(replies, dict):
+                        raise ValueError()
+                except ValueError:
+                    self.log_error('invalid batch reply : %s', resp.text)
+                    return [JobStatus(job_id, None, 'invalid reply') for job_id in job_ids]
+
+                return [self._decode_status(job_id, replies.get(job_id), resp.text) for job_id in job_ids]
+
+        return [self.job_status(job_id) for job_id in job_ids]
+
+    def _decode_status(self, job_id, reply, text):
+        try:
+            code = reply['code']
+        except (TypeError, KeyError):
+            self.log_error('invalid reply for job %s : %s', job_id, text)
+            return JobStatus(job_id, None, 'invalid reply')
+
+        return JobStatus(job_id, code, reply.get('status') or JOB_STATUS.get(code, "unknown code"))
+
+    def poll(self, job_ids):
+        """ Queries the status of a collection of jobs.
+
+        :param job_ids: the job ids
+        :returns: the list of the job statuses, in the same order as the ids
+        """
+        job_ids = list(job_ids)
+        batched = self.batch_mode
+        if batched:
+            tasks = [job_ids[i:i + self._batch_size] for i in xrange(0, len(job_ids), self._batch_size)]
+            query = self.jobs_status
+        else:
+            tasks = job_ids
+            query = self.job_status
+
+        if self._concurrency > 1 and len(tasks) > 1:
+            if self._pool is None:
+                self._pool = ThreadPool(self._concurrency)
+            results = self._pool.map(query, tasks)
+        else:
+            results = [query(task) for task in tasks]
+
+        if batched:
+            return [status for batch in results for status in batch]
+        return results
+
+    def close(self):
+        """ Releases the worker threads if any.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class _JobSchedule(object):
+    """ Scheduling data of a job """
+    __slots__ = ('first_seen', 'interval', 'next_check')
+
+    def __init__(self, first_seen, interval, next_check):
+        self.first_seen = first_seen
+        self.interval = interval
+        self.next_check = next_check
+
+
+class JobCheckScheduler(object):
+    """ Schedules the status checks of pending jobs individually.
+
+    A new job is checked shortly after having been noticed, since small uploads are processed
+    quickly by the server. After each check telling that the job is still in process, the delay
+    before the next check is multiplied by the backoff factor, up to the maximum interval. Jobs
+    pending for more than the maximum age are reported as expired, so that they can be given up.
+
+    Jobs are kept in a heap ordered by the next check time, so that due jobs and the time of the
+    next check are obtained without scanning all of them.
+    """
+    def __init__(self, first_check_delay, check_interval, backoff_factor=2., max_interval=None, max_age=None):
+        """
+        :param float first_check_delay: delay (in seconds) between the discovery of a job and its first check
+        :param float check_interval: delay (in seconds) between the first and the second checks
+        :param float backoff_factor: the multiplier applied to the delay between subsequent checks
+        :param float max_interval: the maximum delay between checks (unbounded if not provided)
+        :param float max_age: the maximum time a job is monitored (unbounded if not provided)
+        """
+        self._first_check_delay = first_check_delay
+        self._check_interval = check_interval
+        self._backoff_factor = backoff_factor
+        self._max_interval = max_interval
+        self._max_age = max_age
+        self._jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_config(cls, cfg, **kwargs):
+        """ Creates a scheduler using the settings of a configuration.
+
+        :param ProcessConfiguration cfg: configuration data
+        :param kwargs: additional arguments of the scheduler constructor
+        """
+        cfg_monitor = cfg[_Props.MONITOR]
+        return cls(
+            first_check_delay=cfg_monitor[_Props.FIRST_CHECK_DELAY],
+            check_interval=cfg[_Props.STATUS_MONITORING_PERIOD],
+            backoff_factor=cfg_monitor[_Props.BACKOFF_FACTOR],
+            max_interval=cfg_monitor[_Props.MAX_CHECK_INTERVAL] or None,
+            max_age=cfg_monitor[_Props.MAX_AGE] or None,
+            **kwargs
+        )
+
+    def _interval(self, checks):
+        """ Returns the delay between the given count of checks of a job and its next check.
+        """
+        interval = self._check_interval * self._backoff_factor ** (checks - 1)
+        if self._max_interval:
+            interval = min(interval, self._max_interval)
+        return interval
+
+    def add(self, job_id, now, info=None):
+        """ Adds a job, its first check being scheduled after the first check delay.
+
+        If the job metadata are provided, its schedule is resumed from them instead.
+        Nothing is done if the job is already known.
+
+        :param str job_id: the job id
+        :param float now: the current time
+        :param PendingJobInfo info: the job metadata, if available
+        """
+        if job_id in self._jobs:
+            return
+
+        if info is None or not info.attempts:
+            first_seen = info.upload_time if info else now
+            schedule = _JobSchedule(first_seen, None, max(now, first_seen + self._first_check_delay))
+        else:
+            schedule = _JobSchedule(info.upload_time, self._interval(info.attempts), info.next_check or now)
+        self._jobs[job_id] = schedule
+        self._push(job_id, schedule)
+
+    def remove(self, job_id):
+        """ Forgets a job. Nothing is done if the job is not known.
+        """
+        # the heap entry will be discarded when popped
+        self._jobs.pop(job_id, None)
+
+    def sync(self, job_ids, now, job_info=None):
+        """ Synchronizes the scheduled jobs with the content of the pending jobs queue, adding the
+        new jobs and forgetting the ones which are not pending any more.
+
+        :param job_ids: the ids of the currently pending jobs
+        :param float now: the current time
+        :param job_info: a callable returning the metadata of a job, or None if not available
+        """
+        job_ids = set(job_ids)
+        for job_id in set(self._jobs) - job_ids:
+            self.remove(job_id)
+        for job_id in job_ids:
+            if job_id not in self._jobs:
+                self.add(job_id, now, job_info(job_id) if job_info else None)
+
+    def reschedule(self, job_id, now):
+        """ Schedules the next check of a job which is still in process.
+        """
+        try:
+            schedule = self._jobs[job_id]
+        except KeyError:
+            return
+
+        if schedule.interval is None:
+            schedule.interval = self._check_interval
+        else:
+            schedule.interval *= self._backoff_factor
+        if self._max_interval:
+            schedule.interval = min(schedule.interval, self._max_interval)
+        schedule.next_check = now + schedule.interval
+        self._push(job_id, schedule)
+
+    def due_jobs(self, now):
+        """ Returns the jobs which check is due, and removes them from the schedule until they are
+        rescheduled.
+
+        :param float now: the current time
+        :returns: the list of the ids of due jobs
+        """
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            next_check, _, job_id = heapq.heappop(heap)
+            schedule = self._jobs.get(job_id)
+            # skip entries of removed or rescheduled jobs
+            if schedule is not None and schedule.next_check == next_check:
+                schedule.next_check = None
+                due.append(job_id)
+        return due
+
+    def expired_jobs(self, now):
+        """ Returns the jobs monitored for longer than the maximum age, and forgets them.
+
+        :param float now: the current time
+        :returns: the list of the ids of expired jobs
+        """
+        if not self._max_age:
+            return []
+        expired = [job_id for job_id, schedule in self._jobs.iteritems() if now - schedule.first_seen > self._max_age]
+        for job_id in expired:
+            self.remove(job_id)
+        return expired
+
+    def job_next_check(self, job_id):
+        """ Returns the time of the next check of a job, or None if not scheduled.
+        """
+        schedule = self._jobs.get(job_id)
+        return schedule.next_check if schedule else None
+
+    def next_check_time(self):
+        """ Returns the time of the next scheduled check, or None if there is none.
+        """
+        heap = self._heap
+        while heap:
+            next_check, _, job_id = heap[0]
+            schedule = self._jobs.get(job_id)
+            if schedule is not None and schedule.next_check == next_check:
+                return next_check
+            heapq.heappop(heap)
+        return None
+
+    def _push(self, job_id, schedule):
+        heapq.heappush(self._heap, (schedule.next_check, next(self._seq), job_id))
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+class StoredJobCheckScheduler(JobCheckScheduler):
+    """ Schedules the status checks of pending jobs using the check times stored with them by the
+    pending jobs queue (see :class:`pycstbox.dwh.pending_jobs_db.SQLitePendingJobsQueue`).
+
+    The due and expired jobs are obtained by indexed queries of the queue, instead of being tracked
+    in memory. The schedule is thus shared with the other users of the queue, and does not need to
+    be synchronized with its content. The next check time of a rescheduled job is kept only until
+    it is stored by :meth:`pycstbox.dwh.pending_jobs_db.SQLitePendingJobsQueue.record_checks`,
+    which must be done before the next call to :meth:`due_jobs`.
+    """
+    def __init__(self, first_check_delay, check_interval, backoff_factor=2., max_interval=None, max_age=None,
+                 queue=None):
+        """
+        :param queue: the pending jobs queue
+        :type queue: pycstbox.dwh.pending_jobs_db.SQLitePendingJobsQueue
+
+        See :class:`JobCheckScheduler` for the other parameters.
+        """
+        if queue is None:
+            raise ValueError("queue argument is mandatory")
+
+        super(StoredJobCheckScheduler, self).__init__(
+            first_check_delay, check_interval, backoff_factor, max_interval, max_age
+        )
+        self._queue = queue
+        self._next_checks = {}
+
+    def add(self, job_id, now, info=None):
+        """ Nothing to do, the jobs being scheduled when added to the queue
+        """
+
+    def remove(self, job_id):
+        self._next_checks.pop(job_id, None)
+
+    def sync(self, job_ids, now, job_info=None):
+        """ Nothing to do, the queue being queried directly
+        """
+
+    def reschedule(self, job_id, now):
+        info = self._queue.job_info(job_id)
+        if info is None:
+            return
+        # the current check is not recorded yet
+        self._next_checks[job_id] = now + self._interval(info.attempts + 1)
+
+    def due_jobs(self, now):
+        # the check times of the previous round have been recorded in the queue
+        self._next_checks.clear()
+        return self._queue.due_jobs(now, self._first_check_delay)
+
+    def expired_jobs(self, now):
+        if not self._max_age:
+            return []
+        return self._queue.jobs_uploaded_before(now - self._max_age)
+
+    def job_next_check(self, job_id):
+        return self._next_checks.get(job_id)
+
+    def next_check_time(self):
+        return self._queue.next_check_time(self._first_check_delay)
+
+    def __contains__(self, job_id):
+        return job_id in self._queue
+
+    def __len__(self):
+        return len(self._queue)
+
+
+def queue_report(queue, stale_age, now=None):
+    """ Returns a report of the pending jobs, based on the metadata stored by the queue (see
+    :class:`pycstbox.dwh.pending_jobs_db.SQLitePendingJobsQueue`).
+
+    It lists the count of jobs and the oldest upload time for each last status, the jobs not
+    checked yet, and the jobs pending for more than a given time.
+
+    :param queue: the pending jobs queue
+    :param float stale_age: the time (in seconds) after which a job is reported as stale
+    :param float now: the current time (defaults to now)
+    :returns: the lines of the report
+    :rtype: list
+    """
+    now = now or time.time()
+
+    def fmt_time(t):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+    lines = ['pending jobs: %d' % len(queue)]
+    for code, count, oldest in queue.status_summary():
+        status = 'not checked' if code is None else JOB_STATUS.get(code, 'status %d' % code)
+        lines.append('- %s: %d (oldest uploaded at %s)' % (status, count, fmt_time(oldest)))
+
+    unchecked = queue.jobs_with_status(None)
+    if unchecked:
+        lines.append('not checked yet: %s' % ', '.join(unchecked))
+
+    stale = queue.jobs_uploaded_before(now - stale_age)
+    if stale:
+        lines.append('pending for more than %d secs: %s' % (stale_age, ', '.join(stale)))
+    return lines
+
+
+_UNCHECKED = object()
+
+
+class FileChangeWatcher(object):
+    """ Detects the changes of a file by comparing its status with the one seen at the previous
+    check, which costs a single ``stat`` system call.
+
+    The file being always rewritten or appended to when modified, its modification time, size and
+    inode number are enough to detect a change.
+    """
+    def __init__(self, path):
+        """
+        :param str path: the path of the watched file
+        """
+        self._path = path
+        self._signature = _UNCHECKED
+
+    def _current_signature(self):
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def changed(self):
+        """ Tells if the file has changed since the previous call (or has not been checked yet).
+
+        The disappearance of the file is considered as a change too.
+        """
+        signature = self._current_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Size-bounded archives.
+
+When the data of an export are too big for being sent by a single request, the series are
+distributed across several archives (the parts), which are uploaded as independent jobs. A series
+is never split, so that each part can be processed by the server on its own.
+"""
+
+import os
+
+from pycstbox.dwh.compression import CompressingZipFile
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+ENTRY_OVERHEAD = 128
+""" Estimated size of the ZIP structures added for an entry (headers and central directory record),
+in addition to its name and its data """
+
+
+class SplitArchiveWriter(object):
+    """ Write-only archive-like object, distributing the added entries across several ZIP archives.
+
+    A new part is started when adding the next entry to the current one would make it exceed the
+    maximum size. Since the entries are compressed, their final size is estimated using the
+    compression ratio observed so far in the current part. The first entry of a part is added
+    whatever its size, which means that a series bigger than the limit will produce an oversized
+    part on its own.
+
+    It implements the subset of the :class:`zipfile.ZipFile` interface used for building the
+    archives (``write``, ``writestr`` and ``close``), and can be used as a context manager.
+    """
+    def __init__(self, new_part, max_size, **options):
+        """
+        :param new_part: callable invoked with the part number (starting at 1), and returning a
+            tuple containing the part name and the path or the file-like object it is written to
+        :param int max_size: the maximum size of the parts, in bytes (if None, all the entries
+            are stored in a single part)
+        :param options: the options of the parts archives (see
+            :class:`pycstbox.dwh.compression.CompressingZipFile`)
+        """
+        if max_size is not None and max_size <= 0:
+            raise ValueError('invalid maximum size: %s' % max_size)
+
+        self._new_part = new_part
+        self._max_size = max_size
+        self._options = options
+        self._archive = None
+        self._entries = 0
+        self._data_size = 0
+        self._written_count = 0
+        self._written_data_size = 0
+        self._written_compressed_size = 0
+        self.parts = []
+        """ The parts created so far, as the tuples returned by ''new_part'' """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def writestr(self, arcname, bytes):
+        self._make_room(arcname, len(bytes))
+        self._archive.writestr(arcname, bytes)
+
+    def write(self, filename, arcname=None):
+        arcname = arcname or os.path.basename(filename)
+        self._make_room(arcname, os.path.getsize(filename))
+        self._archive.write(filename, arcname)
+
+    def close(self):
+        """ Closes the current part, if any """
+        if self._archive is not None:
+            archive, self._archive = self._archive, None
+            archive.close()
+
+    def _make_room(self, arcname, data_size):
+        """ Makes sure that an entry can be added to the current part, starting a new one if needed.
+        """
+        if self._archive is not None and self._entries and self._max_size is not None:
+            if self._estimated_size() + self._entry_size(arcname, data_size) > self._max_size:
+                self.close()
+
+        if self._archive is None:
+            part = self._new_part(len(self.parts) + 1)
+            self.parts.append(part)
+            self._archive = CompressingZipFile(part[1], 'w', **self._options)
+            self._entries = self._data_size = self._written_count = 0
+            self._written_data_size = self._written_compressed_size = 0
+
+        self._entries += 1
+        self._data_size += data_size
+
+    def _compression_ratio(self):
+        """ Returns the compression ratio of the entries already written in the current part.
+        """
+        filelist = self._archive.filelist
+        for zinfo in filelist[self._written_count:]:
+            self._written_data_size += zinfo.file_size
+            self._written_compressed_size += zinfo.compress_size
+        self._written_count = len(filelist)
+        if not self._written_data_size:
+            return 1.
+        return float(self._written_compressed_size) / self._written_data_size
+
+    def _estimated_size(self):
+        """ Returns the estimated size of the current part, including the entries not written yet
+        (i.e. being compressed) and the central directory.
+        """
+        ratio = self._compression_ratio()
+        pending_data_size = self._data_size - self._written_data_size
+        return self._archive.fp.tell() + pending_data_size * ratio + self._entries * ENTRY_OVERHEAD
+
+    def _entry_size(self, arcname, data_size):
+        return data_size * self._compression_ratio() + len(arcname) * 2 + ENTRY_OVERHEAD
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" SQLite storage of the pending jobs, with their metadata.
+
+It provides the same interface as :class:`pycstbox.dwh.pending_jobs_queue.PendingJobsQueue`, and
+stores in addition the upload time and archive size of the jobs, and the results of their status
+checks. Indexes on these data allow the jobs monitor and operation reports to select jobs by
+next check time, status or age without scanning the whole list.
+"""
+
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL UNIQUE,
+    upload_time REAL NOT NULL,
+    archive_size INTEGER,
+    last_check REAL,
+    next_check REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_status INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_next_check ON jobs (next_check);
+CREATE INDEX IF NOT EXISTS jobs_last_status ON jobs (last_status);
+CREATE INDEX IF NOT EXISTS jobs_upload_time ON jobs (upload_time);
+"""
+
+_JOB_FIELDS = 'job_id upload_time archive_size last_check next_check attempts last_status'
+
+
+class PendingJobInfo(namedtuple('PendingJobInfo', _JOB_FIELDS)):
+    """ The metadata of a pending job.
+
+    Times are expressed in seconds since the epoch. The check related fields are None (and the
+    attempts count is 0) until the first status check of the job.
+    """
+    __slots__ = ()
+
+
+class SQLitePendingJobsQueue(object):
+    """ A persistent list holding the jobs which status is pending, stored in a SQLite database.
+
+    Concurrent accesses by several processes are handled by the SQLite locking. Several changes
+    can be grouped in a transaction with :meth:`batch`.
+    """
+    DEFAULT_PATH = "/var/db/cstbox/openrj.db"
+    LOCK_TIMEOUT = 30
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param str path: the path of the database. Will be created if not present
+        """
+        if not path:
+            raise ValueError("path argument cannot be empty")
+
+        self._path = path
+        # transactions are explicitly managed
+        self._db = sqlite3.connect(path, timeout=self.LOCK_TIMEOUT, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+        self._in_batch = False
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._db.close()
+
+    def load(self):
+        """ Nothing to do, the database being always queried for the current state
+        """
+
+    def save(self):
+        """ Nothing to do, changes being committed when done
+        """
+
+    @contextmanager
+    def batch(self):
+        """ Context manager grouping the changes made inside it in a single transaction, committed
+        at the exit of the context, or rolled back if an exception is raised.
+
+        Nested transactions are merged in the outermost one.
+        """
+        if self._in_batch:
+            yield self
+            return
+
+        # reserve the write lock at once, so that the transaction cannot fail to commit because
+        # of a concurrent one
+        self._db.execute('BEGIN IMMEDIATE')
+        self._in_batch = True
+        try:
+            yield self
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        else:
+            self._db.execute('COMMIT')
+        finally:
+            self._in_batch = False
+
+    def append(self, job_id, archive_size=None, upload_time=None):
+        """ Appends a job id to the list.
+
+        A job already in the list is replaced, its metadata being reset.
+
+        :param job_id: the id to be added
+        :param int archive_size: the size of the uploaded archive
+        :param float upload_time: the upload time (defaults to now)
+        """
+        with self.batch():
+            self._db.execute('DELETE FROM jobs WHERE job_id=?', (str(job_id),))
+            self._db.execute(
+                'INSERT INTO jobs (job_id, upload_time, archive_size) VALUES (?, ?, ?)',
+                (str(job_id), time.time() if upload_time is None else upload_time, archive_size)
+            )
+
+    def remove(self, job_id):
+        """ Removes a job id from the list.
+
+        :param job_id: the id to be removed
+
+        :raises: ValueError if not in the list
+        """
+        with self.batch():
+            if not self._db.execute('DELETE FROM jobs WHERE job_id=?', (str(job_id),)).rowcount:
+                raise ValueError('job not in queue: %s' % job_id)
+
+    def remove_all(self, job_ids):
+        """ Removes a collection of job ids from the list in a single transaction.
+
+        Ids not in the list are ignored.
+
+        :param job_ids: the ids to be removed
+        """
+        job_ids = [(str(job_id),) for job_id in job_ids]
+        if job_ids:
+            with self.batch():
+                self._db.executemany('DELETE FROM jobs WHERE job_id=?', job_ids)
+
+    def clear(self):
+        with self.batch():
+            self._db.execute('DELETE FROM jobs')
+
+    def record_checks(self, results, check_time=None):
+        """ Records the results of status checks.
+
+        Results of jobs not in the list are ignored.
+
+        :param results: iterable of (job_id, status code, next check time) tuples
+        :param float check_time: the time of the checks (defaults to now)
+        """
+        check_time = check_time or time.time()
+        params = [(check_time, next_check, code, str(job_id)) for job_id, code, next_check in results]
+        if params:
+            with self.batch():
+                self._db.executemany(
+                    'UPDATE jobs SET last_check=?, next_check=?, last_status=?, attempts=attempts+1 WHERE job_id=?',
+                    params
+                )
+
+    def job_info(self, job_id):
+        """ Returns the metadata of a job, or None if not in the list.
+
+        :rtype: PendingJobInfo
+        """
+        row = self._db.execute(
+            'SELECT %s FROM jobs WHERE job_id=?' % ', '.join(PendingJobInfo._fields), (str(job_id),)
+        ).fetchone()
+        return PendingJobInfo(*row) if row else None
+
+    def due_jobs(self, now=None, first_check_delay=None):
+        """ Returns the ids of the jobs which next check time is passed, by increasing next check
+        time.
+
+        Jobs not checked yet are included only if a first check delay is provided, their first
+        check being due once this delay has elapsed since their upload.
+
+        :param float now: the current time (defaults to now)
+        :param float first_check_delay: the delay (in seconds) between the upload of a job and its
+            first check
+        """
+        now = now or time.time()
+        if first_check_delay is None:
+            rows = self._db.execute('SELECT job_id FROM jobs WHERE next_check<=? ORDER BY next_check', (now,))
+        else:
+            rows = self._db.execute(
+                'SELECT job_id FROM jobs WHERE next_check<=? OR (last_check IS NULL AND upload_time<=?) '
+                'ORDER BY COALESCE(next_check, upload_time+?), seq',
+                (now, now - first_check_delay, first_check_delay)
+            )
+        return [row[0] for row in rows]
+
+    def next_check_time(self, first_check_delay=None):
+        """ Returns the time of the next scheduled check, or None if there is none.
+
+        :param float first_check_delay: the delay (in seconds) between the upload of a job and its
+            first check (jobs not checked yet are ignored if not provided)
+        """
+        next_check = self._db.execute('SELECT MIN(next_check) FROM jobs').fetchone()[0]
+        if first_check_delay is not None:
+            oldest = self._db.execute('SELECT MIN(upload_time) FROM jobs WHERE last_check IS NULL').fetchone()[0]
+            if oldest is not None:
+                first_check = oldest + first_check_delay
+                next_check = first_check if next_check is None else min(next_check, first_check)
+        return next_check
+
+    def jobs_uploaded_before(self, upload_time):
+        """ Returns the ids of the jobs uploaded before a given time, oldest first.
+        """
+        return [row[0] for row in self._db.execute(
+            'SELECT job_id FROM jobs WHERE upload_time<? ORDER BY upload_time', (upload_time,)
+        )]
+
+    def jobs_with_status(self, code):
+        """ Returns the ids of the jobs which last check returned a given status code (None for
+        jobs not checked yet or which status could not be obtained).
+        """
+        if code is None:
+            rows = self._db.execute('SELECT job_id FROM jobs WHERE last_status IS NULL ORDER BY seq')
+        else:
+            rows = self._db.execute('SELECT job_id FROM jobs WHERE last_status=? ORDER BY seq', (code,))
+        return [row[0] for row in rows]
+
+    def status_summary(self):
+        """ Returns a summary of the pending jobs, as a list of (last status code, jobs count,
+        oldest upload time) tuples.
+        """
+        return self._db.execute(
+            'SELECT last_status, COUNT(*), MIN(upload_time) FROM jobs GROUP BY last_status ORDER BY last_status'
+        ).fetchall()
+
+    def is_empty(self):
+        return len(self) == 0
+
+    def items(self):
+        return [row[0] for row in self._db.execute('SELECT job_id FROM jobs ORDER BY seq')]
+
+    def __contains__(self, job_id):
+        return self._db.execute('SELECT 1 FROM jobs WHERE job_id=?', (str(job_id),)).fetchone() is not None
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def __str__(self):
+        return str(self.items())
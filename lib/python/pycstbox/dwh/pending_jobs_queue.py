@@ -2,51 +2,225 @@
 # -*- coding: utf-8 -*-
 
 import os
+import fcntl
+from collections import OrderedDict
+from contextlib import contextmanager
 
 __author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
 
+BACKEND_FILE = 'file'
+BACKEND_SQLITE = 'sqlite'
+BACKENDS = (BACKEND_FILE, BACKEND_SQLITE)
+""" Available storage backends of the pending jobs """
+
+_ADD = '+'
+_REMOVE = '-'
+_CLEAR = '*'
+
 
 class PendingJobsQueue(object):
     """ A persistent list holding the jobs which status is pending.
+
+    The storage file is a journal : additions and removals are appended to it as ``+<job_id>``
+    and ``-<job_id>`` records, instead of rewriting the whole list on each change. Bare job ids
+    lines (i.e. the compacted form of the journal, which is also the format used by previous
+    versions) are handled as additions.
+
+    The journal is compacted (i.e. rewritten with only the pending job ids) when the count of its
+    records exceeds twice the count of pending jobs, and at least COMPACTION_MIN_RECORDS.
+
+    In memory, the jobs are kept in an ordered dictionary, so that membership tests and removals
+    do not depend on the count of pending jobs.
+
+    The file being shared by the export processes and the jobs monitor, all accesses are protected
+    by an advisory lock (see ``flock``) on a companion ``.lock`` file, which is not affected by the
+    renaming of the storage file when compacting it. Several changes can be grouped in a transaction
+    with :meth:`batch`.
     """
     DEFAULT_PATH = "/var/db/cstbox/openrj.jobs"
+    COMPACTION_MIN_RECORDS = 256
 
-    def __init__(self, path=DEFAULT_PATH):
+    def __init__(self, path=DEFAULT_PATH, fsync=True):
         """
         :param str path: the path of the storage file. Will be created if not present
+        :param bool fsync: if True, the storage file is synced to disk after each change (or
+        batch of changes in case of :meth:`remove_all`)
         """
         if not path:
             raise ValueError("path argument cannot be empty")
 
-        self._job_ids = []
+        self._job_ids = OrderedDict()
+        self._records = 0
+        self._lock_fp = None
+        self._batch_ops = None
 
         self._path = path
+        self._fsync = fsync
         if os.path.exists(self._path):
             self.load()
         else:
             # creates a new empty list on disk
             self.save()
 
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        """ Nothing to do, the file being opened only when accessed
+        """
+
+    @contextmanager
+    def _locked(self, operation=fcntl.LOCK_EX):
+        """ Context manager holding the lock of the storage file.
+
+        It can be nested, the lock being held by the outermost level.
+        """
+        if self._lock_fp is not None:
+            yield
+            return
+
+        fp = file(self._path + '.lock', 'a')
+        try:
+            fcntl.flock(fp.fileno(), operation)
+            self._lock_fp = fp
+            yield
+        finally:
+            self._lock_fp = None
+            # closing the file releases the lock
+            fp.close()
+
     def load(self):
-        """ Loads the list from disk
+        """ Loads the list from disk, by replaying the journal
         """
-        self._job_ids = []
-        for job_id in file(self._path, 'rt'):
-            self._job_ids.append(job_id.strip())
+        with self._locked(fcntl.LOCK_SH):
+            terminated = self._replay()
+
+        # files written by previous versions are not terminated by a newline, which would
+        # corrupt the next appended record
+        if not terminated or self._needs_compaction():
+            self._compact()
+
+    def _replay(self):
+        """ Replays the journal, the lock being held.
+
+        :returns: False if the file is not terminated by a newline
+        """
+        self._job_ids = OrderedDict()
+        self._records = 0
+        with file(self._path, 'rt') as fp:
+            data = fp.read()
+
+        for record in data.splitlines():
+            record = record.strip()
+            if not record:
+                continue
+            self._records += 1
+            if record[0] == _REMOVE:
+                self._job_ids.pop(record[1:], None)
+            elif record[0] == _ADD:
+                self._job_ids[record[1:]] = None
+            else:
+                self._job_ids[record] = None
+
+        return not data or data.endswith('\n')
 
     def save(self):
-        """ Saves the list to disk
+        """ Saves the list to disk, replacing the journal by its compacted form
+        """
+        with self._locked():
+            tmp_path = self._path + '.tmp'
+            with file(tmp_path, 'wt') as fp:
+                fp.writelines(job_id + '\n' for job_id in self._job_ids)
+                self._sync(fp)
+            os.rename(tmp_path, self._path)
+            self._records = len(self._job_ids)
+
+    def _compact(self):
+        """ Compacts the journal, including the changes made by other processes since it has been loaded.
+        """
+        with self._locked():
+            self._replay()
+            self.save()
+
+    def _sync(self, fp):
+        fp.flush()
+        if self._fsync:
+            os.fsync(fp.fileno())
+
+    def _needs_compaction(self):
+        return self._records > max(self.COMPACTION_MIN_RECORDS, 2 * len(self._job_ids))
+
+    def _log_records(self, op, job_ids):
+        """ Appends records to the journal, and compacts it if needed.
+
+        Inside a transaction, the records are kept in memory until it is committed.
+        """
+        if not job_ids:
+            return
+        if self._batch_ops is not None:
+            self._batch_ops.extend((op, job_id) for job_id in job_ids)
+            return
+
+        with self._locked():
+            with file(self._path, 'at') as fp:
+                fp.writelines(op + job_id + '\n' for job_id in job_ids)
+                self._sync(fp)
+            self._records += len(job_ids)
+
+            if self._needs_compaction():
+                self._compact()
+
+    @contextmanager
+    def batch(self):
+        """ Context manager grouping the changes made inside it in a transaction.
+
+        The changes are visible immediately in this instance, and are committed to disk at the
+        exit of the context with a single atomic write and rename of the storage file, merged with
+        the changes made by other processes in the meantime. If an exception is raised inside the
+        context, the changes are discarded and the list is reloaded from disk.
+
+        Nested transactions are merged in the outermost one.
         """
-        with file(self._path, 'wt') as fp:
-            fp.writelines('\n'.join((job_id for job_id in self._job_ids)))
+        if self._batch_ops is not None:
+            yield self
+            return
 
-    def append(self, job_id):
+        self._batch_ops = []
+        try:
+            yield self
+        except:
+            self._batch_ops = None
+            self.load()
+            raise
+
+        ops, self._batch_ops = self._batch_ops, None
+        with self._locked():
+            self._replay()
+            for op, job_id in ops:
+                if op == _ADD:
+                    self._job_ids.pop(job_id, None)
+                    self._job_ids[job_id] = None
+                elif op == _REMOVE:
+                    self._job_ids.pop(job_id, None)
+                else:
+                    self._job_ids.clear()
+            self.save()
+
+    def append(self, job_id, archive_size=None, upload_time=None):
         """ Appends a job id to the list and saves it.
 
+        The job metadata are not stored by this implementation.
+
         :param job_id: the id to be added
+        :param int archive_size: the size of the uploaded archive (ignored)
+        :param float upload_time: the upload time (ignored)
         """
-        self._job_ids.append(str(job_id))
-        self.save()
+        job_id = str(job_id)
+        # re-adding a pending job moves it at the end of the list, as a list append+remove would
+        self._job_ids.pop(job_id, None)
+        self._job_ids[job_id] = None
+        self._log_records(_ADD, [job_id])
 
     def remove(self, job_id):
         """ Removes a job id from the list and saves it.
@@ -55,20 +229,50 @@ class PendingJobsQueue(object):
 
         :raises: ValueError if not in the list
         """
-        self._job_ids.remove(str(job_id))
-        self.save()
+        job_id = str(job_id)
+        try:
+            del self._job_ids[job_id]
+        except KeyError:
+            raise ValueError('job not in queue: %s' % job_id)
+        self._log_records(_REMOVE, [job_id])
+
+    def remove_all(self, job_ids):
+        """ Removes a collection of job ids from the list and saves it once.
+
+        Ids not in the list are ignored.
+
+        :param job_ids: the ids to be removed
+        """
+        removed = []
+        for job_id in job_ids:
+            job_id = str(job_id)
+            if self._job_ids.pop(job_id, False) is None:
+                removed.append(job_id)
+        self._log_records(_REMOVE, removed)
+
+    def record_checks(self, results, check_time=None):
+        """ Check results are not stored by this implementation.
+        """
+
+    def job_info(self, job_id):
+        """ Job metadata are not stored by this implementation.
+        """
+        return None
 
     def clear(self):
         """ Guess what...
         """
-        self._job_ids = []
-        self.save()
+        self._job_ids = OrderedDict()
+        if self._batch_ops is not None:
+            self._batch_ops.append((_CLEAR, None))
+        else:
+            self.save()
 
     def is_empty(self):
         return len(self._job_ids) == 0
 
     def items(self):
-        return self._job_ids[:]
+        return self._job_ids.keys()
 
     def __contains__(self, job_id):
         return str(job_id) in self._job_ids
@@ -77,4 +281,20 @@ class PendingJobsQueue(object):
         return len(self._job_ids)
 
     def __str__(self):
-        return str(self._job_ids)
\ No newline at end of file
+        return str(self._job_ids.keys())
+
+
+def open_pending_jobs_queue(backend=BACKEND_FILE, path=None):
+    """ Opens the pending jobs list, stored with the given backend.
+
+    :param str backend: the storage backend (see :data:`BACKENDS`)
+    :param str path: the path of the storage (defaults to the one of the backend)
+    :returns: a :class:`PendingJobsQueue`, or a :class:`pycstbox.dwh.pending_jobs_db.SQLitePendingJobsQueue`
+    """
+    if backend == BACKEND_FILE:
+        return PendingJobsQueue(path or PendingJobsQueue.DEFAULT_PATH)
+    elif backend == BACKEND_SQLITE:
+        from pycstbox.dwh.pending_jobs_db import SQLitePendingJobsQueue
+        return SQLitePendingJobsQueue(path or SQLitePendingJobsQueue.DEFAULT_PATH)
+    else:
+        raise ValueError('invalid pending jobs backend: %s' % backend)
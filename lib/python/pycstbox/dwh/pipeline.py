@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Pipelined archive building and upload.
+
+The archive is compressed by a background thread, entry after entry, while the already compressed
+data are streamed to the server as the body of a chunked multipart request. The compression and the
+transfer of the data are thus overlapped, instead of being done one after the other.
+"""
+
+import Queue
+import threading
+import uuid
+import zipfile
+
+from pycstbox.dwh import DWHException
+from pycstbox.dwh.compression import CompressingZipFile, DEFAULT_LEVEL
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+""" Default size of the chunks the archive is streamed by """
+DEFAULT_QUEUE_SIZE = 8
+""" Default count of chunks which can be produced in advance """
+
+_ABORT_CHECK_PERIOD = 0.5
+_EOF = object()
+
+
+class PipelineAborted(DWHException):
+    """ Raised in the producer thread when the consumer side has been stopped """
+
+
+class _ProducerError(object):
+    """ Wrapper used to forward an error from the producer thread to the consumer one """
+    def __init__(self, error):
+        self.error = error
+
+
+class _ChunkQueueWriter(object):
+    """ Write-only file-like object, pushing the written data by chunks in a bounded queue.
+
+    It implements the subset of the file interface used by :class:`zipfile.ZipFile` when writing
+    an archive with ``writestr``.
+    """
+    def __init__(self, queue, aborted, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._queue = queue
+        self._aborted = aborted
+        self._chunk_size = chunk_size
+        self._buffer = []
+        self._buffered = 0
+        self._position = 0
+        self._discarded = False
+
+    def write(self, data):
+        if self._discarded:
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._position += len(data)
+        if self._buffered >= self._chunk_size:
+            self._push_buffer()
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        # data are pushed by chunks, and the remainder when closing
+        pass
+
+    def close(self):
+        self._push_buffer()
+        self.put(_EOF)
+
+    def discard(self):
+        """ Makes any subsequent write be ignored (used when the pipeline is broken) """
+        self._discarded = True
+
+    def put(self, item):
+        """ Puts an item in the queue, waiting for some room if needed.
+
+        :raises PipelineAborted: if the consumer side has been stopped in the meantime
+        """
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                self._queue.put(item, timeout=_ABORT_CHECK_PERIOD)
+                return
+            except Queue.Full:
+                pass
+
+    def _push_buffer(self):
+        if self._buffer:
+            self.put(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+
+class PipelinedArchiveUpload(object):
+    """ Builds a ZIP archive from a collection of entries and produces the body of a multipart
+    upload request containing it, the compression of the next entries being done in a background
+    thread while the body is consumed.
+
+    The body is produced by a generator, which makes ``requests`` send it using the chunked
+    transfer encoding.
+    """
+    def __init__(self, entries, field_name, file_name, compression=zipfile.ZIP_DEFLATED,
+                 chunk_size=DEFAULT_CHUNK_SIZE, queue_size=DEFAULT_QUEUE_SIZE, level=DEFAULT_LEVEL, workers=1):
+        """
+        :param entries: iterable of tuples containing the name and the content of the archive entries
+        :param str field_name: the name of the form field the archive is uploaded as
+        :param str file_name: the file name of the archive
+        :param int compression: the compression method of the archive entries
+        :param int chunk_size: the size of the chunks the archive is streamed by
+        :param int queue_size: the count of chunks which can be produced in advance
+        :param int level: the compression level
+        :param int workers: the count of processes compressing the entries in parallel
+        """
+        self._entries = entries
+        self._field_name = field_name
+        self._file_name = file_name
+        self._compression = compression
+        self._chunk_size = chunk_size
+        self._queue_size = queue_size
+        self._level = level
+        self._workers = workers
+        self._boundary = uuid.uuid4().hex
+        self.archive_size = None
+        """ The size of the produced archive, available once the body has been fully generated """
+
+    @property
+    def content_type(self):
+        """ The value of the Content-Type header of the request """
+        return 'multipart/form-data; boundary=%s' % self._boundary
+
+    def body(self):
+        """ Generates the body of the request.
+
+        :raises: any error raised while building the archive
+        """
+        queue = Queue.Queue(maxsize=self._queue_size)
+        aborted = threading.Event()
+        writer = _ChunkQueueWriter(queue, aborted, self._chunk_size)
+        producer = threading.Thread(target=self._produce, args=(writer,), name='archive-producer')
+        producer.daemon = True
+        producer.start()
+        try:
+            yield (
+                '--%s\r\n'
+                'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                'Content-Type: application/zip\r\n'
+                '\r\n'
+            ) % (self._boundary, self._field_name, self._file_name)
+
+            while True:
+                chunk = queue.get()
+                if chunk is _EOF:
+                    break
+                if isinstance(chunk, _ProducerError):
+                    raise chunk.error
+                yield chunk
+
+            yield '\r\n--%s--\r\n' % self._boundary
+
+        finally:
+            aborted.set()
+            producer.join()
+
+    def _produce(self, writer):
+        try:
+            archive = CompressingZipFile(
+                writer, 'w', compression=self._compression, level=self._level, workers=self._workers
+            )
+            for name, data in self._entries:
+                archive.writestr(name, data)
+            archive.close()
+            self.archive_size = writer.tell()
+            writer.close()
+
+        except PipelineAborted:
+            writer.discard()
+
+        except Exception as e:  #pylint: disable=W0703
+            writer.discard()
+            try:
+                writer.put(_ProducerError(e))
+            except PipelineAborted:
+                pass
@@ -37,39 +37,90 @@ This module defines the following classes :
 
 import os
 import datetime
+import contextlib
+import itertools
 import tempfile
 import time
-import zipfile
 import json
-import requests
 import jsonschema
 import copy
+import shutil
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
 
 from pycstbox.log import Loggable
 import pycstbox.export
 from pycstbox import evtdao
-from pycstbox.config import GlobalSettings
-from pycstbox.dwh.filters import EventsExportFilter, VariableDefsExportFilter, LINE_END
-from pycstbox.dwh.pending_jobs_queue import PendingJobsQueue
+from pycstbox.config import GlobalSettings, make_config_file_path
+from pycstbox.dwh.filters import EventsExportFilter, VariableDefsExportFilter, LINE_END, \
+    DEFAULT_MAX_OPEN_FILES, DEFAULT_BUCKETS_MEMORY_LIMIT
+from pycstbox.dwh import pending_jobs_queue as pjq
+from pycstbox.dwh.pipeline import PipelinedArchiveUpload
+from pycstbox.dwh import compression
+from pycstbox.dwh.compression import CompressingZipFile
+from pycstbox.dwh.parts import SplitArchiveWriter
+from pycstbox.dwh.checkpoints import ExportCheckpoints
+from pycstbox.dwh.upload_ledger import UploadLedger, archive_content_hash
+from pycstbox.dwh.watermarks import ExportWatermarks
+from pycstbox.dwh.vardefs_state import UploadedDefinitions
+from pycstbox.dwh import sessions
 from pycstbox.events import VarTypes
-from pycstbox.dwh import DWHException
+from pycstbox.dwh import DWHException, VARS_METATDATA_FILE_NAME
 
 __author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
 
 PARM_EXTRACT_DATE = 'date'
+PARM_EXTRACT_DATES = 'dates'
+PARM_FROM_TIME = 'from_time'
+PARM_TO_TIME = 'to_time'
 
 gs = GlobalSettings()
 
 TEMP_FILES_TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S.%f'
 
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+""" Default maximum size of the in-memory buffer used by the in-memory export mode """
+
+_pending_jobs_lock = threading.Lock()
+""" Serializes the updates of the pending jobs queue by concurrently running jobs """
+
+_upload_ledger_lock = threading.Lock()
+""" Serializes the accesses to the upload ledger by concurrently running jobs """
+
+ALL_VAR_TYPES = '*'
+""" Exported variable types setting value for exporting all the events """
+VARDEFS_VAR_TYPES = 'vardefs'
+""" Exported variable types setting value for exporting the types found in the variables metadata """
+
 
 class DWHEventsExportJob(pycstbox.export.EventsExportJob):
     """ A specialized EventsExportJob for exporting sensor events to the
     DataWareHouse server.  """
 
-    def __init__(self, jobname, jobid, parms, config):
+    def __init__(self, jobname, jobid, parms, config, watermarks=None):
+        """
+        :param str jobname: the job name
+        :param jobid: the job id
+        :param dict parms: the job parameters, defining either the exported dates
+            (''PARM_EXTRACT_DATE'' or ''PARM_EXTRACT_DATES'') or the exported time range
+            (''PARM_FROM_TIME'' and ''PARM_TO_TIME'')
+        :param ProcessConfiguration config: configuration data
+        :param ExportWatermarks watermarks: if provided, only the events more recent than the
+            watermark of their series are exported (incremental export mode)
+        """
         super(DWHEventsExportJob, self).__init__(jobname, jobid, parms)
         self._archive = None
+        self._archive_name = None
+        self._work_dir = None
+        self._series_buckets = None
+        self._parts = None
+        self._uploaded_parts = set()
+        self._checkpoint = None
+        self._watermarks = watermarks
+        self.exported_watermarks = {}
+        """ The timestamps of the last exported event of each series, in the incremental export mode """
         self._config = config
         self._site_code = config[ProcessConfiguration.Props.SITE_CODE]
 
@@ -77,36 +128,272 @@ class DWHEventsExportJob(pycstbox.export.EventsExportJob):
         """ Creates a ZIP archive containing the time series of the variables to be exported.
 
         The generated file name is placed in the private attribute ''self._archive'' for later use
-        by the sending step.
+        by the sending step. If the in-memory export mode is configured, the archive is built
+        in a spooled buffer instead, without any intermediate series file, and this buffer is
+        stored in ''self._archive'' in place of the file name.
+
+        If the pipelined mode is configured, the archive is not built here, but while being
+        uploaded by the sending step. The events are only gathered by series, the result being
+        stored in the private attribute ''self._series_buckets''.
+
+        If a maximum archive size is configured, the series are split across several archives
+        (see :meth:`create_archive_parts`), stored in the private attribute ''self._parts''. Since
+        the size of a streamed archive is not known in advance, the parts are built in spooled
+        buffers in the pipelined mode.
+
+        If checkpoints are enabled, the archive parts are built as files of the job checkpoint
+        whatever the export mode is, so that they can be reused if the upload fails. The series
+        are still produced as configured (see :meth:`_export_parts`). If the job has a valid
+        checkpoint, it is resumed from there instead, without reading the events.
 
         :return: the exported events count
         """
         evt_count = 0
         self._archive = None
-
-        filter_ = EventsExportFilter(self._config.site_code, prefix_with_type=False)
-        extract_date = self._parms[PARM_EXTRACT_DATE]
+        self._archive_name = None
+        self._series_buckets = None
+        self._parts = None
+        self._uploaded_parts = set()
+        self._checkpoint = None
+
+        checkpoints = export_checkpoints(self._config)
+        if checkpoints is not None:
+            checkpoint = checkpoints.get(self._jobid)
+            if checkpoint is not None:
+                if checkpoint.is_valid_for(self.extract_dates):
+                    return self._resume(checkpoint)
+                self.log_warn('checkpoint of job %s is outdated or damaged : discarded', self._jobid)
+            checkpoints.discard(self._jobid)
+
+        cfg_export = self._config[_CFG_PROPS.EXPORT]
+        var_types = self.exported_var_types()
+        if var_types is not None and len(var_types) == 1:
+            # the selection can be done by the DAO itself
+            dao_var_type, = var_types
+            var_types = None
+        else:
+            # all the events of the day are read in a single pass, and the filter keeps the
+            # relevant ones on the fly
+            dao_var_type = None
+        self.log_info('exported variable types : %s', ' '.join(sorted(var_types or [dao_var_type or '*'])))
+
+        filter_ = EventsExportFilter(
+            self._config.site_code, prefix_with_type=False,
+            max_open_files=cfg_export[_CFG_PROPS.MAX_OPEN_FILES],
+            group_by_series=cfg_export[_CFG_PROPS.GROUP_BY_SERIES],
+            buckets_memory_limit=cfg_export[_CFG_PROPS.BUCKETS_MEMORY_LIMIT],
+            var_types=var_types
+        )
+        time_stamp = datetime.datetime.utcnow()
+        chunk_period = datetime.timedelta(minutes=cfg_export[_CFG_PROPS.CHUNK_PERIOD])
         with evtdao.get_dao(gs.get('dao_name')) as dao:
-            events = dao.get_events_for_day(extract_date, var_type=VarTypes.ENERGY)
-            if events:
-                evt_count, series_files = filter_.export_events(events)
-                self._archive = self.create_archive(series_files, time_stamp=datetime.datetime.utcnow())
+            events = self._iter_events(dao, var_type=dao_var_type, chunk_period=chunk_period)
+            # peek the first event to find out if there is something to export, without
+            # materializing the whole sequence
+            first = next(events, None)
+            if first is not None:
+                events = itertools.chain([first], events)
+                max_size = cfg_export[_CFG_PROPS.MAX_ARCHIVE_SIZE]
+                if checkpoints is not None:
+                    evt_count = self._export_parts(
+                        filter_, events, time_stamp, max_size or None, to_dir=checkpoints.job_dir(self._jobid)
+                    )
+                    if evt_count:
+                        self._checkpoint = checkpoints.create(
+                            self._jobid, self.extract_dates, evt_count, [name for name, _ in self._parts]
+                        )
+                elif max_size and (cfg_export[_CFG_PROPS.IN_MEMORY] or cfg_export[_CFG_PROPS.PIPELINED]):
+                    evt_count = self._export_parts(
+                        filter_, events, time_stamp, max_size, spool_max_size=cfg_export[_CFG_PROPS.SPOOL_MAX_SIZE]
+                    )
+                elif max_size:
+                    evt_count = self._export_parts(filter_, events, time_stamp, max_size)
+                elif cfg_export[_CFG_PROPS.PIPELINED]:
+                    evt_count, self._series_buckets = filter_.bucket_events(events)
+                    self._archive_name = self.archive_name(time_stamp)
+                elif cfg_export[_CFG_PROPS.IN_MEMORY]:
+                    evt_count, self._archive = self.create_spooled_archive(
+                        filter_, events, spool_max_size=cfg_export[_CFG_PROPS.SPOOL_MAX_SIZE],
+                        options=archive_options(self._config)
+                    )
+                    self._archive_name = self.archive_name(time_stamp)
+                else:
+                    work_dir = self._make_work_dir()
+                    evt_count, series_files = filter_.export_events(events, to_dir=work_dir)
+                    self._archive = self.create_archive(series_files, time_stamp=time_stamp, to_dir=work_dir)
+                    self._archive_name = os.path.basename(self._archive)
+
+                if not evt_count:
+                    # none of the events were of an exported type
+                    self.cleanup()
+                    if checkpoints is not None:
+                        checkpoints.discard(self._jobid)
 
         return evt_count
 
-    def create_archive(self, series_files, time_stamp, cleanup=True):
+    def _make_work_dir(self):
+        """ Creates the private directory of the job, where the series files and the archive are
+        created in the file export mode, so that jobs running concurrently do not share them.
+
+        It is removed by :meth:`cleanup`.
+
+        :return: the directory path
+        """
+        if self._work_dir is None:
+            self._work_dir = tempfile.mkdtemp(prefix='dwh-%s-' % self._jobid)
+        return self._work_dir
+
+    def _export_parts(self, filter_, events, time_stamp, max_size, spool_max_size=None, to_dir=None):
+        """ Exports the events as archive parts (see :meth:`create_archive_parts`), the series
+        being produced the same way as by the configured export mode:
+
+        - in pipelined mode, the events are gathered in per-series buckets, which are spilled to
+          a temp file above their memory limit
+        - in in-memory mode, the series are written directly as archive entries, all their points
+          being held in memory until then
+        - otherwise, the series files are written in the work directory of the job
+
+        :param EventsExportFilter filter_: the filter used to export the events
+        :param events: the events to be exported
+        :param datetime.datetime time_stamp: the archives time stamp
+        :param int max_size: the maximum size of the parts (a single part is created if None)
+        :param int spool_max_size: if provided, the parts are built in spooled buffers
+        :param str to_dir: the directory where the part files are created (the work directory
+            of the job if not provided)
+        :return: the exported events count
+        """
+        cfg_export = self._config[_CFG_PROPS.EXPORT]
+        if cfg_export[_CFG_PROPS.PIPELINED]:
+            evt_count, buckets = filter_.bucket_events(events)
+
+            def add_series(archive):
+                for series_name, data in buckets.iter_series():
+                    archive.writestr(EventsExportFilter.series_filename(series_name), data)
+
+            try:
+                self.create_archive_parts(add_series, time_stamp, max_size, spool_max_size, to_dir)
+            finally:
+                buckets.close()
+            return evt_count
+
+        if cfg_export[_CFG_PROPS.IN_MEMORY]:
+            return self.create_archive_parts(
+                lambda archive: filter_.export_events_to_archive(events, archive)[0],
+                time_stamp, max_size, spool_max_size, to_dir
+            )
+
+        evt_count, series_files = filter_.export_events(events, to_dir=self._make_work_dir())
+
+        def add_series_files(archive):
+            for series_file in series_files:
+                archive.write(series_file, os.path.basename(series_file))
+
+        try:
+            self.create_archive_parts(add_series_files, time_stamp, max_size, spool_max_size, to_dir)
+        finally:
+            for f in series_files:
+                os.remove(f)
+        return evt_count
+
+    def _resume(self, checkpoint):
+        """ Restores the state of the job from its checkpoint, so that only the archive parts not
+        uploaded yet will be sent.
+
+        :param ExportCheckpoint checkpoint: the job checkpoint
+        :return: the exported events count
+        """
+        self._checkpoint = checkpoint
+        self._parts = [(part[checkpoint.NAME], checkpoint.part_path(part[checkpoint.NAME])) for part in checkpoint.parts]
+        self._uploaded_parts = set(name for name, _ in self._parts if checkpoint.is_uploaded(name))
+        self.log_info(
+            'resuming job from checkpoint (%d of %d parts already uploaded)',
+            len(self._uploaded_parts), len(self._parts)
+        )
+        return checkpoint.events_count
+
+    def _iter_events(self, dao, var_type=None, chunk_period=None):
+        """ Iterates lazily over the events exported by the job.
+
+        :param dao: the events DAO
+        :param str var_type: optional variable type to select the events
+        :param datetime.timedelta chunk_period: the time span of the chunks the events are read by
+        :returns: an iterator of the events, in chronological order
+        """
+        if PARM_FROM_TIME not in self._parms:
+            return iter_days_events(dao, self.extract_dates, var_type=var_type, chunk_period=chunk_period)
+
+        events = _iter_chunked_events(
+            dao, self._parms[PARM_FROM_TIME], self._parms[PARM_TO_TIME], var_type, chunk_period
+        )
+        if self._watermarks is not None:
+            self.exported_watermarks = {}
+            events = self._watermarks.new_events(events, self.exported_watermarks)
+        return events
+
+    @property
+    def extract_dates(self):
+        """ The sorted list of the dates which events are exported by the job.
+
+        A job exports either a single date (''PARM_EXTRACT_DATE'' parameter) or a batch of dates
+        (''PARM_EXTRACT_DATES'' parameter) when backlog jobs are coalesced. For a job exporting a
+        time range, these are the dates overlapped by the range.
+        """
+        if PARM_FROM_TIME in self._parms:
+            first = self._parms[PARM_FROM_TIME].date()
+            last = (self._parms[PARM_TO_TIME] - datetime.timedelta(microseconds=1)).date()
+            return [first + datetime.timedelta(days=n) for n in xrange((last - first).days + 1)]
+
+        try:
+            dates = self._parms[PARM_EXTRACT_DATES]
+        except KeyError:
+            dates = [self._parms[PARM_EXTRACT_DATE]]
+        return sorted(set(_as_date(d) for d in dates))
+
+    def exported_var_types(self):
+        """ Returns the set of the variable types to be exported, as defined by the configuration.
+
+        :return: the set of types, or None if all types are exported
+        :raises ConfigurationError: if the types are defined by the variables metadata and these
+            cannot be loaded
+        """
+        cfg_var_types = self._config[_CFG_PROPS.EXPORT][_CFG_PROPS.VAR_TYPES]
+        if cfg_var_types == ALL_VAR_TYPES or ALL_VAR_TYPES in cfg_var_types:
+            return None
+
+        if cfg_var_types == VARDEFS_VAR_TYPES:
+            path = make_config_file_path(VARS_METATDATA_FILE_NAME)
+            try:
+                with file(path) as fp:
+                    vars_metadata = json.load(fp)
+            except (IOError, ValueError) as e:
+                raise ConfigurationError('cannot load variables metadata from %s (%s)' % (path, e))
+            return set(md['type'] for md in vars_metadata.itervalues() if md.get('type'))
+
+        return set(cfg_var_types)
+
+    def archive_name(self, time_stamp, part=None):
+        """ Returns the name of the archive, built from the site code and the provided time stamp.
+
+        :param datetime.datetime time_stamp: the archive time stamp
+        :param int part: the part number, if the archive is split
+        """
+        name = "%s-%s" % (self._site_code, time_stamp.strftime(TEMP_FILES_TIMESTAMP_FORMAT))
+        if part is not None:
+            name += "-part%02d" % part
+        return name + ".zip"
+
+    def create_archive(self, series_files, time_stamp, cleanup=True, to_dir='/tmp'):
         """ Creates the archive to be sent, as a temp file packaging created series files.
 
         :param list series_files: the list of series files
         :param datetime.datetime time_stamp: the archive time stamp
         :param bool cleanup: if True, series files are deleted after the archive has been created
+        :param str to_dir: the directory where the archive is created
         :return: the generated archive file name, built from the site name and the provided time
         stamp
         """
-        archive_name = "/tmp/%s-%s.zip" % (
-            self._site_code, time_stamp.strftime(TEMP_FILES_TIMESTAMP_FORMAT)
-        )
-        with zipfile.ZipFile(archive_name, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive_name = os.path.join(to_dir, self.archive_name(time_stamp))
+        with CompressingZipFile(archive_name, 'w', **archive_options(self._config)) as archive:
             for series_file in series_files:
                 archive.write(series_file, os.path.basename(series_file))
 
@@ -117,8 +404,91 @@ class DWHEventsExportJob(pycstbox.export.EventsExportJob):
 
         return archive_name
 
+    def create_archive_parts(self, add_entries, time_stamp, max_size, spool_max_size=None, to_dir=None):
+        """ Creates the archives to be sent, the entries being split across several ones (the parts)
+        so that the size of each one does not exceed a given limit.
+
+        The parts are stored in ''self._parts'' as soon as they are created, as tuples containing
+        their name and their path or buffer, so that they are discarded by :meth:`cleanup`
+        whatever the outcome is.
+
+        :param add_entries: callable adding the entries to the archive-like object passed as its
+            argument, and returning the exported events count
+        :param datetime.datetime time_stamp: the archives time stamp
+        :param int max_size: the maximum size of the parts, in bytes (a single part is created
+            if None)
+        :param int spool_max_size: if provided, the parts are built in spooled buffers of this
+            maximum in-memory size instead of files
+        :param str to_dir: the directory where the part files are created (the work directory
+            of the job if not provided)
+        :return: the value returned by ''add_entries''
+        """
+        def new_part(num):
+            name = self.archive_name(time_stamp, part=num)
+            if spool_max_size is None:
+                return name, os.path.join(to_dir or self._make_work_dir(), name)
+            return name, tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+
+        writer = SplitArchiveWriter(new_part, max_size, **archive_options(self._config))
+        self._parts = writer.parts
+        with writer:
+            result = add_entries(writer)
+        self.log_info('archive split in %d parts', len(self._parts))
+        return result
+
+    @staticmethod
+    def create_spooled_archive(filter_, events, spool_max_size=SPOOL_MAX_SIZE, options=None):
+        """ Creates the archive to be sent in a spooled buffer, by streaming the series
+        directly into the archive entries.
+
+        The buffer is kept in memory as long as its size does not exceed the provided limit, and
+        is transparently moved to an anonymous temp file otherwise.
+
+        :param EventsExportFilter filter_: the filter used to export the events
+        :param events: the events to be exported
+        :param int spool_max_size: the maximum size of the in-memory buffer
+        :param dict options: the archive options (see :func:`archive_options`)
+        :return: a tuple containing the exported events count and the buffer (positioned at its
+        beginning)
+        """
+        buf = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        try:
+            with CompressingZipFile(buf, 'w', **(options or {})) as archive:
+                evt_count, _ = filter_.export_events_to_archive(events, archive)
+        except:
+            buf.close()
+            raise
+
+        buf.seek(0)
+        return evt_count, buf
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _open_archive(archive, archive_name):
+        """ Context manager giving access to an archive content as an opened file, whatever
+        the export mode is.
+
+        The yielded value is the object to be used as the file part of the upload request.
+
+        :param archive: the path of the archive, or the buffer containing it
+        :param str archive_name: the name of the archive
+        """
+        if isinstance(archive, basestring):
+            with file(archive, 'rb') as fp:
+                yield fp
+        else:
+            archive.seek(0)
+            yield (archive_name, archive)
+
     def send_data(self):
-        if not self._archive:
+        """ Uploads the archive(s) produced by :meth:`export_events`.
+
+        When the archive has been split, the parts are uploaded independently, and the ones
+        already accepted by the server are skipped when the upload is retried.
+
+        :raises pycstbox.export.ExportError: if the upload (of at least one part) failed
+        """
+        if not self._archive and self._series_buckets is None and not self._parts:
             self.log_warn('No archive previously created. We should not have been called.')
             return
 
@@ -128,17 +498,104 @@ class DWHEventsExportJob(pycstbox.export.EventsExportJob):
             'site': self._site_code
         }
         auth = cfg_server[_CFG_PROPS.AUTH]
+        session = server_session(self._config)
+        timeout = server_timeout(self._config)
+
+        if self._parts:
+            failed = []
+            for part_name, part in self._parts:
+                if part_name in self._uploaded_parts:
+                    continue
+                try:
+                    job_id = self._upload_archive(session, url, auth, timeout, part, part_name)
+                except pycstbox.export.ExportError:
+                    failed.append(part_name)
+                except requests.RequestException as e:
+                    # a network failure must not prevent uploading the other parts
+                    self.log_error('upload of %s failed : %s', part_name, e)
+                    failed.append(part_name)
+                else:
+                    self._uploaded_parts.add(part_name)
+                    if self._checkpoint is not None:
+                        self._checkpoint.set_uploaded(part_name, job_id)
+
+            if failed:
+                msg = '%d of %d parts not uploaded : %s' % (len(failed), len(self._parts), ' '.join(failed))
+                self.log_error(msg)
+                raise pycstbox.export.ExportError(msg)
+
+        elif self._series_buckets is not None:
+            upload = PipelinedArchiveUpload(
+                (
+                    (EventsExportFilter.series_filename(series_name), data)
+                    for series_name, data in self._series_buckets.iter_series()
+                ),
+                field_name='zip',
+                file_name=self._archive_name,
+                **archive_options(self._config)
+            )
+            self.log_info('streaming archive %s using URL %s', self._archive_name, url)
+            upload_time = time.time()
+            resp = session.post(
+                url,
+                data=upload.body(),
+                headers={
+                    'Content-Type': upload.content_type
+                },
+                auth=(auth[_CFG_PROPS.LOGIN], auth[_CFG_PROPS.PASSWORD]),
+                timeout=timeout
+            )
+            self._upload_done(resp, upload.archive_size, upload_time)
+
+        else:
+            self._upload_archive(session, url, auth, timeout, self._archive, self._archive_name)
+
+    def _upload_archive(self, session, url, auth, timeout, archive, archive_name):
+        """ Uploads a built archive.
 
-        with file(self._archive, 'rb') as archive:
-            self.log_info('uploading file %s using URL %s', self._archive, url)
-            resp = requests.post(
+        If the upload ledger is enabled, the upload is skipped when an identical archive
+        covering the same dates has already been accepted by the server.
+
+        :param archive: the path of the archive, or the buffer containing it
+        :param str archive_name: the name of the archive
+        :returns: the id of the server job processing the archive
+        :raises pycstbox.export.ExportError: if the upload failed
+        """
+        with self._open_archive(archive, archive_name) as fp:
+            content = fp[1] if isinstance(fp, tuple) else fp
+            content_hash = None
+            if self._config[_CFG_PROPS.UPLOAD_LEDGER][_CFG_PROPS.ENABLED]:
+                content_hash = archive_content_hash(content)
+                with _upload_ledger_lock:
+                    job_id = upload_ledger(self._config).lookup(content_hash, self.extract_dates)
+                if job_id is not None:
+                    self.log_warn('archive %s already uploaded (job id=%s) : skipped', archive_name, job_id)
+                    return job_id
+
+            self.log_info('uploading file %s using URL %s', archive_name, url)
+            archive_size = _file_size(content)
+            upload_time = time.time()
+            resp = session.post(
                 url,
                 files={
-                    'zip': archive
+                    'zip': fp
                 },
-                auth=(auth[_CFG_PROPS.LOGIN], auth[_CFG_PROPS.PASSWORD])
+                auth=(auth[_CFG_PROPS.LOGIN], auth[_CFG_PROPS.PASSWORD]),
+                timeout=timeout
             )
-
+        return self._upload_done(resp, archive_size, upload_time, content_hash)
+
+    def _upload_done(self, resp, archive_size, upload_time, content_hash=None):
+        """ Processes the reply to an upload request.
+
+        :param resp: the reply
+        :param int archive_size: the size of the uploaded archive
+        :param float upload_time: the time the upload was started at
+        :param str content_hash: the content hash of the archive, if it must be recorded in the
+            upload ledger
+        :returns: the id of the server job processing the archive
+        :raises pycstbox.export.ExportError: if the upload failed
+        """
         self.log_info('%s - %s', resp, resp.text)
         if resp.ok:
             resp_data = json.loads(resp.text)
@@ -155,8 +612,18 @@ class DWHEventsExportJob(pycstbox.export.EventsExportJob):
             # and log the result
 
             # add the job id to the persistent queue
-            queue = PendingJobsQueue()
-            queue.append(job_id)
+            with _pending_jobs_lock:
+                queue = pending_jobs_queue(self._config)
+                try:
+                    queue.append(job_id, archive_size=archive_size, upload_time=upload_time)
+                finally:
+                    queue.close()
+
+            if content_hash is not None:
+                with _upload_ledger_lock:
+                    upload_ledger(self._config).record(content_hash, self.extract_dates, job_id, upload_time)
+
+            return job_id
 
         else:
             try:
@@ -169,14 +636,137 @@ class DWHEventsExportJob(pycstbox.export.EventsExportJob):
     def cleanup(self, error=None):
         """ Final cleanup.
 
-        Removes the generated archive file if any.
+        Removes the generated archive file(s) or buffer(s), or the series buckets if any, and the work
+        directory of the job. The files of a checkpoint are left untouched, since they are owned by it.
         """
+        if self._checkpoint is not None:
+            self._checkpoint = None
+            self._parts = None
+
+        if self._parts:
+            for _, part in self._parts:
+                self._discard_archive(part)
+            self._parts = None
+
+        if self._series_buckets is not None:
+            self._series_buckets.close()
+            self._series_buckets = None
+            self._archive_name = None
+
         if self._archive:
+            self._discard_archive(self._archive)
+            self._archive = None
+            self._archive_name = None
+
+        if self._work_dir:
             if not self._config[ProcessConfiguration.Props.DEBUG]:
-                os.remove(self._archive)
+                shutil.rmtree(self._work_dir, ignore_errors=True)
             else:
-                self.log_warn('running in debug mode : temp file %s not deleted', self._archive)
-            self._archive = None
+                self.log_warn('running in debug mode : work directory %s not deleted', self._work_dir)
+            self._work_dir = None
+
+    def _discard_archive(self, archive):
+        """ Removes an archive file, or closes an archive buffer.
+        """
+        if not isinstance(archive, basestring):
+            archive.close()
+        elif not os.path.exists(archive):
+            # split archive part not created because of an error
+            pass
+        elif not self._config[ProcessConfiguration.Props.DEBUG]:
+            os.remove(archive)
+        else:
+            self.log_warn('running in debug mode : temp file %s not deleted', archive)
+
+
+def iter_day_events(dao, day, var_type=None, chunk_period=None):
+    """ Iterates lazily over the events of a given day.
+
+    If a chunk period is provided, the events are read from the DAO by successive time slices of
+    this duration, so that only the events of the current slice are held in memory. Otherwise they
+    are read by a single DAO request.
+
+    :param dao: the events DAO
+    :param datetime.date day: the day
+    :param str var_type: optional variable type to select the events
+    :param datetime.timedelta chunk_period: the time span of the chunks
+    :returns: an iterator of the events, in chronological order
+    """
+    return iter_days_events(dao, [day], var_type=var_type, chunk_period=chunk_period)
+
+
+def iter_days_events(dao, days, var_type=None, chunk_period=None):
+    """ Iterates lazily over the events of a collection of days.
+
+    Consecutive days are merged into a single time range, which is read as a whole (or by chunks
+    if a chunk period is provided, as for :func:`iter_day_events`).
+
+    :param dao: the events DAO
+    :param days: the days
+    :param str var_type: optional variable type to select the events
+    :param datetime.timedelta chunk_period: the time span of the chunks
+    :returns: an iterator of the events, in chronological order
+    """
+    days = sorted(set(_as_date(d) for d in days))
+    if len(days) == 1 and not chunk_period:
+        return iter(dao.get_events_for_day(days[0], var_type=var_type))
+
+    return itertools.chain.from_iterable(
+        _iter_chunked_events(dao, from_time, to_time, var_type, chunk_period)
+        for from_time, to_time in _days_ranges(days)
+    )
+
+
+def _as_date(d):
+    return d.date() if isinstance(d, datetime.datetime) else d
+
+
+def _days_ranges(days):
+    """ Returns the list of the time ranges covered by a sorted list of days, consecutive days being
+    merged in a single range.
+    """
+    one_day = datetime.timedelta(days=1)
+    ranges = []
+    for day in days:
+        day_start = datetime.datetime.combine(day, datetime.time())
+        if ranges and ranges[-1][1] == day_start:
+            ranges[-1][1] = day_start + one_day
+        else:
+            ranges.append([day_start, day_start + one_day])
+    return [tuple(r) for r in ranges]
+
+
+def _iter_chunked_events(dao, from_time, to_time, var_type, chunk_period=None):
+    # Chunks are requested with some overlap and trimmed here, so that we do not depend on the
+    # bounds inclusion policy of the DAO and no event is lost or duplicated at chunk boundaries.
+    margin = datetime.timedelta(seconds=1)
+    chunk_start = from_time
+    while chunk_start < to_time:
+        chunk_end = min(chunk_start + chunk_period, to_time) if chunk_period else to_time
+        for evt in dao.get_events(chunk_start - margin, chunk_end + margin, var_type=var_type):
+            if chunk_start <= evt.timestamp < chunk_end:
+                yield evt
+        chunk_start = chunk_end
+
+
+def _run_job(args):
+    """ Runs a job in a worker thread of the pool.
+
+    An unexpected error is reported as the failure of the job, instead of stopping the whole
+    process, so that the outcome of the other jobs is recorded anyway.
+
+    :param tuple args: the job id, the job, the covered backlog entries and the retries parameters
+    :returns: a tuple containing the job id, the covered backlog entries and the job completion code
+    """
+    job_id, job, covered_jobs, max_try, retry_delay = args
+    job.log_info('activating job with id=%s', job_id)
+    try:
+        error_code = job.run(max_try=max_try, retry_delay=retry_delay)
+    except Exception as e:      #pylint: disable=W0703
+        job.log_exception(e)
+        job.log_error('job %s failed with an unexpected error', job_id)
+        error_code = DWHEventsExportProcess.ERR_UNEXPECTED
+    return job_id, covered_jobs, error_code
 
 
 class DWHEventsExportProcess(Loggable):
@@ -185,16 +775,19 @@ class DWHEventsExportProcess(Loggable):
     attempts,...
     """
     ERR_NONE = 0
+    ERR_UNEXPECTED = 998
     ERR_MULTIPLE = 999
 
     err_messages = {
         ERR_NONE: 'successful',
+        ERR_UNEXPECTED: 'unexpected error',
         ERR_MULTIPLE: 'error on more than 1 job'
     }
 
     def __init__(self):
         Loggable.__init__(self, logname='evt-expproc')
         self._failed_jobs = {}
+        self._checkpoints = None
 
     def run(self, cfg):
         """ Runs the job of the day, but before it, runs also all the job
@@ -206,6 +799,10 @@ class DWHEventsExportProcess(Loggable):
         unexpected error), we can be sure that it is included in the backlog
         for next time.
 
+        In the incremental export mode, the job of the day is replaced by a job exporting
+        the events produced since the previous run (see :meth:`_make_incremental_job`),
+        which is run after the backlog ones.
+
         :param ProcessConfiguration cfg: configuration data
 
             The process configuration contains only constant information not depending on the
@@ -224,18 +821,20 @@ class DWHEventsExportProcess(Loggable):
         else:
             self.log_info('backlog is empty')
 
-        # add the current job to the backlog before running it
-        job_id = pycstbox.export.EventsExportJob.make_jobid()
-        # compute the events extraction reference date, by applying the
-        # requested offset to today's date. Note that the sign of the passed
-        # value is ignored, since we have few chances to be able to extract
-        # future events :)
-        extract_date = (
-            datetime.datetime.utcnow() - datetime.timedelta(days=abs(cfg[ProcessConfiguration.Props.DATE_OFFSET]))
-        ).date()
-        backlog[job_id] = {
-            PARM_EXTRACT_DATE: extract_date
-        }
+        incremental = cfg[ProcessConfiguration.Props.INTRADAY][ProcessConfiguration.Props.ENABLED]
+        if not incremental:
+            # add the current job to the backlog before running it
+            job_id = pycstbox.export.EventsExportJob.make_jobid()
+            # compute the events extraction reference date, by applying the
+            # requested offset to today's date. Note that the sign of the passed
+            # value is ignored, since we have few chances to be able to extract
+            # future events :)
+            extract_date = (
+                datetime.datetime.utcnow() - datetime.timedelta(days=abs(cfg[ProcessConfiguration.Props.DATE_OFFSET]))
+            ).date()
+            backlog[job_id] = {
+                PARM_EXTRACT_DATE: extract_date
+            }
 
         # now execute all the jobs in the backlog
         cfg_retry = cfg[ProcessConfiguration.Props.RETRIES]
@@ -243,15 +842,46 @@ class DWHEventsExportProcess(Loggable):
         retry_delay = cfg_retry[ProcessConfiguration.Props.DELAY]
 
         self._failed_jobs = {}
-        for job_id, job_parms in backlog.iteritems():
-            self.log_info('activating job with id=%s', job_id)
-            job = DWHEventsExportJob(
-                'dwh.events', job_id, job_parms, cfg
-            )
+        jobs = self._make_jobs(backlog, cfg)
+
+        incremental_job = self._make_incremental_job(cfg) if incremental else None
+
+        self._checkpoints = export_checkpoints(cfg)
+        if self._checkpoints is not None:
+            # the checkpoints of jobs which are not run anymore (e.g. backlog entries coalesced
+            # differently, or failed incremental jobs) are useless
+            for job_id in self._checkpoints.purge(job_id for job_id, _, _ in jobs):
+                self.log_info('obsolete checkpoint of job %s discarded', job_id)
+
+        workers = min(cfg[ProcessConfiguration.Props.EXPORT][ProcessConfiguration.Props.WORKERS], len(jobs))
+        if workers > 1:
+            # jobs are run concurrently, but the backlog is updated from this thread only
+            self.log_info('running %d jobs with %d workers', len(jobs), workers)
+            pool = ThreadPool(workers)
+            try:
+                results = pool.imap_unordered(
+                    _run_job,
+                    ((job_id, job, covered_jobs, max_try, retry_delay) for job_id, job, covered_jobs in jobs)
+                )
+                for job_id, covered_jobs, error_code in results:
+                    self._job_done(backlog, job_id, covered_jobs, error_code)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job_id, job, covered_jobs in jobs:
+                job_id, covered_jobs, error_code = _run_job((job_id, job, covered_jobs, max_try, retry_delay))
+                self._job_done(backlog, job_id, covered_jobs, error_code)
+
+        if incremental_job:
+            job_id, job, watermarks, to_time = incremental_job
+            self.log_info('activating incremental job with id=%s', job_id)
             error_code = job.run(max_try=max_try, retry_delay=retry_delay)
-            # if successful run, remove the job from the backlog
             if not error_code:
-                del backlog[job_id]
+                # the next export will start from there
+                watermarks.update(job.exported_watermarks, to_time)
+                if self._checkpoints is not None:
+                    self._checkpoints.discard(job_id)
             else:
                 self._failed_jobs[job_id] = error_code
 
@@ -261,7 +891,7 @@ class DWHEventsExportProcess(Loggable):
         else:
             self.log_error(
                 'job(s) failed (%s)' %
-                ' '.join(['%s:%s' % (job_id, pycstbox.export.EventsExportJob.error_text(errcode)) for job_id, errcode in
+                ' '.join(['%s:%s' % (failed_id, self._error_text(errcode)) for failed_id, errcode in
                           self._failed_jobs.iteritems()])
             )
             if len(self._failed_jobs) == 1:
@@ -270,6 +900,112 @@ class DWHEventsExportProcess(Loggable):
                 status_code = self.ERR_MULTIPLE
         return status_code
 
+    def _error_text(self, error_code):
+        """ Returns the description of a job completion code, which can be a process one.
+        """
+        try:
+            return self.err_messages[error_code]
+        except KeyError:
+            return pycstbox.export.EventsExportJob.error_text(error_code)
+
+    def _job_done(self, backlog, job_id, covered_jobs, error_code):
+        """ Updates the backlog and the failed jobs record after a job run.
+
+        The checkpoint of a successful job is discarded, the one of a failed job being kept
+        for the next run.
+
+        :param backlog: the backlog
+        :param str job_id: the job id
+        :param list covered_jobs: the ids of the backlog entries covered by the job
+        :param int error_code: the job completion code
+        """
+        if not error_code and self._checkpoints is not None:
+            self._checkpoints.discard(job_id)
+
+        # if successful run, remove the job(s) from the backlog
+        for bl_job_id in covered_jobs:
+            if not error_code:
+                del backlog[bl_job_id]
+            else:
+                self._failed_jobs[bl_job_id] = error_code
+
+    def _make_incremental_job(self, cfg):
+        """ Creates the job exporting the events produced since the previous incremental export.
+
+        The exported time range ends a bit before the current time, to leave some time to the
+        events for reaching the events log. It starts at the oldest of the series watermarks, or
+        at the beginning of the day the daily mode would extract (see the `date_offset` option)
+        if nothing has been exported yet in this mode, the previous days being supposed to be
+        exported by the daily mode already.
+
+        No backlog entry is used : if the job fails, the watermarks are not advanced, and its time
+        range is thus included in the one of the next run.
+
+        :param ProcessConfiguration cfg: configuration data
+        :returns: a tuple containing the job id, the job, the watermarks and the end of the
+            exported time range
+        """
+        cfg_intraday = cfg[ProcessConfiguration.Props.INTRADAY]
+        watermarks = ExportWatermarks(cfg_intraday[ProcessConfiguration.Props.PATH] or ExportWatermarks.DEFAULT_PATH)
+
+        now = datetime.datetime.utcnow()
+        to_time = now - datetime.timedelta(minutes=cfg_intraday[ProcessConfiguration.Props.LAG])
+        from_time = watermarks.read_start(
+            datetime.timedelta(minutes=cfg_intraday[ProcessConfiguration.Props.MAX_LOOKBACK])
+        )
+        if from_time is None:
+            # start where the daily mode would have exported next, i.e. at the day it extracts
+            first_day = (now - datetime.timedelta(days=abs(cfg[ProcessConfiguration.Props.DATE_OFFSET]))).date()
+            from_time = datetime.datetime.combine(first_day, datetime.time())
+        job_id = 'intraday-' + to_time.strftime(TEMP_FILES_TIMESTAMP_FORMAT)
+
+        self.log_info('incremental export from %s to %s', from_time, to_time)
+        job = DWHEventsExportJob(
+            'dwh.events', job_id, {PARM_FROM_TIME: from_time, PARM_TO_TIME: to_time}, cfg, watermarks=watermarks
+        )
+        return job_id, job, watermarks, to_time
+
+    def _make_jobs(self, backlog, cfg):
+        """ Creates the jobs to be run for processing the backlog.
+
+        By default, a job is created for each backlog entry. If backlog coalescing is configured,
+        entries are merged in batches of consecutive dates, each one being processed by a single
+        job (i.e. a single DAO read, archive and upload).
+
+        :returns: a list of tuples, containing the job id, the job and the list of the ids of the
+            backlog entries it covers
+        """
+        cfg_export = cfg[ProcessConfiguration.Props.EXPORT]
+        bl_items = sorted(backlog.items(), key=lambda item: _as_date(item[1][PARM_EXTRACT_DATE]))
+        if not cfg_export[ProcessConfiguration.Props.COALESCE_BACKLOG] or len(bl_items) < 2:
+            return [
+                (job_id, DWHEventsExportJob('dwh.events', job_id, job_parms, cfg), [job_id])
+                for job_id, job_parms in bl_items
+            ]
+
+        max_days = cfg_export[ProcessConfiguration.Props.MAX_BATCH_DAYS]
+        batches = []
+        batch_dates = set()
+        for job_id, job_parms in bl_items:
+            extract_date = _as_date(job_parms[PARM_EXTRACT_DATE])
+            if not batches or (extract_date not in batch_dates and len(batch_dates) >= max_days):
+                batch_dates = set()
+                batches.append(([], batch_dates))
+            batch_jobs, batch_dates = batches[-1]
+            batch_jobs.append(job_id)
+            batch_dates.add(extract_date)
+
+        jobs = []
+        for batch_jobs, batch_dates in batches:
+            job_id = batch_jobs[0] if len(batch_jobs) == 1 else '+'.join((batch_jobs[0], batch_jobs[-1]))
+            self.log_info('batch %s covers backlog jobs %s', job_id, ' '.join(batch_jobs))
+            jobs.append((
+                job_id,
+                DWHEventsExportJob('dwh.events', job_id, {PARM_EXTRACT_DATES: sorted(batch_dates)}, cfg),
+                batch_jobs
+            ))
+        return jobs
+
     @property
     def failed_jobs(self):
         return self._failed_jobs
@@ -306,7 +1042,7 @@ class DWHVariableDefinitionsExportProcess(Loggable):
     def __init__(self):
         Loggable.__init__(self, logname='cfg-expproc')
 
-    def run(self, cfg, devices_config, vars_metadata):  #pylint: disable=R0912
+    def run(self, cfg, devices_config, vars_metadata, full=False):  #pylint: disable=R0912
         """ Builds the variable definitions dataset, using the current devices
         configuration data, and uploads it to the appropriate area on DataWareHouse
         server.
@@ -314,13 +1050,27 @@ class DWHVariableDefinitionsExportProcess(Loggable):
         Unlike for events date this process is not scheduled to run
         periodically, so no backlog is handled here.
 
+        In incremental mode (the default one), only the definitions added or modified since the
+        last successful upload are sent, and nothing is sent at all if there is no such one.
+
         :param ProcessConfiguration cfg: configuration data
         :param devices_config: devices coonfiguration
+        :param bool full: if True, all the definitions are uploaded, even in incremental mode
         :returns: error code (ERR_xxx) if something went wrong, 0 if all is ok
         """
         self.log_info('starting')
         done = False
 
+        cfg_vardefs = cfg[ProcessConfiguration.Props.VARDEFS]
+        if cfg_vardefs[ProcessConfiguration.Props.INCREMENTAL]:
+            uploaded = UploadedDefinitions(
+                cfg_vardefs[ProcessConfiguration.Props.PATH] or UploadedDefinitions.DEFAULT_PATH,
+                host=cfg[ProcessConfiguration.Props.SERVER][ProcessConfiguration.Props.HOST],
+                site_code=cfg[ProcessConfiguration.Props.SITE_CODE]
+            )
+        else:
+            uploaded = None
+
         # export the configuration as DataWareHouse point definitions
         error = self.ERR_EXPORT
         try:
@@ -330,13 +1080,20 @@ class DWHVariableDefinitionsExportProcess(Loggable):
                 contact=cfg[ProcessConfiguration.Props.REPORT_TO],
                 vars_metadata=vars_metadata
             )
-            data = exp_filter.export_variable_definitions(devices_config)
+            all_data = data = exp_filter.export_variable_definitions(devices_config)
 
         except Exception as e:  #pylint: disable=W0703
             self.log_error('configuration export failure : %s', str(e))
 
         else:
             self.log_info('configuration export ok')
+            if uploaded is not None and not full:
+                data = uploaded.changed(all_data)
+                if not data:
+                    self.log_info('no definition added or modified since last upload => nothing to send')
+                    return self.ERR_NONE
+                self.log_info('%d definitions added or modified (out of %d)', len(data), len(all_data))
+
             cfg_retries = cfg[ProcessConfiguration.Props.RETRIES]
             max_try = cfg_retries[ProcessConfiguration.Props.MAX_ATTEMPTS]
             retry_delay = cfg_retries[ProcessConfiguration.Props.DELAY]
@@ -358,17 +1115,20 @@ class DWHVariableDefinitionsExportProcess(Loggable):
 
                 cfg_auth = cfg_server[ProcessConfiguration.Props.AUTH]
                 auth = (cfg_auth[ProcessConfiguration.Props.LOGIN], cfg_auth[ProcessConfiguration.Props.PASSWORD])
+                session = server_session(cfg)
                 cnt = 0
                 while not done and cnt < max_try:
                     cnt += 1
                     self.log_info('POSTing data to %s', url)
-                    resp = requests.post(
+                    f.seek(0)
+                    resp = session.post(
                         url,
                         data=f,
                         auth=auth,
                         headers={
                             'Content-Type': 'application/json'
-                        }
+                        },
+                        timeout=server_timeout(cfg)
                     )
 
                     # self.log_info('%s - %s', resp, resp.text)
@@ -392,6 +1152,8 @@ class DWHVariableDefinitionsExportProcess(Loggable):
                             )
 
         if done:
+            if uploaded is not None:
+                uploaded.set_uploaded(all_data)
             self.log_info('export process successful')
             error = self.ERR_NONE
         else:
@@ -400,6 +1162,96 @@ class DWHVariableDefinitionsExportProcess(Loggable):
         return error
 
 
+def _file_size(fp):
+    """ Returns the size of an open file (or file-like) object, its position being left unchanged.
+    """
+    pos = fp.tell()
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(pos)
+    return size
+
+
+def server_session(cfg, min_pool_size=0):
+    """ Returns the HTTP session shared by the requests sent to the server defined by a configuration.
+
+    :param ProcessConfiguration cfg: configuration data
+    :param int min_pool_size: minimal size of the connections pool, overriding the configured one
+        if greater (for callers using concurrent requests)
+    :rtype: requests.Session
+    """
+    cfg_server = cfg[ProcessConfiguration.Props.SERVER]
+    return sessions.get_session(
+        cfg_server[ProcessConfiguration.Props.HOST],
+        pool_size=max(cfg_server[ProcessConfiguration.Props.POOL_SIZE], min_pool_size),
+        connect_retries=cfg_server[ProcessConfiguration.Props.CONNECT_RETRIES]
+    )
+
+
+def server_timeout(cfg):
+    """ Returns the timeout of the requests sent to the server defined by a configuration.
+
+    :param ProcessConfiguration cfg: configuration data
+    :returns: the timeout, in the form accepted by ''requests''
+    """
+    cfg_server = cfg[ProcessConfiguration.Props.SERVER]
+    return cfg_server[ProcessConfiguration.Props.CONNECT_TIMEOUT], cfg_server[ProcessConfiguration.Props.READ_TIMEOUT]
+
+
+def archive_options(cfg):
+    """ Returns the options of the uploaded archives defined by a configuration.
+
+    :param ProcessConfiguration cfg: configuration data
+    :returns: the keyword arguments of :class:`pycstbox.dwh.compression.CompressingZipFile`
+    :rtype: dict
+    """
+    cfg_compression = cfg[ProcessConfiguration.Props.EXPORT][ProcessConfiguration.Props.COMPRESSION]
+    return {
+        'compression': compression.METHODS[cfg_compression[ProcessConfiguration.Props.METHOD]],
+        'level': cfg_compression[ProcessConfiguration.Props.LEVEL],
+        'workers': cfg_compression[ProcessConfiguration.Props.WORKERS]
+    }
+
+
+def export_checkpoints(cfg):
+    """ Opens the checkpoints store of the export jobs, as defined by a configuration.
+
+    :param ProcessConfiguration cfg: configuration data
+    :returns: the checkpoints store, or None if checkpoints are disabled
+    :rtype: ExportCheckpoints
+    """
+    cfg_checkpoints = cfg[ProcessConfiguration.Props.CHECKPOINTS]
+    if not cfg_checkpoints[ProcessConfiguration.Props.ENABLED]:
+        return None
+    return ExportCheckpoints(cfg_checkpoints[ProcessConfiguration.Props.PATH] or ExportCheckpoints.DEFAULT_PATH)
+
+
+def upload_ledger(cfg):
+    """ Opens the upload ledger, as defined by a configuration.
+
+    :param ProcessConfiguration cfg: configuration data
+    :rtype: UploadLedger
+    """
+    cfg_ledger = cfg[ProcessConfiguration.Props.UPLOAD_LEDGER]
+    return UploadLedger(
+        cfg_ledger[ProcessConfiguration.Props.PATH] or UploadLedger.DEFAULT_PATH,
+        retention=cfg_ledger[ProcessConfiguration.Props.RETENTION] * 24 * 3600
+    )
+
+
+def pending_jobs_queue(cfg):
+    """ Opens the pending jobs list, as defined by a configuration.
+
+    :param ProcessConfiguration cfg: configuration data
+    :returns: the pending jobs list (see :func:`pycstbox.dwh.pending_jobs_queue.open_pending_jobs_queue`)
+    """
+    cfg_queue = cfg[ProcessConfiguration.Props.JOBS_QUEUE]
+    return pjq.open_pending_jobs_queue(
+        cfg_queue[ProcessConfiguration.Props.BACKEND],
+        cfg_queue[ProcessConfiguration.Props.PATH] or None
+    )
+
+
 class ProcessConfiguration(Loggable):
     """ Configuration data manager, using JSON as persistence format.
     """
@@ -416,11 +1268,52 @@ class ProcessConfiguration(Loggable):
         DATA_UPLOAD = 'data_upload'
         DEFS_UPLOAD = 'defs_upload'
         JOB_STATUS = 'job_status'
+        JOBS_STATUS = 'jobs_status'
         CONNECT_TIMEOUT = 'connect_timeout'
+        READ_TIMEOUT = 'read_timeout'
+        POOL_SIZE = 'pool_size'
+        CONNECT_RETRIES = 'connect_retries'
         RETRIES = 'retries'
         MAX_ATTEMPTS = 'max_attempts'
         DELAY = 'delay'
         STATUS_MONITORING_PERIOD = 'status_monitoring_period'
+        MONITOR = 'monitor'
+        CONCURRENCY = 'concurrency'
+        REQUEST_TIMEOUT = 'request_timeout'
+        BATCH_SIZE = 'batch_size'
+        QUEUE_CHECK_PERIOD = 'queue_check_period'
+        FIRST_CHECK_DELAY = 'first_check_delay'
+        BACKOFF_FACTOR = 'backoff_factor'
+        MAX_CHECK_INTERVAL = 'max_check_interval'
+        MAX_AGE = 'max_age'
+        EXPORT = 'export'
+        IN_MEMORY = 'in_memory'
+        SPOOL_MAX_SIZE = 'spool_max_size'
+        PIPELINED = 'pipelined'
+        MAX_ARCHIVE_SIZE = 'max_archive_size'
+        COMPRESSION = 'compression'
+        METHOD = 'method'
+        LEVEL = 'level'
+        MAX_OPEN_FILES = 'max_open_files'
+        CHUNK_PERIOD = 'chunk_period'
+        COALESCE_BACKLOG = 'coalesce_backlog'
+        MAX_BATCH_DAYS = 'max_batch_days'
+        WORKERS = 'workers'
+        GROUP_BY_SERIES = 'group_by_series'
+        BUCKETS_MEMORY_LIMIT = 'buckets_memory_limit'
+        VAR_TYPES = 'var_types'
+        JOBS_QUEUE = 'jobs_queue'
+        VARDEFS = 'vardefs'
+        CHECKPOINTS = 'checkpoints'
+        UPLOAD_LEDGER = 'upload_ledger'
+        INTRADAY = 'intraday'
+        LAG = 'lag'
+        MAX_LOOKBACK = 'max_lookback'
+        ENABLED = 'enabled'
+        RETENTION = 'retention'
+        INCREMENTAL = 'incremental'
+        BACKEND = 'backend'
+        PATH = 'path'
         DEBUG = 'debug'
 
     SCHEMA = {
@@ -463,6 +1356,20 @@ class ProcessConfiguration(Loggable):
                     Props.CONNECT_TIMEOUT: {
                         "type": "integer",
                         "minimum": 1
+                    },
+                    Props.READ_TIMEOUT: {
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.POOL_SIZE: {
+                        "description": "The maximum count of connections kept alive with the server",
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.CONNECT_RETRIES: {
+                        "description": "The count of immediate retries when the connection fails",
+                        "type": "integer",
+                        "minimum": 0
                     }
                 },
                 "required": [Props.HOST]
@@ -478,6 +1385,10 @@ class ProcessConfiguration(Loggable):
                     },
                     Props.JOB_STATUS: {
                         "type": "string"
+                    },
+                    Props.JOBS_STATUS: {
+                        "description": "The URL of the batch job status API (if supported by the server)",
+                        "type": "string"
                     }
                 }
             },
@@ -498,6 +1409,232 @@ class ProcessConfiguration(Loggable):
                 "type": "integer",
                 "minimum": 1
             },
+            Props.MONITOR: {
+                "type": "object",
+                "properties": {
+                    Props.CONCURRENCY: {
+                        "description": "The maximum count of job status requests sent concurrently",
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.REQUEST_TIMEOUT: {
+                        "description": "The timeout (in seconds) of job status replies",
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.BATCH_SIZE: {
+                        "description": "The maximum count of jobs queried by a batch job status request",
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.QUEUE_CHECK_PERIOD: {
+                        "description": "The period (in seconds) of the pending jobs queue changes detection",
+                        "type": "number",
+                        "exclusiveMinimum": True,
+                        "minimum": 0
+                    },
+                    Props.FIRST_CHECK_DELAY: {
+                        "description": "The delay (in seconds) before the first status check of a new job",
+                        "type": "number",
+                        "minimum": 0
+                    },
+                    Props.BACKOFF_FACTOR: {
+                        "description": "The multiplier of the delay between successive checks of a job",
+                        "type": "number",
+                        "minimum": 1
+                    },
+                    Props.MAX_CHECK_INTERVAL: {
+                        "description": "The maximum delay (in seconds) between checks of a job (0 for unbounded)",
+                        "type": "number",
+                        "minimum": 0
+                    },
+                    Props.MAX_AGE: {
+                        "description": "The time (in seconds) after which a pending job is given up (0 for never)",
+                        "type": "number",
+                        "minimum": 0
+                    }
+                }
+            },
+            Props.EXPORT: {
+                "type": "object",
+                "properties": {
+                    Props.IN_MEMORY: {
+                        "description": "If true, the archive is built without intermediate series files. "
+                                       "The series points are held in memory up to buckets_memory_limit "
+                                       "bytes (spilled to a temp file above), and the archive up to "
+                                       "spool_max_size bytes",
+                        "type": "boolean"
+                    },
+                    Props.SPOOL_MAX_SIZE: {
+                        "type": "integer",
+                        "minimum": 0
+                    },
+                    Props.PIPELINED: {
+                        "description": "If true, the archive is compressed while being uploaded, using "
+                                       "a chunked request",
+                        "type": "boolean"
+                    },
+                    Props.MAX_ARCHIVE_SIZE: {
+                        "description": "The maximum size (in bytes) of the uploaded archives, the series "
+                                       "being split across several ones if needed (no limit if 0)",
+                        "type": "integer",
+                        "minimum": 0
+                    },
+                    Props.COMPRESSION: {
+                        "type": "object",
+                        "properties": {
+                            Props.METHOD: {
+                                "description": "The compression method of the archive entries",
+                                "enum": sorted(compression.METHODS)
+                            },
+                            Props.LEVEL: {
+                                "description": "The compression level (1: fastest, 9: smallest)",
+                                "type": "integer",
+                                "minimum": 1,
+                                "maximum": 9
+                            },
+                            Props.WORKERS: {
+                                "description": "The count of processes compressing the archive entries "
+                                               "in parallel (compression done in the export process if 1). "
+                                               "Cannot be combined with several export workers",
+                                "type": "integer",
+                                "minimum": 1
+                            }
+                        }
+                    },
+                    Props.MAX_OPEN_FILES: {
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.CHUNK_PERIOD: {
+                        "description": "Time span (in minutes) of the chunks the events are read by. "
+                                       "The whole day is read at once if 0",
+                        "type": "integer",
+                        "minimum": 0
+                    },
+                    Props.COALESCE_BACKLOG: {
+                        "description": "If true, the backlog jobs are merged in batches",
+                        "type": "boolean"
+                    },
+                    Props.MAX_BATCH_DAYS: {
+                        "description": "The maximum count of days merged in a batch",
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.WORKERS: {
+                        "description": "The count of backlog jobs run concurrently",
+                        "type": "integer",
+                        "minimum": 1
+                    },
+                    Props.GROUP_BY_SERIES: {
+                        "type": "boolean"
+                    },
+                    Props.BUCKETS_MEMORY_LIMIT: {
+                        "type": "integer",
+                        "minimum": 0
+                    },
+                    Props.VAR_TYPES: {
+                        "description": "The exported variable types, or '%s' for all of them, or '%s' for "
+                                       "the ones used by the variables metadata" % (ALL_VAR_TYPES, VARDEFS_VAR_TYPES),
+                        "anyOf": [
+                            {
+                                "type": "array",
+                                "items": {
+                                    "type": "string"
+                                }
+                            },
+                            {
+                                "enum": [ALL_VAR_TYPES, VARDEFS_VAR_TYPES]
+                            }
+                        ]
+                    }
+                }
+            },
+            Props.JOBS_QUEUE: {
+                "type": "object",
+                "properties": {
+                    Props.BACKEND: {
+                        "description": "The storage backend of the pending jobs",
+                        "enum": list(pjq.BACKENDS)
+                    },
+                    Props.PATH: {
+                        "description": "The path of the pending jobs storage (backend default one if empty)",
+                        "type": "string"
+                    }
+                }
+            },
+            Props.VARDEFS: {
+                "type": "object",
+                "properties": {
+                    Props.INCREMENTAL: {
+                        "description": "If true, only new or modified variable definitions are uploaded",
+                        "type": "boolean"
+                    },
+                    Props.PATH: {
+                        "description": "The path of the uploaded definitions state (default one if empty)",
+                        "type": "string"
+                    }
+                }
+            },
+            Props.CHECKPOINTS: {
+                "type": "object",
+                "properties": {
+                    Props.ENABLED: {
+                        "description": "If true, the archives of the export jobs are kept until uploaded, "
+                                       "so that failed jobs are resumed without exporting the events again. "
+                                       "The archives are then always built as files, the series being "
+                                       "produced as defined by the export mode",
+                        "type": "boolean"
+                    },
+                    Props.PATH: {
+                        "description": "The path of the checkpoints directory (default one if empty)",
+                        "type": "string"
+                    }
+                }
+            },
+            Props.UPLOAD_LEDGER: {
+                "type": "object",
+                "properties": {
+                    Props.ENABLED: {
+                        "description": "If true, the archives identical to an already uploaded one are not sent",
+                        "type": "boolean"
+                    },
+                    Props.PATH: {
+                        "description": "The path of the upload ledger (default one if empty)",
+                        "type": "string"
+                    },
+                    Props.RETENTION: {
+                        "description": "The time (in days) the uploads are remembered for",
+                        "type": "integer",
+                        "minimum": 1
+                    }
+                }
+            },
+            Props.INTRADAY: {
+                "type": "object",
+                "properties": {
+                    Props.ENABLED: {
+                        "description": "If true, each run exports the events produced since the previous one, "
+                                       "instead of the events of a whole past day",
+                        "type": "boolean"
+                    },
+                    Props.PATH: {
+                        "description": "The path of the series watermarks (default one if empty)",
+                        "type": "string"
+                    },
+                    Props.LAG: {
+                        "description": "The delay (in minutes) left to the events for reaching the events log",
+                        "type": "integer",
+                        "minimum": 0
+                    },
+                    Props.MAX_LOOKBACK: {
+                        "description": "How far (in minutes) before the end of the previous export the late "
+                                       "events of a series are looked for",
+                        "type": "integer",
+                        "minimum": 0
+                    }
+                }
+            },
             Props.DEBUG: {
                 "type": "boolean"
             }
@@ -508,18 +1645,74 @@ class ProcessConfiguration(Loggable):
     DEFAULTS = {
         Props.DATE_OFFSET: 1,
         Props.SERVER: {
-            Props.CONNECT_TIMEOUT: 60
+            Props.CONNECT_TIMEOUT: 60,
+            Props.READ_TIMEOUT: 300,
+            Props.POOL_SIZE: sessions.DEFAULT_POOL_SIZE,
+            Props.CONNECT_RETRIES: sessions.DEFAULT_CONNECT_RETRIES
         },
         Props.API_URLS: {
             Props.DATA_UPLOAD: 'http://%(host)s/api/dss/sites/%(site)s/series',
             Props.DEFS_UPLOAD: 'http://%(host)s/api/dss/sites/%(site)s/vardefs',
-            Props.JOB_STATUS: 'http://%(host)s/api/dss/sites/%(site)s/jobs/%(job_id)s/status'
+            Props.JOB_STATUS: 'http://%(host)s/api/dss/sites/%(site)s/jobs/%(job_id)s/status',
+            Props.JOBS_STATUS: ''
         },
         Props.RETRIES: {
             Props.MAX_ATTEMPTS: 3,
             Props.DELAY: 10
         },
         Props.STATUS_MONITORING_PERIOD: 60,
+        Props.MONITOR: {
+            Props.CONCURRENCY: 4,
+            Props.REQUEST_TIMEOUT: 30,
+            Props.BATCH_SIZE: 50,
+            Props.QUEUE_CHECK_PERIOD: 2,
+            Props.FIRST_CHECK_DELAY: 10,
+            Props.BACKOFF_FACTOR: 2,
+            Props.MAX_CHECK_INTERVAL: 3600,
+            Props.MAX_AGE: 7 * 24 * 3600
+        },
+        Props.EXPORT: {
+            Props.IN_MEMORY: False,
+            Props.SPOOL_MAX_SIZE: SPOOL_MAX_SIZE,
+            Props.PIPELINED: False,
+            Props.MAX_ARCHIVE_SIZE: 0,
+            Props.COMPRESSION: {
+                Props.METHOD: compression.METHOD_DEFLATE,
+                Props.LEVEL: compression.DEFAULT_LEVEL,
+                Props.WORKERS: 1
+            },
+            Props.MAX_OPEN_FILES: DEFAULT_MAX_OPEN_FILES,
+            Props.CHUNK_PERIOD: 0,
+            Props.COALESCE_BACKLOG: False,
+            Props.MAX_BATCH_DAYS: 7,
+            Props.WORKERS: 1,
+            Props.GROUP_BY_SERIES: False,
+            Props.BUCKETS_MEMORY_LIMIT: DEFAULT_BUCKETS_MEMORY_LIMIT,
+            Props.VAR_TYPES: [VarTypes.ENERGY]
+        },
+        Props.JOBS_QUEUE: {
+            Props.BACKEND: pjq.BACKEND_FILE,
+            Props.PATH: ''
+        },
+        Props.VARDEFS: {
+            Props.INCREMENTAL: True,
+            Props.PATH: ''
+        },
+        Props.CHECKPOINTS: {
+            Props.ENABLED: False,
+            Props.PATH: ''
+        },
+        Props.UPLOAD_LEDGER: {
+            Props.ENABLED: False,
+            Props.PATH: '',
+            Props.RETENTION: 30
+        },
+        Props.INTRADAY: {
+            Props.ENABLED: False,
+            Props.PATH: '',
+            Props.LAG: 5,
+            Props.MAX_LOOKBACK: 120
+        },
         Props.DEBUG: False
     }
 
@@ -548,9 +1741,15 @@ class ProcessConfiguration(Loggable):
 
         try:
             jsonschema.validate(cfg, self.SCHEMA)
-        except jsonschema.ValidationError() as e:
+        except jsonschema.ValidationError as e:
             raise ConfigurationError(e)
 
+        # the compression processes would be forked from the threads running the jobs, which can
+        # deadlock them (locks held by other threads are inherited in their acquired state)
+        cfg_export = cfg[self.Props.EXPORT]
+        if cfg_export[self.Props.WORKERS] > 1 and cfg_export[self.Props.COMPRESSION][self.Props.WORKERS] > 1:
+            raise ConfigurationError('compression workers cannot be used with concurrent export workers')
+
         self.data = cfg
 
     def save(self, path):
@@ -574,6 +1773,8 @@ def _deep_update(d, u):
         else:
             if isinstance(v, dict):
                 _deep_update(d[k], v)
+            else:
+                d[k] = v
 
 
 class ConfigurationError(DWHException):
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Shared HTTP sessions for the requests sent to the DataWareHouse server.
+
+Sessions keep their connections alive and pool them, so that successive uploads and job status
+queries sent to the same server do not pay for a new TCP (and TLS) connection setup each time.
+They are shared by all the users of a given server in the process, and are thread safe.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+DEFAULT_POOL_SIZE = 4
+""" Default maximum count of connections kept alive per server """
+DEFAULT_CONNECT_RETRIES = 2
+""" Default count of retries when the connection to the server cannot be established """
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, connect_retries=DEFAULT_CONNECT_RETRIES):
+    """ Creates a new session, with a connection pool of the given size.
+
+    Only connection failures are retried at this level, since the request has not been sent
+    yet in this case. Other failures are left to the retry policies of the callers, which know if
+    the request can be safely re-sent.
+
+    :param int pool_size: the maximum count of connections kept alive per host
+    :param int connect_retries: the count of retries when a connection cannot be established
+    :rtype: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, backoff_factor=0.5)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(host, pool_size=DEFAULT_POOL_SIZE, connect_retries=DEFAULT_CONNECT_RETRIES):
+    """ Returns the session shared by all the requests sent to a given server, creating it if
+    needed.
+
+    The pool settings are used only when the session is created.
+
+    :param str host: the server host
+    :param int pool_size: the maximum count of connections kept alive
+    :param int connect_retries: the count of retries when a connection cannot be established
+    :rtype: requests.Session
+    """
+    with _sessions_lock:
+        try:
+            return _sessions[host]
+        except KeyError:
+            session = _sessions[host] = make_session(pool_size=pool_size, connect_retries=connect_retries)
+            return session
+
+
+def close_sessions():
+    """ Closes all the shared sessions, and the connections they hold.
+    """
+    with _sessions_lock:
+        for session in _sessions.itervalues():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Ledger of the archives accepted by the DataWareHouse server.
+
+An export job can be run again after its archive has been successfully uploaded, if the process
+stopped before the job backlog entry was cleared. The ledger records the content hash of the
+uploaded archives, together with the dates they cover and the id of the server job processing
+them, so that such duplicate uploads can be detected and skipped.
+
+The content hash of an archive is computed from the names, CRCs and sizes of its entries, as stored
+in its central directory. It thus does not depend on the time the archive has been built at, nor
+on the compression settings, and is obtained without reading the compressed data.
+"""
+
+import hashlib
+import json
+import os
+import time
+import zipfile
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+DEFAULT_RETENTION = 30 * 24 * 3600
+""" Default time (in seconds) the uploads are remembered for """
+
+
+def archive_content_hash(archive):
+    """ Returns the content hash of a ZIP archive.
+
+    :param archive: the path of the archive, or an opened file-like object containing it (its
+        position is restored afterwards)
+    :rtype: str
+    """
+    pos = None if isinstance(archive, basestring) else archive.tell()
+    sha1 = hashlib.sha1()
+    with zipfile.ZipFile(archive, 'r') as zf:
+        for zinfo in sorted(zf.infolist(), key=lambda zi: zi.filename):
+            sha1.update('%s\0%08x\0%d\n' % (zinfo.filename, zinfo.CRC, zinfo.file_size))
+    if pos is not None:
+        archive.seek(pos)
+    return sha1.hexdigest()
+
+
+def _dates_key(dates):
+    return ','.join(sorted(d.isoformat() for d in dates))
+
+
+class UploadLedger(object):
+    """ The uploaded archives, keyed by their content hash and the dates they cover.
+    """
+    DEFAULT_PATH = "/var/db/cstbox/dwh-uploads.json"
+
+    def __init__(self, path=DEFAULT_PATH, retention=DEFAULT_RETENTION):
+        """
+        :param str path: the path of the storage file. Will be created when first saved
+        :param int retention: the time (in seconds) the uploads are remembered for
+        """
+        if not path:
+            raise ValueError("path argument cannot be empty")
+
+        self._path = path
+        self._retention = retention
+        self._uploads = {}
+        if os.path.exists(self._path):
+            self.load()
+
+    def load(self):
+        """ Loads the ledger from disk
+        """
+        with file(self._path, 'rt') as fp:
+            self._uploads = json.load(fp)
+
+    def save(self):
+        """ Saves the ledger to disk, replacing the file atomically
+        """
+        tmp_path = self._path + '.tmp'
+        with file(tmp_path, 'wt') as fp:
+            json.dump(self._uploads, fp)
+        os.rename(tmp_path, self._path)
+
+    def lookup(self, content_hash, dates):
+        """ Returns the id of the server job which processed an identical archive.
+
+        :param str content_hash: the content hash of the archive (see :func:`archive_content_hash`)
+        :param dates: the dates covered by the archive
+        :returns: the server job id, or None if no identical archive has been uploaded
+        """
+        try:
+            job_id, _ = self._uploads[content_hash + '@' + _dates_key(dates)]
+            return job_id
+        except KeyError:
+            return None
+
+    def record(self, content_hash, dates, job_id, upload_time=None):
+        """ Records an upload accepted by the server, and saves the ledger.
+
+        The uploads older than the retention time are forgotten at the same time.
+
+        :param str content_hash: the content hash of the archive
+        :param dates: the dates covered by the archive
+        :param job_id: the id of the server job processing the archive
+        :param float upload_time: the upload time (now if not provided)
+        """
+        now = time.time()
+        self.prune(now)
+        self._uploads[content_hash + '@' + _dates_key(dates)] = (job_id, upload_time or now)
+        self.save()
+
+    def prune(self, now=None):
+        """ Forgets the uploads older than the retention time.
+
+        :param float now: the current time (used by unit tests)
+        """
+        limit = (now or time.time()) - self._retention
+        for key in [key for key, (_, upload_time) in self._uploads.iteritems() if upload_time < limit]:
+            del self._uploads[key]
+
+    def __len__(self):
+        return len(self._uploads)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Persistent state of the variable definitions uploaded to the DataWareHouse server.
+
+Since the server accepts a subset of the variable definitions, and leaves the other ones untouched,
+only the definitions added or modified since the last successful upload need to be sent. They are
+identified by comparing the hash of their content with the one stored at that time.
+
+The state is only valid for the server and the site it has been built for, which are stored with
+it. All the definitions are considered as changed when uploading them to another target.
+"""
+
+import hashlib
+import json
+import os
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+VARNAME = 'varname'
+""" The key of the variable name in the definitions """
+
+TARGET = 'target'
+HOST = 'host'
+SITE_CODE = 'site_code'
+HASHES = 'hashes'
+""" The keys of the storage file content """
+
+
+def definition_hash(vardef):
+    """ Returns the hash of a variable definition content.
+
+    :param dict vardef: the definition, as produced by :class:`pycstbox.dwh.filters.VariableDefsExportFilter`
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps(vardef, sort_keys=True)).hexdigest()
+
+
+class UploadedDefinitions(object):
+    """ The hashes of the variable definitions known by the server, keyed by the variable name.
+    """
+    DEFAULT_PATH = "/var/db/cstbox/dwh-vardefs.json"
+
+    def __init__(self, path=DEFAULT_PATH, host=None, site_code=None):
+        """
+        :param str path: the path of the storage file. Will be created when first saved
+        :param str host: the server the definitions are uploaded to
+        :param str site_code: the site the definitions belong to
+        """
+        if not path:
+            raise ValueError("path argument cannot be empty")
+
+        self._path = path
+        self._target = {HOST: host, SITE_CODE: site_code}
+        self._hashes = {}
+        if os.path.exists(self._path):
+            self.load()
+
+    def load(self):
+        """ Loads the hashes from disk.
+
+        They are ignored if they have been stored for another server or site, or by a version
+        which did not store them.
+        """
+        with file(self._path, 'rt') as fp:
+            state = json.load(fp)
+        if state.get(TARGET) == self._target:
+            self._hashes = state[HASHES]
+        else:
+            self._hashes = {}
+
+    def save(self):
+        """ Saves the hashes to disk, replacing the file atomically
+        """
+        tmp_path = self._path + '.tmp'
+        with file(tmp_path, 'wt') as fp:
+            json.dump({TARGET: self._target, HASHES: self._hashes}, fp)
+        os.rename(tmp_path, self._path)
+
+    def changed(self, vardefs):
+        """ Returns the definitions which are new or have been modified since the last upload.
+
+        :param list vardefs: the current definitions
+        :rtype: list
+        """
+        hashes = self._hashes
+        return [vdef for vdef in vardefs if hashes.get(vdef[VARNAME]) != definition_hash(vdef)]
+
+    def set_uploaded(self, vardefs):
+        """ Records a set of definitions as the one known by the server, and saves it.
+
+        :param list vardefs: the current definitions, once uploaded
+        """
+        self._hashes = dict((vdef[VARNAME], definition_hash(vdef)) for vdef in vardefs)
+        self.save()
+
+    def clear(self):
+        """ Forgets the uploaded definitions, so that all of them will be sent next time
+        """
+        self._hashes = {}
+        self.save()
+
+    def __len__(self):
+        return len(self._hashes)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of CSTBox.
+#
+# CSTBox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CSTBox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with CSTBox.  If not, see <http://www.gnu.org/licenses/>.
+
+""" High-watermarks of the incremental events export.
+
+In the incremental (intraday) export mode, the timestamp of the last exported event of each series
+is remembered, so that the next export only includes the events which are more recent. Keeping a
+watermark per series allows exporting the events of a device which reached the events log late,
+without sending again the ones of the other series.
+
+The end of the time range covered by the last export is stored too, since it is where the next
+export must start from for the series which do not produce events anymore.
+"""
+
+import datetime
+import json
+import os
+
+__author__ = 'Eric PASCUAL - CSTB (eric.pascual@cstb.fr)'
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class ExportWatermarks(object):
+    """ The timestamps of the last exported events, keyed by the variable name.
+    """
+    DEFAULT_PATH = "/var/db/cstbox/dwh-watermarks.json"
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param str path: the path of the storage file. Will be created when first saved
+        """
+        if not path:
+            raise ValueError("path argument cannot be empty")
+
+        self._path = path
+        self._marks = {}
+        self.end = None
+        """ The end of the time range covered by the last export """
+        if os.path.exists(self._path):
+            self.load()
+
+    def load(self):
+        """ Loads the watermarks from disk
+        """
+        with file(self._path, 'rt') as fp:
+            state = json.load(fp)
+        self._marks = dict(
+            (var_name, datetime.datetime.strptime(ts, TIMESTAMP_FORMAT))
+            for var_name, ts in state['series'].iteritems()
+        )
+        self.end = datetime.datetime.strptime(state['end'], TIMESTAMP_FORMAT) if state['end'] else None
+
+    def save(self):
+        """ Saves the watermarks to disk, replacing the file atomically
+        """
+        tmp_path = self._path + '.tmp'
+        with file(tmp_path, 'wt') as fp:
+            json.dump({
+                'end': self.end.strftime(TIMESTAMP_FORMAT) if self.end else None,
+                'series': dict((var_name, ts.strftime(TIMESTAMP_FORMAT)) for var_name, ts in self._marks.iteritems())
+            }, fp)
+        os.rename(tmp_path, self._path)
+
+    def get(self, var_name):
+        """ Returns the timestamp of the last exported event of a series.
+
+        :param str var_name: the variable name
+        :returns: the timestamp, or None if no event of this series has been exported yet
+        :rtype: datetime.datetime
+        """
+        return self._marks.get(var_name)
+
+    def read_start(self, lookback):
+        """ Returns the time from which the events must be read by the next export.
+
+        This is the oldest of the watermarks, so that no series misses any event, but not older
+        than the end of the last export minus a given look-back period, so that a series which
+        stopped producing events does not make each export read a growing time range.
+
+        :param datetime.timedelta lookback: the look-back period
+        :returns: the time, or None if nothing has been exported yet
+        :rtype: datetime.datetime
+        """
+        if self.end is None:
+            return None
+        if not self._marks:
+            return self.end
+        return max(min(min(self._marks.itervalues()), self.end), self.end - lookback)
+
+    def new_events(self, events, exported=None):
+        """ Iterates over the events which are more recent than the watermark of their series.
+
+        :param events: the events
+        :param dict exported: if provided, updated with the timestamp of the last yielded event of
+            each series, to be passed to :meth:`update` once the events have been exported
+        :returns: an iterator of the new events
+        """
+        marks = self._marks
+        if exported is None:
+            exported = {}
+        for evt in events:
+            var_name = evt.var_name
+            mark = marks.get(var_name)
+            if mark is not None and evt.timestamp <= mark:
+                continue
+            last = exported.get(var_name)
+            if last is None or evt.timestamp > last:
+                exported[var_name] = evt.timestamp
+            yield evt
+
+    def update(self, exported, end):
+        """ Advances the watermarks of the series which events have been exported, and saves them.
+
+        :param dict exported: the timestamps of the last exported event of the series
+        :param datetime.datetime end: the end of the time range covered by the export
+        """
+        self.end = end
+        for var_name, ts in exported.iteritems():
+            mark = self._marks.get(var_name)
+            if mark is None or ts > mark:
+                self._marks[var_name] = ts
+        self.save()
+
+    def __len__(self):
+        return len(self._marks)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the archive compression settings, showing the archive size against the CPU time
+(including the one of the worker processes) and the elapsed time, on synthetic series data.
+
+Usage: python bench_compression.py [series_count [events_per_series]]
+"""
+
+import io
+import os
+import random
+import sys
+import time
+
+from pycstbox.dwh.compression import CompressingZipFile, METHODS, METHOD_STORED, METHOD_DEFLATE
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+SETTINGS = [(METHOD_STORED, 0, 1)] + [
+    (METHOD_DEFLATE, level, workers) for level in (1, 6, 9) for workers in (1, 2, 4)
+]
+
+
+def _make_series(series_count, events_count):
+    """ Returns the content of series files, mimicking the ones produced by the export filters.
+    """
+    rnd = random.Random(0)
+    series = []
+    for num in xrange(series_count):
+        value = 20.
+        lines = []
+        for i in xrange(events_count):
+            value += rnd.uniform(-0.1, 0.1)
+            lines.append('2015-06-01T%02d:%02d:%02d.000,temperature,var_%d,%.2f,degC\n' % (
+                i // 3600 % 24, i // 60 % 60, i % 60, num, value
+            ))
+        series.append(('var_%d.csv' % num, ''.join(lines)))
+    return series
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def bench_matrix(series_count, events_count):
+    series = _make_series(series_count, events_count)
+    raw_size = sum(len(content) for _, content in series)
+    print('%d series, %d bytes of raw data' % (series_count, raw_size))
+    print('%8s %6s %8s %12s %7s %10s %10s' % ('method', 'level', 'workers', 'size', 'ratio', 'cpu (s)', 'wall (s)'))
+
+    for method, level, workers in SETTINGS:
+        buf = io.BytesIO()
+        cpu, wall = _cpu_time(), time.time()
+        with CompressingZipFile(buf, 'w', compression=METHODS[method], level=level or 6, workers=workers) as archive:
+            for name, content in series:
+                archive.writestr(name, content)
+        cpu, wall = _cpu_time() - cpu, time.time() - wall
+        size = len(buf.getvalue())
+        print('%8s %6s %8d %12d %7.3f %10.3f %10.3f' % (
+            method, level or '-', workers, size, float(size) / raw_size, cpu, wall
+        ))
+
+
+if __name__ == '__main__':
+    bench_matrix(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    )
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the series export formatters, compared to the generic formatting they replace.
+
+Usage: python bench_formatters.py [points_count]
+"""
+
+import sys
+import timeit
+import datetime
+import calendar
+import random
+
+from pycstbox.dwh.filters import DTFMT_POINT, maybe_boolean
+from pycstbox.dwh.formatters import PointTimestampFormatter, encode_value, series_value_encoder
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+def _make_timestamps(count):
+    # one point every 10 seconds, as for a dense meter
+    t0 = datetime.datetime(2015, 11, 4)
+    return [t0 + datetime.timedelta(seconds=10 * i) for i in xrange(count)]
+
+
+def _bench(label, func, reference=None, repeat=3):
+    elapsed = min(timeit.repeat(func, number=1, repeat=repeat))
+    if reference:
+        print('%-30s %8.3f s  (x%.1f)' % (label, elapsed, reference / elapsed))
+    else:
+        print('%-30s %8.3f s' % (label, elapsed))
+    return elapsed
+
+
+def bench_timestamps(count):
+    timestamps = _make_timestamps(count)
+    epochs = [calendar.timegm(ts.timetuple()) for ts in timestamps]
+    print('time stamps formatting (%d points)' % count)
+
+    ref = _bench('strftime', lambda: [ts.strftime(DTFMT_POINT) for ts in timestamps])
+
+    def _datetime():
+        fmt = PointTimestampFormatter().format_datetime
+        return [fmt(ts) for ts in timestamps]
+
+    def _epoch():
+        fmt = PointTimestampFormatter().format_epoch
+        return [fmt(ts) for ts in epochs]
+
+    _bench('formatter (datetime)', _datetime, ref)
+    _bench('formatter (epoch)', _epoch, ref)
+
+
+def bench_values(count):
+    rnd = random.Random(42)
+    for label, values in (
+        ('float', [rnd.uniform(0, 1000) for _ in xrange(count)]),
+        ('int', [rnd.randint(0, 100000) for _ in xrange(count)]),
+        ('bool', [rnd.random() > 0.5 for _ in xrange(count)]),
+    ):
+        print('%s values formatting (%d points)' % (label, count))
+
+        ref = _bench('maybe_boolean(str())', lambda: [maybe_boolean(str(v)) for v in values])
+        _bench('encode_value', lambda: [encode_value(v) for v in values], ref)
+
+        def _series():
+            encode = series_value_encoder(values[0])
+            return [encode(v) for v in values]
+
+        _bench('series_value_encoder', _series, ref)
+
+
+if __name__ == '__main__':
+    _count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    bench_timestamps(_count)
+    bench_values(_count)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark of the variable definitions export on synthetic device networks, showing how its
+duration scales with the count of outputs.
+
+Usage: python bench_vardefs.py [max_outputs_count]
+"""
+
+import sys
+import timeit
+
+from pycstbox.dwh.filters import VariableDefsExportFilter, DeviceMetadataCache
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+OUTPUTS_PER_DEVICE = 8
+DEVICE_TYPES = ['synth:type%d' % i for i in xrange(10)]
+
+
+class _Device(object):
+    def __init__(self, devtype, outputs):
+        self.type = devtype
+        self.enabled = True
+        self.outputs = outputs
+
+
+def _load_metadata(devtype):
+    return {
+        'pdefs': {
+            'outputs': {
+                '*': {'__vartype__': 'temperature', '__varunits__': 'degC'}
+            }
+        }
+    }
+
+
+def _make_config(outputs_count):
+    """ Returns a devices configuration, as organized by the device manager (i.e. devices grouped
+    by coordinator), with the given count of enabled outputs.
+    """
+    devices = {}
+    for dev_num in xrange(outputs_count // OUTPUTS_PER_DEVICE):
+        outputs = dict(
+            ('out%d' % i, {'enabled': True, 'varname': 'var_%d_%d' % (dev_num, i)})
+            for i in xrange(OUTPUTS_PER_DEVICE)
+        )
+        devices['dev%d' % dev_num] = _Device(DEVICE_TYPES[dev_num % len(DEVICE_TYPES)], outputs)
+    return {'synth': devices}
+
+
+def bench_scaling(max_count):
+    print('variable definitions export (%d outputs per device)' % OUTPUTS_PER_DEVICE)
+    print('%10s %10s %16s' % ('outputs', 'time (s)', 'per output (us)'))
+
+    exp_filter = VariableDefsExportFilter('bench', devices_metadata=DeviceMetadataCache(_load_metadata))
+    count = max_count // 16
+    while count <= max_count:
+        cfg = _make_config(count)
+        elapsed = min(timeit.repeat(lambda: exp_filter.export_variable_definitions(cfg), number=1, repeat=3))
+        print('%10d %10.3f %16.2f' % (count, elapsed, elapsed / count * 1e6))
+        count *= 2
+
+
+if __name__ == '__main__':
+    bench_scaling(int(sys.argv[1]) if len(sys.argv) > 1 else 160000)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import io
+import tempfile
+import zipfile
+
+from pycstbox.dwh.compression import CompressingZipFile
+from pycstbox.dwh.process import ProcessConfiguration, ConfigurationError
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+def _entries(count=10, size=20000):
+    return [
+        ('series-%d.csv' % i, ''.join('2015-06-%02d 10:00:%02d,%d\n' % (i + 1, n % 60, n) for n in xrange(size // 24)))
+        for i in xrange(count)
+    ]
+
+
+class CompressingZipFileTestCase(unittest.TestCase):
+    def _check_archive(self, buf, entries, compress_type):
+        buf.seek(0)
+        with zipfile.ZipFile(buf, 'r') as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [name for name, _ in entries])
+            for name, content in entries:
+                self.assertEqual(archive.read(name), content)
+                self.assertEqual(archive.getinfo(name).compress_type, compress_type)
+
+    def _build(self, entries, **kwargs):
+        buf = io.BytesIO()
+        with CompressingZipFile(buf, 'w', **kwargs) as archive:
+            for name, content in entries:
+                archive.writestr(name, content)
+        return buf
+
+    def test_01_levels(self):
+        entries = _entries()
+        sizes = []
+        for level in (1, 9):
+            buf = self._build(entries, level=level)
+            self._check_archive(buf, entries, zipfile.ZIP_DEFLATED)
+            sizes.append(len(buf.getvalue()))
+        self.assertLess(sizes[1], sizes[0])
+
+    def test_02_stored(self):
+        entries = _entries(count=3)
+        buf = self._build(entries, compression=zipfile.ZIP_STORED)
+        self._check_archive(buf, entries, zipfile.ZIP_STORED)
+        self.assertGreater(len(buf.getvalue()), sum(len(content) for _, content in entries))
+
+    def test_03_workers(self):
+        entries = _entries(count=20)
+        buf = self._build(entries, workers=2)
+        self._check_archive(buf, entries, zipfile.ZIP_DEFLATED)
+
+        # the parallel compression produces the same entries as the sequential one
+        buf.seek(0)
+        sequential = self._build(entries)
+        with zipfile.ZipFile(buf) as parallel, zipfile.ZipFile(sequential) as reference:
+            self.assertEqual(
+                [(i.CRC, i.compress_size) for i in parallel.infolist()],
+                [(i.CRC, i.compress_size) for i in reference.infolist()]
+            )
+
+    def test_04_write_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'some content\n' * 100)
+            os.close(fd)
+            buf = io.BytesIO()
+            with CompressingZipFile(buf, 'w', workers=2) as archive:
+                archive.write(path, 'data.txt')
+            self._check_archive(buf, [('data.txt', 'some content\n' * 100)], zipfile.ZIP_DEFLATED)
+        finally:
+            os.remove(path)
+
+
+class CompressionConfigurationTestCase(unittest.TestCase):
+    def _load(self, export_workers, compression_workers):
+        cfg = ProcessConfiguration()
+        cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest'
+            },
+            ProcessConfiguration.Props.EXPORT: {
+                ProcessConfiguration.Props.WORKERS: export_workers,
+                ProcessConfiguration.Props.COMPRESSION: {
+                    ProcessConfiguration.Props.WORKERS: compression_workers
+                }
+            }
+        })
+        return cfg
+
+    def test_01_workers(self):
+        """ Checks that compression workers are rejected when jobs are run concurrently
+        """
+        self._load(1, 4)
+        self._load(4, 1)
+        self.assertRaises(ConfigurationError, self._load, 4, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,12 +8,17 @@ import logging
 import requests
 import json
 import tempfile
+import shutil
 import zipfile
 
+import pycstbox.export
 from pycstbox.events import TimedEvent
 
-from pycstbox.dwh.filters import EventsExportFilter
-from pycstbox.dwh.process import DWHEventsExportJob, ProcessConfiguration, PARM_EXTRACT_DATE
+from pycstbox.dwh.filters import EventsExportFilter, DEFAULT_BUCKETS_MEMORY_LIMIT
+from pycstbox.dwh import process
+from pycstbox.dwh.process import DWHEventsExportJob, DWHEventsExportProcess, ProcessConfiguration, \
+    PARM_EXTRACT_DATE, iter_day_events, iter_days_events
+from pycstbox.dwh.checkpoints import ExportCheckpoints
 
 __author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
 
@@ -37,12 +42,22 @@ class TestCase01(unittest.TestCase):
         ok = None
         message = None
 
-    def mock_post(self, url, files=None, **kwargs):
-        zip = files['zip']
-        zip.seek(0)
+    def mock_post(self, url, files=None, data=None, headers=None, **kwargs):
+        if files:
+            zip = files['zip']
+            if isinstance(zip, tuple):
+                _, zip = zip
+            zip.seek(0)
+            content = zip.read()
+        else:
+            # streamed multipart body
+            boundary = headers['Content-Type'].split('boundary=')[1]
+            body = ''.join(data)
+            _, content = body.split('\r\n\r\n', 1)
+            content, _ = content.rsplit('\r\n--%s--' % boundary, 1)
 
         tmp = tempfile.NamedTemporaryFile(suffix='.zip', delete=False)
-        tmp.write(zip.read())
+        tmp.write(content)
         tmp.close()
         self.tmp = tmp
 
@@ -61,9 +76,13 @@ class TestCase01(unittest.TestCase):
 
     def setUp(self):
         self.filter = EventsExportFilter("unittest")
-        requests.post = self.mock_post
+        self._session_post = requests.Session.post
+        requests.Session.post = self.mock_post
         self.tmp = None
 
+    def tearDown(self):
+        requests.Session.post = self._session_post
+
     def test_01(self):
         count, files = self.filter.export_events(events=self.events)
 
@@ -77,6 +96,77 @@ class TestCase01(unittest.TestCase):
             '/tmp/type3_var30.tsv',
         })
 
+    def test_01_bounded_open_files(self):
+        """ Checks that limiting the count of opened files does not alter the result
+        """
+        expected = {}
+        count, files = self.filter.export_events(events=self.events)
+        for path in files:
+            with file(path) as fp:
+                expected[path] = fp.read()
+
+        filter_ = EventsExportFilter("unittest", max_open_files=1)
+        count, files = filter_.export_events(events=self.events)
+        self.assertEqual(count, 6)
+        self.assertSetEqual(set(files), set(expected))
+        for path in files:
+            with file(path) as fp:
+                self.assertEqual(fp.read(), expected[path])
+
+    def test_01_grouped(self):
+        """ Checks that grouping events by series produces the same files, with or without spilling
+        """
+        expected = {}
+        count, files = self.filter.export_events(events=self.events)
+        for path in files:
+            with file(path) as fp:
+                expected[path] = fp.read()
+
+        for memory_limit in (DEFAULT_BUCKETS_MEMORY_LIMIT, 0):
+            filter_ = EventsExportFilter("unittest", group_by_series=True, buckets_memory_limit=memory_limit)
+            count, files = filter_.export_events(events=self.events)
+            self.assertEqual(count, 6)
+            self.assertSetEqual(set(files), set(expected))
+            for path in files:
+                with file(path) as fp:
+                    self.assertEqual(fp.read(), expected[path])
+
+    def test_01_to_archive(self):
+        """ Checks that exporting to an archive produces the same series, with or without spilling
+        """
+        expected = {}
+        count, files = self.filter.export_events(events=self.events)
+        for path in files:
+            with file(path) as fp:
+                expected[os.path.basename(path)] = fp.read()
+
+        for memory_limit in (DEFAULT_BUCKETS_MEMORY_LIMIT, 0):
+            filter_ = EventsExportFilter("unittest", buckets_memory_limit=memory_limit)
+            buf = tempfile.TemporaryFile()
+            try:
+                with zipfile.ZipFile(buf, 'w') as archive:
+                    count, entries = filter_.export_events_to_archive(self.events, archive)
+                self.assertEqual(count, 6)
+                self.assertSetEqual(set(entries), set(expected))
+                with zipfile.ZipFile(buf) as archive:
+                    for name in entries:
+                        self.assertEqual(archive.read(name), expected[name])
+            finally:
+                buf.close()
+
+    def test_01_var_types(self):
+        """ Checks the selection of the exported variable types
+        """
+        for group_by_series in (False, True):
+            filter_ = EventsExportFilter("unittest", var_types=['type1', 'type3'], group_by_series=group_by_series)
+            count, files = filter_.export_events(events=self.events)
+            self.assertEqual(count, 4)
+            self.assertSetEqual(set(files), {
+                '/tmp/type1_var10.tsv',
+                '/tmp/type1_var11.tsv',
+                '/tmp/type3_var30.tsv',
+            })
+
     def test_02(self):
         job_cfg = ProcessConfiguration()
         job_cfg.load_dict({
@@ -114,6 +204,471 @@ class TestCase01(unittest.TestCase):
         finally:
             job.cleanup()
 
+    def test_03(self):
+        """ Checks the in-memory export mode, where no intermediate series file is created
+        """
+        job_cfg = ProcessConfiguration()
+        job_cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest',
+                ProcessConfiguration.Props.AUTH: {
+                    ProcessConfiguration.Props.LOGIN: 'john.doe',
+                    ProcessConfiguration.Props.PASSWORD: 'letmein'
+                }
+            },
+            ProcessConfiguration.Props.EXPORT: {
+                ProcessConfiguration.Props.IN_MEMORY: True
+            }
+        })
+        self.assertTrue(job_cfg[ProcessConfiguration.Props.EXPORT][ProcessConfiguration.Props.IN_MEMORY])
+
+        job_parms = {
+            PARM_EXTRACT_DATE: datetime.datetime(2015, 11, 03, 0, 0)
+        }
+        job = DWHEventsExportJob(jobname='unittest', jobid=42, config=job_cfg, parms=job_parms)
+        job.log_setLevel(logging.ERROR)
+
+        count, buf = job.create_spooled_archive(self.filter, self.events)
+        self.assertEqual(count, 6)
+
+        try:
+            job._archive = buf
+            job._archive_name = job.archive_name(datetime.datetime(2015, 11, 04, 0, 0))
+            job.send_data()
+
+            self.assertIsNotNone(self.tmp)
+            arch = zipfile.ZipFile(self.tmp.name)
+            self.assertSetEqual(set(arch.namelist()), {
+                'type1_var10.tsv',
+                'type1_var11.tsv',
+                'type2_var20.tsv',
+                'type2_var21.tsv',
+                'type3_var30.tsv',
+            })
+            self.assertEqual(
+                arch.read('type1_var10.tsv'),
+                "2015-11-04T00:00:00Z\t0\n2015-11-04T00:02:00Z\t2\n"
+            )
+
+        finally:
+            job.cleanup()
+            os.remove(self.tmp.name)
+
+    def test_04(self):
+        """ Checks the pipelined export mode, where the archive is built while being uploaded
+        """
+        job_cfg = ProcessConfiguration()
+        job_cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest',
+                ProcessConfiguration.Props.AUTH: {
+                    ProcessConfiguration.Props.LOGIN: 'john.doe',
+                    ProcessConfiguration.Props.PASSWORD: 'letmein'
+                }
+            }
+        })
+        job_parms = {
+            PARM_EXTRACT_DATE: datetime.datetime(2015, 11, 03, 0, 0)
+        }
+        job = DWHEventsExportJob(jobname='unittest', jobid=42, config=job_cfg, parms=job_parms)
+        job.log_setLevel(logging.ERROR)
+
+        count, buckets = self.filter.bucket_events(self.events)
+        self.assertEqual(count, 6)
+
+        try:
+            job._series_buckets = buckets
+            job._archive_name = job.archive_name(datetime.datetime(2015, 11, 04, 0, 0))
+            job.send_data()
+
+            self.assertIsNotNone(self.tmp)
+            arch = zipfile.ZipFile(self.tmp.name)
+            self.assertEqual(len(arch.filelist), 5)
+            self.assertEqual(
+                arch.read('type1_var10.tsv'),
+                "2015-11-04T00:00:00Z\t0\n2015-11-04T00:02:00Z\t2\n"
+            )
+
+        finally:
+            job.cleanup()
+            os.remove(self.tmp.name)
+
+
+class SplitUploadTestCase(unittest.TestCase):
+    """ Checks the upload of an export split in several archives
+    """
+    class MockResponse(object):
+        def __init__(self, ok, text, status_code=200):
+            self.ok = ok
+            self.text = text
+            self.status_code = status_code
+            self.reason = 'OK' if ok else 'Internal Server Error'
+
+    def mock_post(self, url, files=None, **kwargs):
+        name, buf = files['zip']
+        self.posted.append(name)
+        if name in self.failing:
+            self.failing.remove(name)
+            return self.MockResponse(False, 'failure', 500)
+        if name in self.timing_out:
+            self.timing_out.remove(name)
+            raise requests.Timeout('read timed out')
+        return self.MockResponse(True, json.dumps({'message': 'OK', 'jobID': 'job-%s' % name}))
+
+    def setUp(self):
+        self._session_post = requests.Session.post
+        requests.Session.post = self.mock_post
+        self.posted = []
+        self.failing = set()
+        self.timing_out = set()
+        self.queue_path = tempfile.mktemp(suffix='.jobs')
+
+        cfg = ProcessConfiguration()
+        cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest',
+                ProcessConfiguration.Props.AUTH: {
+                    ProcessConfiguration.Props.LOGIN: 'john.doe',
+                    ProcessConfiguration.Props.PASSWORD: 'letmein'
+                }
+            },
+            ProcessConfiguration.Props.EXPORT: {
+                ProcessConfiguration.Props.IN_MEMORY: True,
+                ProcessConfiguration.Props.MAX_ARCHIVE_SIZE: 1024
+            },
+            ProcessConfiguration.Props.JOBS_QUEUE: {
+                ProcessConfiguration.Props.PATH: self.queue_path
+            }
+        })
+        self.job = DWHEventsExportJob(
+            jobname='unittest', jobid=42, config=cfg,
+            parms={PARM_EXTRACT_DATE: datetime.datetime(2015, 11, 03, 0, 0)}
+        )
+        self.job.log_setLevel(logging.CRITICAL)
+
+        t0 = datetime.datetime(2015, 11, 3)
+        self.events = [
+            TimedEvent(t0 + datetime.timedelta(minutes=m), 'type1', 'var%d' % (m % 20), {'value': m * 7 % 13})
+            for m in xrange(0, 24 * 60, 2)
+        ]
+
+    def tearDown(self):
+        requests.Session.post = self._session_post
+        self.job.cleanup()
+        for path in (self.queue_path, self.queue_path + '.lock'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_01(self):
+        job = self.job
+        filter_ = EventsExportFilter("unittest")
+        count = job.create_archive_parts(
+            lambda archive: filter_.export_events_to_archive(self.events, archive)[0],
+            datetime.datetime(2015, 11, 04, 0, 0), 1024, spool_max_size=1024
+        )
+        self.assertEqual(count, len(self.events))
+
+        part_names = [name for name, _ in job._parts]
+        self.assertGreater(len(part_names), 2)
+        self.assertTrue(part_names[0].endswith('-part01.zip'))
+
+        # the failure of a part does not prevent uploading the other ones...
+        self.failing = {part_names[1]}
+        self.assertRaises(pycstbox.export.ExportError, job.send_data)
+        self.assertEqual(self.posted, part_names)
+
+        # ... and only the failed one is sent again by the retry
+        self.posted = []
+        job.send_data()
+        self.assertEqual(self.posted, [part_names[1]])
+
+        with file(self.queue_path) as fp:
+            queued = set(line.strip().lstrip('+') for line in fp if line.strip())
+        self.assertSetEqual(queued, set('job-%s' % name for name in part_names))
+
+    def test_02_network_error(self):
+        """ Checks that a network error on a part does not prevent uploading the other ones
+        """
+        job = self.job
+        filter_ = EventsExportFilter("unittest")
+        job.create_archive_parts(
+            lambda archive: filter_.export_events_to_archive(self.events, archive)[0],
+            datetime.datetime(2015, 11, 04, 0, 0), 1024, spool_max_size=1024
+        )
+        part_names = [name for name, _ in job._parts]
+
+        self.timing_out = {part_names[0]}
+        self.failing = {part_names[-1]}
+        self.assertRaises(pycstbox.export.ExportError, job.send_data)
+        self.assertEqual(self.posted, part_names)
+
+        self.posted = []
+        job.send_data()
+        self.assertEqual(self.posted, [part_names[0], part_names[-1]])
+
+
+class MockDAO(object):
+    """ In-memory events DAO, with inclusive bounds for both ends of the requested intervals
+    """
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: e.timestamp)
+        self.requests = 0
+
+    def get_events(self, from_time, to_time, var_type=None):
+        self.requests += 1
+        return [
+            e for e in self.events
+            if from_time <= e.timestamp <= to_time and (var_type is None or e.var_type == var_type)
+        ]
+
+    def get_events_for_day(self, day, var_type=None):
+        from_time = datetime.datetime.combine(day, datetime.time())
+        return [
+            e for e in self.get_events(from_time, from_time + datetime.timedelta(days=1), var_type)
+            if e.timestamp.date() == day
+        ]
+
+
+class ChunkedReadTestCase(unittest.TestCase):
+    def test_01(self):
+        """ Checks that reading events by chunks gives the same result as reading the whole day
+        """
+        day = datetime.date(2015, 11, 4)
+        t0 = datetime.datetime.combine(day, datetime.time())
+        dao = MockDAO([
+            TimedEvent(t0 + datetime.timedelta(minutes=m), 'type1', 'var%d' % (m % 3), {'value': m})
+            for m in xrange(-10, 24 * 60 + 10, 5)
+        ])
+        expected = dao.get_events_for_day(day)
+        self.assertEqual(len(expected), 24 * 12)
+
+        for chunk_minutes in (1, 15, 60, 25 * 60):
+            dao.requests = 0
+            events = list(iter_day_events(dao, day, chunk_period=datetime.timedelta(minutes=chunk_minutes)))
+            self.assertEqual(events, expected)
+            self.assertEqual(dao.requests, -(-24 * 60 // min(chunk_minutes, 24 * 60)))
+
+    def test_02(self):
+        """ Checks reading several days, consecutive or not
+        """
+        t0 = datetime.datetime(2015, 11, 1)
+        dao = MockDAO([
+            TimedEvent(t0 + datetime.timedelta(hours=h), 'type1', 'var1', {'value': h})
+            for h in xrange(0, 10 * 24, 3)
+        ])
+        days = [datetime.date(2015, 11, d) for d in (2, 3, 4, 7)]
+        expected = [e for e in dao.events if e.timestamp.date() in days]
+
+        for chunk_period in (None, datetime.timedelta(hours=5)):
+            events = list(iter_days_events(dao, days, chunk_period=chunk_period))
+            self.assertEqual(events, expected)
+
+
+class BacklogCoalescingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.process = DWHEventsExportProcess()
+        self.process.log_setLevel(logging.ERROR)
+        self.backlog = dict(
+            ('job%d' % d, {PARM_EXTRACT_DATE: datetime.date(2015, 11, d)})
+            for d in (5, 1, 2, 3, 4, 2)
+        )
+
+    def _make_cfg(self, coalesce, max_days=7):
+        cfg = ProcessConfiguration()
+        cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest'
+            },
+            ProcessConfiguration.Props.EXPORT: {
+                ProcessConfiguration.Props.COALESCE_BACKLOG: coalesce,
+                ProcessConfiguration.Props.MAX_BATCH_DAYS: max_days
+            }
+        })
+        return cfg
+
+    def test_01(self):
+        """ Checks that backlog jobs are not merged by default
+        """
+        jobs = self.process._make_jobs(self.backlog, self._make_cfg(False))
+        self.assertEqual([covered for _, _, covered in jobs], [['job1'], ['job2'], ['job3'], ['job4'], ['job5']])
+
+    def test_02(self):
+        """ Checks backlog jobs merging, with batches size limit
+        """
+        jobs = self.process._make_jobs(self.backlog, self._make_cfg(True, max_days=3))
+        self.assertEqual([covered for _, _, covered in jobs], [['job1', 'job2', 'job3'], ['job4', 'job5']])
+        self.assertEqual(
+            [job.extract_dates for _, job, _ in jobs],
+            [[datetime.date(2015, 11, d) for d in (1, 2, 3)], [datetime.date(2015, 11, d) for d in (4, 5)]]
+        )
+
+    def test_03_mixed_dates(self):
+        """ Checks that backlogs mixing dates and date times are ordered, with or without merging
+        """
+        self.backlog['job2'][PARM_EXTRACT_DATE] = datetime.datetime(2015, 11, 2, 0, 0)
+        self.backlog['job4'][PARM_EXTRACT_DATE] = datetime.datetime(2015, 11, 4, 0, 0)
+        for coalesce, expected in (
+            (False, [['job1'], ['job2'], ['job3'], ['job4'], ['job5']]),
+            (True, [['job1', 'job2', 'job3'], ['job4', 'job5']])
+        ):
+            jobs = self.process._make_jobs(self.backlog, self._make_cfg(coalesce, max_days=3))
+            self.assertEqual([covered for _, _, covered in jobs], expected)
+
+
+class BacklogReplayTestCase(unittest.TestCase):
+    failing_date = datetime.date(2015, 11, 3)
+
+    class MockBacklog(dict):
+        content = {}
+        instance = None
+
+        def __init__(self, name):
+            dict.__init__(self, self.content)
+            BacklogReplayTestCase.MockBacklog.instance = self
+
+    def mock_job_run(self, job, max_try=1, retry_delay=0):
+        return 2 if self.failing_date in job.extract_dates else 0
+
+    def setUp(self):
+        self.saved = pycstbox.export.Backlog, DWHEventsExportJob.run
+        test = self
+        pycstbox.export.Backlog = self.MockBacklog
+        DWHEventsExportJob.run = lambda job, **kwargs: test.mock_job_run(job, **kwargs)
+
+        self.MockBacklog.content = dict(
+            ('job%d' % d, {PARM_EXTRACT_DATE: datetime.date(2015, 11, d)})
+            for d in xrange(1, 6)
+        )
+        self.process = DWHEventsExportProcess()
+        self.process.log_setLevel(logging.ERROR)
+
+    def tearDown(self):
+        pycstbox.export.Backlog, DWHEventsExportJob.run = self.saved
+
+    def test_01(self):
+        """ Checks failures accounting, with sequential and concurrent runs
+        """
+        for workers in (1, 3):
+            cfg = ProcessConfiguration()
+            cfg.load_dict({
+                ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+                ProcessConfiguration.Props.SERVER: {
+                    ProcessConfiguration.Props.HOST: 'unittest'
+                },
+                ProcessConfiguration.Props.EXPORT: {
+                    ProcessConfiguration.Props.WORKERS: workers
+                }
+            })
+            rc = self.process.run(cfg)
+            self.assertEqual(rc, 2)
+            self.assertEqual(self.process.failed_jobs, {'job3': 2})
+            # only the failed job remains in the backlog
+            self.assertEqual(self.MockBacklog.instance.keys(), ['job3'])
+
+
+class ConcurrentFileExportTestCase(unittest.TestCase):
+    """ Checks that jobs run concurrently in the file export mode do not share their series files
+    """
+    days = [datetime.date(2015, 11, d) for d in xrange(1, 5)]
+
+    class MockBacklog(dict):
+        content = {}
+        instance = None
+
+        def __init__(self, name):
+            dict.__init__(self, self.content)
+            ConcurrentFileExportTestCase.MockBacklog.instance = self
+
+    class MockDAOContext(MockDAO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+    def mock_send_data(self, job):
+        dates = set()
+        for path in [part for _, part in job._parts] if job._parts else [job._archive]:
+            with zipfile.ZipFile(path) as archive:
+                dates.update(
+                    line[:10] for name in archive.namelist() for line in archive.read(name).splitlines()
+                )
+        self.uploaded_dates.append(tuple(sorted(dates)))
+
+    def setUp(self):
+        self.dao = self.MockDAOContext([
+            TimedEvent(
+                datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(minutes=m),
+                'type1', 'var%d' % (m % 5), {'value': m}
+            )
+            for day in self.days for m in xrange(0, 24 * 60, 3)
+        ])
+        self.saved = pycstbox.export.Backlog, process.evtdao.get_dao, DWHEventsExportJob.send_data
+        test = self
+        pycstbox.export.Backlog = self.MockBacklog
+        process.evtdao.get_dao = lambda name: self.dao
+        DWHEventsExportJob.send_data = lambda job: test.mock_send_data(job)
+
+        # the current job must not find any event
+        self.MockBacklog.content = dict(
+            ('job%d' % day.day, {PARM_EXTRACT_DATE: day}) for day in self.days
+        )
+        self.cfg = ProcessConfiguration()
+        self.cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest'
+            },
+            ProcessConfiguration.Props.EXPORT: {
+                ProcessConfiguration.Props.VAR_TYPES: '*',
+                ProcessConfiguration.Props.WORKERS: 4
+            }
+        })
+        self.uploaded_dates = []
+
+    def tearDown(self):
+        pycstbox.export.Backlog, process.evtdao.get_dao, DWHEventsExportJob.send_data = self.saved
+
+    def _check_run(self):
+        proc = DWHEventsExportProcess()
+        proc.log_setLevel(logging.CRITICAL)
+        self.assertEqual(proc.run(self.cfg), 0)
+        self.assertEqual(self.MockBacklog.instance.keys(), [])
+        # each archive contains the points of its day only
+        self.assertEqual(sorted(self.uploaded_dates), [(day.isoformat(),) for day in self.days])
+
+    def test_01(self):
+        self._check_run()
+
+    def test_03_split(self):
+        self.cfg.data[ProcessConfiguration.Props.EXPORT][ProcessConfiguration.Props.MAX_ARCHIVE_SIZE] = 1024 * 1024
+        self._check_run()
+
+    def test_02_unexpected_error(self):
+        """ Checks that an unexpected error only fails its own job
+        """
+        get_events = self.dao.get_events
+
+        def failing_get_events(from_time, to_time, var_type=None):
+            if from_time.date() <= self.days[1] < to_time.date():
+                raise RuntimeError('DAO failure')
+            return get_events(from_time, to_time, var_type=var_type)
+
+        self.dao.get_events = failing_get_events
+        proc = DWHEventsExportProcess()
+        proc.log_setLevel(logging.CRITICAL)
+        # the failure is logged by the job
+        logging.disable(logging.CRITICAL)
+        try:
+            self.assertEqual(proc.run(self.cfg), DWHEventsExportProcess.ERR_UNEXPECTED)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(self.MockBacklog.instance.keys(), ['job2'])
+
 
 _HERE_ = os.path.dirname(__file__)
 
@@ -121,3 +676,300 @@ _HERE_ = os.path.dirname(__file__)
 def fixture_path(name):
     return os.path.join(_HERE_, 'fixtures', name)
 
+
+
+class ExportJobTestMixin(object):
+    """ Runs export jobs using an in-memory DAO, and records the uploaded archives
+    """
+    class MockDAOContext(MockDAO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoints_path = os.path.join(self.tmp_dir, 'checkpoints')
+        self.cfg = ProcessConfiguration()
+        self.cfg.load_dict({
+            ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+            ProcessConfiguration.Props.SERVER: {
+                ProcessConfiguration.Props.HOST: 'unittest',
+                ProcessConfiguration.Props.AUTH: {
+                    ProcessConfiguration.Props.LOGIN: 'john.doe',
+                    ProcessConfiguration.Props.PASSWORD: 'letmein'
+                }
+            },
+            ProcessConfiguration.Props.EXPORT: {
+                ProcessConfiguration.Props.VAR_TYPES: '*',
+                ProcessConfiguration.Props.MAX_ARCHIVE_SIZE: 1024
+            },
+            ProcessConfiguration.Props.JOBS_QUEUE: {
+                ProcessConfiguration.Props.PATH: os.path.join(self.tmp_dir, 'jobs')
+            },
+            ProcessConfiguration.Props.CHECKPOINTS: {
+                ProcessConfiguration.Props.ENABLED: True,
+                ProcessConfiguration.Props.PATH: self.checkpoints_path
+            }
+        })
+
+        t0 = datetime.datetime(2015, 11, 3)
+        self.dao = self.MockDAOContext([
+            TimedEvent(t0 + datetime.timedelta(minutes=m), 'type1', 'var%d' % (m % 20), {'value': m * 7 % 13})
+            for m in xrange(0, 24 * 60, 2)
+        ])
+        self.saved = process.evtdao.get_dao, requests.Session.post
+        process.evtdao.get_dao = lambda name: self.dao
+        requests.Session.post = self.mock_post
+        self.posted = []
+        self.failing = set()
+
+    def tearDown(self):
+        process.evtdao.get_dao, requests.Session.post = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def mock_post(self, url, files=None, **kwargs):
+        name = os.path.basename(files['zip'].name)
+        self.posted.append(name)
+        if name in self.failing:
+            return SplitUploadTestCase.MockResponse(False, 'failure', 500)
+        return SplitUploadTestCase.MockResponse(True, json.dumps({'message': 'OK', 'jobID': 'job-%s' % name}))
+
+    def _make_job(self, dates=(datetime.date(2015, 11, 3),), job_id='bl-job'):
+        job = DWHEventsExportJob(
+            jobname='unittest', jobid=job_id, config=self.cfg, parms={process.PARM_EXTRACT_DATES: list(dates)}
+        )
+        job.log_setLevel(logging.CRITICAL)
+        return job
+
+
+class CheckpointTestCase(ExportJobTestMixin, unittest.TestCase):
+    """ Checks that a job which failed to upload its archive is resumed from its checkpoint
+    """
+
+    def test_01_resume(self):
+        job = self._make_job()
+        count = job.export_events()
+        self.assertEqual(count, 24 * 30)
+        part_names = [name for name, _ in job._parts]
+        self.assertGreater(len(part_names), 2)
+
+        self.failing = {part_names[1]}
+        try:
+            self.assertRaises(pycstbox.export.ExportError, job.send_data)
+        finally:
+            job.cleanup()
+
+        # the failed part is kept, the uploaded ones are not needed anymore
+        checkpoints = ExportCheckpoints(self.checkpoints_path)
+        self.assertEqual(checkpoints.job_ids(), ['bl-job'])
+        job_dir = checkpoints.job_dir('bl-job')
+        self.assertIn(part_names[1], os.listdir(job_dir))
+        self.assertNotIn(part_names[0], os.listdir(job_dir))
+
+        # the next run does not read the events again, and only sends the failed part
+        self.dao.requests = 0
+        self.posted = []
+        self.failing = set()
+        job = self._make_job()
+        try:
+            self.assertEqual(job.export_events(), count)
+            job.send_data()
+        finally:
+            job.cleanup()
+        self.assertEqual(self.dao.requests, 0)
+        self.assertEqual(self.posted, [part_names[1]])
+
+    def test_02_outdated(self):
+        """ Checks that a checkpoint which does not match the job anymore is not used
+        """
+        job = self._make_job()
+        job.export_events()
+        part_names = [name for name, _ in job._parts]
+        job.cleanup()
+
+        # damaged archive
+        with file(os.path.join(self.checkpoints_path, 'bl-job', part_names[0]), 'ab') as fp:
+            fp.write('garbage')
+        job = self._make_job()
+        self.dao.requests = 0
+        try:
+            job.export_events()
+        finally:
+            job.cleanup()
+        self.assertGreater(self.dao.requests, 0)
+
+        # other dates
+        self.dao.requests = 0
+        job = self._make_job(dates=(datetime.date(2015, 11, 3), datetime.date(2015, 11, 4)))
+        try:
+            job.export_events()
+        finally:
+            job.cleanup()
+        self.assertGreater(self.dao.requests, 0)
+
+    def test_03_process(self):
+        """ Checks the checkpoints lifecycle managed by the export process
+        """
+        checkpoints = ExportCheckpoints(self.checkpoints_path)
+        for job_id in ('job1', 'job2'):
+            checkpoints.job_dir(job_id)
+
+        proc = DWHEventsExportProcess()
+        proc._checkpoints = checkpoints
+        self.assertEqual(checkpoints.purge(['job1', 'job3']), ['job2'])
+        proc._job_done({}, 'job1', [], 1)
+        self.assertEqual(checkpoints.job_ids(), ['job1'])
+        proc._job_done({'job1': {}}, 'job1', ['job1'], 0)
+        self.assertEqual(checkpoints.job_ids(), [])
+
+    def test_04_export_modes(self):
+        """ Checks that the checkpoint parts are built using the configured export mode, with the
+        same content whatever it is
+        """
+        cfg_export = self.cfg.data[ProcessConfiguration.Props.EXPORT]
+        contents = {}
+        for mode in ('file', ProcessConfiguration.Props.IN_MEMORY, ProcessConfiguration.Props.PIPELINED):
+            cfg_export[ProcessConfiguration.Props.IN_MEMORY] = mode == ProcessConfiguration.Props.IN_MEMORY
+            cfg_export[ProcessConfiguration.Props.PIPELINED] = mode == ProcessConfiguration.Props.PIPELINED
+            job = self._make_job(job_id=mode)
+            try:
+                self.assertEqual(job.export_events(), 24 * 30)
+                self.assertGreater(len(job._parts), 2)
+                entries = {}
+                for _, path in job._parts:
+                    self.assertEqual(os.path.dirname(path), os.path.join(self.checkpoints_path, mode))
+                    with zipfile.ZipFile(path) as zf:
+                        for name in zf.namelist():
+                            entries[name] = zf.read(name)
+                contents[mode] = entries
+            finally:
+                job.cleanup()
+            self.assertIsNone(job._work_dir)
+
+        self.assertEqual(len(contents['file']), 10)
+        self.assertEqual(contents['file'], contents[ProcessConfiguration.Props.IN_MEMORY])
+        self.assertEqual(contents['file'], contents[ProcessConfiguration.Props.PIPELINED])
+
+
+class UploadLedgerTestCase(ExportJobTestMixin, unittest.TestCase):
+    """ Checks that an archive identical to an already uploaded one is not sent again
+    """
+    def setUp(self):
+        super(UploadLedgerTestCase, self).setUp()
+        self.cfg.data[ProcessConfiguration.Props.CHECKPOINTS][ProcessConfiguration.Props.ENABLED] = False
+        self.cfg.data[ProcessConfiguration.Props.UPLOAD_LEDGER] = {
+            ProcessConfiguration.Props.ENABLED: True,
+            ProcessConfiguration.Props.PATH: os.path.join(self.tmp_dir, 'uploads.json'),
+            ProcessConfiguration.Props.RETENTION: 30
+        }
+
+    def _run_job(self, job_id):
+        job = self._make_job(job_id=job_id)
+        try:
+            job.export_events()
+            part_names = [name for name, _ in job._parts]
+            job.send_data()
+        finally:
+            job.cleanup()
+        return part_names
+
+    def test_01(self):
+        part_names = self._run_job('job1')
+        self.assertEqual(self.posted, part_names)
+
+        # same data exported again, by a job which archive names are different => nothing sent
+        self.posted = []
+        self.assertNotEqual(self._run_job('job2'), part_names)
+        self.assertEqual(self.posted, [])
+
+        # data modified => the modified part is sent
+        self.dao.events[0].data['value'] += 1
+        self._run_job('job3')
+        self.assertEqual(len(self.posted), 1)
+
+
+class IncrementalExportTestCase(ExportJobTestMixin, unittest.TestCase):
+    """ Checks that the incremental mode exports only the events produced since the previous run
+    """
+    class MockBacklog(dict):
+        def __init__(self, name):
+            dict.__init__(self)
+
+    def setUp(self):
+        super(IncrementalExportTestCase, self).setUp()
+        self.saved_backlog = pycstbox.export.Backlog
+        pycstbox.export.Backlog = self.MockBacklog
+
+        self.cfg.data[ProcessConfiguration.Props.CHECKPOINTS][ProcessConfiguration.Props.ENABLED] = False
+        self.cfg.data[ProcessConfiguration.Props.EXPORT][ProcessConfiguration.Props.MAX_ARCHIVE_SIZE] = 0
+        self.watermarks_path = os.path.join(self.tmp_dir, 'watermarks.json')
+        self.cfg.data[ProcessConfiguration.Props.INTRADAY].update({
+            ProcessConfiguration.Props.ENABLED: True,
+            ProcessConfiguration.Props.PATH: self.watermarks_path
+        })
+
+        # the previous export ended 3 hours ago
+        self.now = datetime.datetime.utcnow()
+        watermarks = process.ExportWatermarks(self.watermarks_path)
+        watermarks.update({}, self.now - datetime.timedelta(hours=3))
+
+        self.dao.events = sorted(
+            self._event(-m, 'var%d' % (m % 3)) for m in xrange(4 * 60, 10, -10)
+        )
+        self.uploaded = []
+
+    def tearDown(self):
+        pycstbox.export.Backlog = self.saved_backlog
+        super(IncrementalExportTestCase, self).tearDown()
+
+    def _event(self, minutes, var_name):
+        return TimedEvent(self.now + datetime.timedelta(minutes=minutes), 'type1', var_name, {'value': minutes})
+
+    def mock_post(self, url, files=None, **kwargs):
+        with zipfile.ZipFile(files['zip']) as archive:
+            self.uploaded.append(dict(
+                (name, archive.read(name).count('\n')) for name in archive.namelist()
+            ))
+        return SplitUploadTestCase.MockResponse(True, json.dumps({'message': 'OK', 'jobID': 'job'}))
+
+    def _run(self):
+        proc = DWHEventsExportProcess()
+        proc.log_setLevel(logging.CRITICAL)
+        return proc.run(self.cfg)
+
+    def test_01(self):
+        self.assertEqual(self._run(), 0)
+        # events of the last 3 hours, but the ones of the last 5 minutes
+        self.assertEqual(self.uploaded, [{'var0.tsv': 6, 'var1.tsv': 5, 'var2.tsv': 6}])
+
+        # some new events, and late ones : only the ones more recent than the last exported
+        # event of their series are exported (the watermarks being -30, -40 and -20 minutes)
+        self.uploaded = []
+        self.dao.events.extend([
+            self._event(-8, 'var0'), self._event(-7, 'var2'),
+            self._event(-35, 'var1'), self._event(-45, 'var1'), self._event(-35, 'var0')
+        ])
+        self.dao.events.sort()
+        self.assertEqual(self._run(), 0)
+        self.assertEqual(self.uploaded, [{'var0.tsv': 1, 'var1.tsv': 1, 'var2.tsv': 1}])
+
+        # nothing new
+        self.uploaded = []
+        self.assertEqual(self._run(), 0)
+        self.assertEqual(self.uploaded, [])
+
+    def test_02_first_run(self):
+        """ Checks that the first incremental export starts at the day the daily mode would extract
+        """
+        os.remove(self.watermarks_path)
+        first_day = datetime.datetime.combine((self.now - datetime.timedelta(days=1)).date(), datetime.time())
+        self.dao.events.extend([
+            TimedEvent(first_day + datetime.timedelta(minutes=1), 'type1', 'var8', {'value': 1}),
+            TimedEvent(first_day - datetime.timedelta(minutes=1), 'type1', 'var9', {'value': 1}),
+        ])
+        self.dao.events.sort()
+
+        self.assertEqual(self._run(), 0)
+        self.assertEqual(self.uploaded, [{'var0.tsv': 8, 'var1.tsv': 7, 'var2.tsv': 8, 'var8.tsv': 1}])
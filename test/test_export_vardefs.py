@@ -3,6 +3,7 @@
 
 import unittest
 import json
+import copy
 import os
 import tempfile
 import logging
@@ -130,6 +131,8 @@ class TestProcess01(unittest.TestCase):
         cls.vars_meta = json.load(file(fixture_path('vars_metadata.json')))
 
     def setUp(self):
+        self.state_path = tempfile.mktemp(suffix='.json')
+        self.tmp = None
         self.process = DWHVariableDefinitionsExportProcess()
         self.process_cfg = ProcessConfiguration()
         self.process_cfg.load_dict({
@@ -141,13 +144,22 @@ class TestProcess01(unittest.TestCase):
                     ProcessConfiguration.Props.LOGIN: 'john.doe',
                     ProcessConfiguration.Props.PASSWORD: 'letmein'
                 }
+            },
+            ProcessConfiguration.Props.VARDEFS: {
+                ProcessConfiguration.Props.PATH: self.state_path
             }
         })
         # avoid cluttering unit tests report with logging
         self.process.logger.setLevel(logging.ERROR)
 
-        # monkey patch requests module
-        requests.post = self.mock_post
+        # monkey patch requests sessions
+        self._session_post = requests.Session.post
+        requests.Session.post = self.mock_post
+
+    def tearDown(self):
+        requests.Session.post = self._session_post
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
 
     def test_01(self):
         rc = self.process.run(self.process_cfg, self.dev_cfg, self.vars_meta)
@@ -167,6 +179,41 @@ class TestProcess01(unittest.TestCase):
         finally:
             os.remove(self.tmp.name)
 
+    def test_02_incremental(self):
+        """ Checks that only modified definitions are uploaded, and nothing if there is none
+        """
+        rc = self.process.run(self.process_cfg, self.dev_cfg, self.vars_meta)
+        self.assertEqual(rc, 0)
+        os.remove(self.tmp.name)
+
+        # nothing changed => no upload
+        self.tmp = None
+        rc = self.process.run(self.process_cfg, self.dev_cfg, self.vars_meta)
+        self.assertEqual(rc, 0)
+        self.assertIsNone(self.tmp)
+
+        # modify the metadata of a variable => only its definition is uploaded
+        vars_meta = copy.deepcopy(self.vars_meta)
+        varname = sorted(vars_meta)[0]
+        vars_meta[varname]['label'] = 'modified label'
+        rc = self.process.run(self.process_cfg, self.dev_cfg, vars_meta)
+        self.assertEqual(rc, 0)
+        try:
+            with file(self.tmp.name) as fp:
+                defs = json.load(fp)
+            self.assertEqual([d['varname'] for d in defs], [varname])
+        finally:
+            os.remove(self.tmp.name)
+
+        # full upload requested
+        rc = self.process.run(self.process_cfg, self.dev_cfg, vars_meta, full=True)
+        self.assertEqual(rc, 0)
+        try:
+            with file(self.tmp.name) as fp:
+                self.assertEqual(len(json.load(fp)), self.enabled_outputs_cnt)
+        finally:
+            os.remove(self.tmp.name)
+
 _HERE_ = os.path.dirname(__file__)
 
 
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import datetime
+import calendar
+import random
+
+from pycstbox.dwh.filters import DTFMT_POINT, maybe_boolean
+from pycstbox.dwh.formatters import PointTimestampFormatter, encode_value, series_value_encoder
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+def _random_timestamps(count, seed=42):
+    rnd = random.Random(seed)
+    t0 = datetime.datetime(2015, 12, 31, 0, 0)
+    return sorted(
+        t0 + datetime.timedelta(seconds=rnd.uniform(0, 2 * 24 * 3600))
+        for _ in xrange(count)
+    )
+
+
+class PointTimestampFormatterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.formatter = PointTimestampFormatter()
+
+    def test_01(self):
+        """ Checks that datetime formatting is identical to strftime, across day changes
+        """
+        for ts in _random_timestamps(5000):
+            self.assertEqual(self.formatter.format_datetime(ts), ts.strftime(DTFMT_POINT))
+
+    def test_02(self):
+        """ Checks that epoch formatting is identical to strftime, across day changes
+        """
+        for ts in _random_timestamps(5000):
+            epoch = calendar.timegm(ts.timetuple())
+            self.assertEqual(self.formatter.format_epoch(epoch), ts.strftime(DTFMT_POINT))
+
+    def test_03(self):
+        """ Checks day boundaries
+        """
+        for ts in (
+            datetime.datetime(2016, 2, 28, 23, 59, 59),
+            datetime.datetime(2016, 2, 29, 0, 0, 0),
+            datetime.datetime(2016, 3, 1, 0, 0, 0),
+            datetime.datetime(1970, 1, 1, 0, 0, 0),
+        ):
+            self.assertEqual(self.formatter.format_datetime(ts), ts.strftime(DTFMT_POINT))
+            self.assertEqual(
+                self.formatter.format_epoch(calendar.timegm(ts.timetuple())), ts.strftime(DTFMT_POINT)
+            )
+
+
+_SAMPLE_VALUES = (
+    True, False, 0, 1, -42, 10 ** 20, 3L, 0.1, 2.0 / 3, 1e-10, 1e22, float('nan'),
+    'true', 'False', 'TRUE', 'on', '12.5', '', u'false', u'closed'
+)
+
+
+class ValueEncodersTestCase(unittest.TestCase):
+    def test_01(self):
+        """ Checks that the generic encoder is identical to the legacy formatting
+        """
+        for value in _SAMPLE_VALUES:
+            self.assertEqual(encode_value(value), maybe_boolean(str(value)))
+
+    def test_02(self):
+        """ Checks that series encoders are identical to the legacy formatting, whatever the
+        type of the sample used to select them
+        """
+        for sample in _SAMPLE_VALUES:
+            encode = series_value_encoder(sample)
+            for value in _SAMPLE_VALUES:
+                self.assertEqual(encode(value), maybe_boolean(str(value)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+import os
+import tempfile
+import logging
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+from pycstbox.dwh.process import ProcessConfiguration
+from pycstbox.dwh.pending_jobs_db import PendingJobInfo, SQLitePendingJobsQueue
+from pycstbox.dwh.sessions import close_sessions
+from pycstbox.dwh.job_monitor import JobStatusPoller, JobCheckScheduler, StoredJobCheckScheduler, FileChangeWatcher
+from pycstbox.dwh.job_monitor import queue_report
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Local stub of the DataWareHouse server job status API.
+
+    Job statuses are defined by the ''statuses'' dictionary, keyed by the job id. Unknown jobs
+    are replied with a 404 by the single job API, and are omitted in batch API replies. The batch
+    API is replied with a 404 if not enabled.
+    """
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, statuses, delay=0, batch_enabled=True):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubRequestHandler)
+        self.statuses = statuses
+        self.delay = delay
+        self.batch_enabled = batch_enabled
+        self.requests = []
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # kept alive connections are reset when the server is stopped
+        pass
+
+    @property
+    def host(self):
+        return '127.0.0.1:%d' % self.server_port
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        with self.server.lock:
+            self.server.requests.append(path)
+        time.sleep(self.server.delay)
+
+        # path: /api/dss/sites/<site>/jobs/<job_id>/status
+        job_id = path.split('/')[-2]
+        try:
+            code = self.server.statuses[job_id]
+        except KeyError:
+            self.reply(404, {'message': 'unknown job'})
+        else:
+            self.reply(200, {'code': code})
+
+    def do_POST(self):
+        path = urlparse.urlparse(self.path).path
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.requests.append(path)
+        time.sleep(self.server.delay)
+
+        # path: /api/dss/sites/<site>/jobs/status
+        if not self.server.batch_enabled:
+            self.reply(404, {'message': 'not found'})
+            return
+
+        statuses = self.server.statuses
+        self.reply(200, dict(
+            (job_id, {'code': statuses[job_id]}) for job_id in json.loads(body) if job_id in statuses
+        ))
+
+    def reply(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_config(host, concurrency, batch_size=None):
+    cfg = ProcessConfiguration()
+    cfg.load_dict({
+        ProcessConfiguration.Props.SITE_CODE: 'unit-test',
+        ProcessConfiguration.Props.SERVER: {
+            ProcessConfiguration.Props.HOST: host,
+            ProcessConfiguration.Props.AUTH: {
+                ProcessConfiguration.Props.LOGIN: 'john.doe',
+                ProcessConfiguration.Props.PASSWORD: 'letmein'
+            }
+        },
+        ProcessConfiguration.Props.MONITOR: {
+            ProcessConfiguration.Props.CONCURRENCY: concurrency
+        }
+    })
+    if batch_size:
+        cfg[ProcessConfiguration.Props.MONITOR][ProcessConfiguration.Props.BATCH_SIZE] = batch_size
+        cfg[ProcessConfiguration.Props.API_URLS][ProcessConfiguration.Props.JOBS_STATUS] = \
+            'http://%(host)s/api/dss/sites/%(site)s/jobs/status'
+    return cfg
+
+
+class JobStatusPollerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.statuses = dict(('job%02d' % i, (i % 3) - 1) for i in xrange(20))
+        self.server = StubServer(self.statuses, delay=0.02)
+        self.server.start()
+
+    def tearDown(self):
+        # close the kept alive connections, so that the server handler threads terminate
+        close_sessions()
+        self.server.stop()
+
+    def _poll(self, concurrency, job_ids, batch_size=None):
+        poller = JobStatusPoller(make_config(self.server.host, concurrency, batch_size))
+        poller.log_setLevel(logging.CRITICAL)
+        try:
+            return poller.poll(job_ids)
+        finally:
+            poller.close()
+
+    def _check_statuses(self, job_ids, statuses):
+        self.assertEqual([s.job_id for s in statuses], job_ids)
+        for status in statuses[:-1]:
+            self.assertEqual(status.code, self.statuses[status.job_id])
+            self.assertEqual(status.is_final, status.code <= 0)
+
+        # unknown job : no status available
+        self.assertIsNone(statuses[-1].code)
+        self.assertFalse(statuses[-1].is_final)
+
+    def test_01(self):
+        """ Checks the returned statuses, in sequential and concurrent modes
+        """
+        job_ids = sorted(self.statuses) + ['unknown']
+        for concurrency in (1, 8):
+            self._check_statuses(job_ids, self._poll(concurrency, job_ids))
+
+    def test_02(self):
+        """ Checks that concurrent polling is faster than sequential one with a slow server
+        """
+        job_ids = sorted(self.statuses)
+        t0 = time.time()
+        self._poll(1, job_ids)
+        sequential = time.time() - t0
+
+        t0 = time.time()
+        self._poll(10, job_ids)
+        concurrent = time.time() - t0
+
+        self.assertLess(concurrent, sequential / 3)
+
+    def test_03_batch(self):
+        """ Checks the batch mode, in sequential and concurrent modes
+        """
+        job_ids = sorted(self.statuses) + ['unknown']
+        for concurrency in (1, 4):
+            del self.server.requests[:]
+            self._check_statuses(job_ids, self._poll(concurrency, job_ids, batch_size=8))
+            # 21 jobs => 3 batch requests
+            self.assertEqual(len(self.server.requests), 3)
+            self.assertTrue(all(path.endswith('/jobs/status') for path in self.server.requests))
+
+    def test_04_batch_fallback(self):
+        """ Checks the fallback to single job requests when the server does not support the batch API
+        """
+        self.server.batch_enabled = False
+        job_ids = sorted(self.statuses) + ['unknown']
+        poller = JobStatusPoller(make_config(self.server.host, 1, batch_size=8))
+        poller.log_setLevel(logging.CRITICAL)
+        try:
+            self._check_statuses(job_ids, poller.poll(job_ids))
+            self.assertFalse(poller.batch_mode)
+            # one rejected batch request, followed by single job ones
+            self.assertEqual(len(self.server.requests), 1 + len(job_ids))
+
+            # subsequent polls do not try the batch API again
+            del self.server.requests[:]
+            poller.poll(job_ids)
+            self.assertEqual(len(self.server.requests), len(job_ids))
+        finally:
+            poller.close()
+
+
+class JobCheckSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = JobCheckScheduler(
+            first_check_delay=10, check_interval=60, backoff_factor=2, max_interval=300, max_age=1000
+        )
+
+    def test_01_backoff(self):
+        """ Checks the fast first check, the backoff of the next ones and its upper bound
+        """
+        sched = self.scheduler
+        sched.add('job', 0)
+        self.assertEqual(sched.next_check_time(), 10)
+        self.assertEqual(sched.due_jobs(9), [])
+
+        now, check_times = 10, []
+        while len(check_times) < 6:
+            self.assertEqual(sched.due_jobs(now), ['job'])
+            check_times.append(now)
+            sched.reschedule('job', now)
+            now = sched.next_check_time()
+
+        intervals = [b - a for a, b in zip(check_times, check_times[1:])]
+        self.assertEqual(intervals, [60, 120, 240, 300, 300])
+
+    def test_02_sync(self):
+        """ Checks the synchronization with the pending jobs, and the order of checks
+        """
+        sched = self.scheduler
+        sched.sync(['job1', 'job2'], 0)
+        sched.sync(['job2', 'job3'], 5)
+        self.assertNotIn('job1', sched)
+        self.assertEqual(len(sched), 2)
+
+        self.assertEqual(sched.due_jobs(10), ['job2'])
+        sched.reschedule('job2', 10)
+        self.assertEqual(sched.next_check_time(), 15)
+        self.assertEqual(sched.due_jobs(100), ['job3', 'job2'])
+
+        # removed jobs are not reported any more
+        sched.reschedule('job3', 100)
+        sched.remove('job3')
+        self.assertEqual(sched.due_jobs(10000), [])
+        self.assertIsNone(sched.next_check_time())
+
+    def test_03_expiry(self):
+        """ Checks that jobs pending for too long are reported as expired, and forgotten
+        """
+        sched = self.scheduler
+        sched.add('old', 0)
+        sched.add('new', 500)
+        self.assertEqual(sched.expired_jobs(1000), [])
+        self.assertEqual(sched.expired_jobs(1001), ['old'])
+        self.assertNotIn('old', sched)
+        self.assertIn('new', sched)
+
+    def test_04_resume(self):
+        """ Checks that schedules are resumed from the stored job metadata
+        """
+        infos = {
+            'fresh': PendingJobInfo('fresh', 0, 100, None, None, 0, None),
+            'checked': PendingJobInfo('checked', 0, 100, 200, 470, 3, 1),
+            'old': PendingJobInfo('old', -2000, 100, None, None, 0, None)
+        }
+        sched = self.scheduler
+        sched.sync(['fresh', 'checked', 'old', 'unknown'], 5, infos.get)
+        self.assertEqual(sched.job_next_check('fresh'), 10)
+        self.assertEqual(sched.job_next_check('checked'), 470)
+        self.assertEqual(sched.job_next_check('unknown'), 15)
+        self.assertEqual(sched.expired_jobs(5), ['old'])
+
+        # 3 checks done => next interval is 60 * 2**3, bounded to the max interval
+        sched.due_jobs(470)
+        sched.reschedule('checked', 470)
+        self.assertEqual(sched.job_next_check('checked'), 470 + 300)
+
+
+class StoredJobCheckSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.db')
+        self.queue = SQLitePendingJobsQueue(self.path)
+        self.scheduler = StoredJobCheckScheduler(
+            first_check_delay=10, check_interval=60, backoff_factor=2, max_interval=300, max_age=1000,
+            queue=self.queue
+        )
+
+    def tearDown(self):
+        self.queue.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _check(self, job_ids, now):
+        """ Reschedules the given jobs and records the checks, as done by the monitor
+        """
+        sched = self.scheduler
+        for job_id in job_ids:
+            sched.reschedule(job_id, now)
+        self.queue.record_checks([(job_id, 1, sched.job_next_check(job_id)) for job_id in job_ids], now)
+
+    def test_01_backoff(self):
+        """ Checks that the schedule is stored in the queue, with the same backoff as the in-memory one
+        """
+        sched = self.scheduler
+        self.queue.append('job', upload_time=0)
+        self.assertIn('job', sched)
+        self.assertEqual(sched.next_check_time(), 10)
+        self.assertEqual(sched.due_jobs(9), [])
+
+        now, check_times = 10, []
+        while len(check_times) < 6:
+            self.assertEqual(sched.due_jobs(now), ['job'])
+            check_times.append(now)
+            self._check(['job'], now)
+            now = sched.next_check_time()
+
+        intervals = [b - a for a, b in zip(check_times, check_times[1:])]
+        self.assertEqual(intervals, [60, 120, 240, 300, 300])
+        self.assertEqual(self.queue.job_info('job').attempts, 6)
+
+    def test_02_shared(self):
+        """ Checks that the schedule is resumed from the queue by another scheduler, and that
+        completed jobs are not reported any more
+        """
+        self.queue.append('job1', upload_time=0)
+        self.queue.append('job2', upload_time=5)
+        self.assertEqual(self.scheduler.due_jobs(20), ['job1', 'job2'])
+        self._check(['job1', 'job2'], 20)
+
+        other = StoredJobCheckScheduler(
+            first_check_delay=10, check_interval=60, backoff_factor=2, queue=self.queue
+        )
+        self.assertEqual(other.next_check_time(), 80)
+        self.queue.remove('job1')
+        self.assertEqual(other.due_jobs(80), ['job2'])
+        self.assertEqual(len(other), 1)
+
+    def test_03_expiry(self):
+        """ Checks that jobs pending for too long are reported as expired
+        """
+        self.queue.append('old', upload_time=0)
+        self.queue.append('new', upload_time=500)
+        self.assertEqual(self.scheduler.expired_jobs(1000), [])
+        self.assertEqual(self.scheduler.expired_jobs(1001), ['old'])
+
+    def test_04_report(self):
+        """ Checks the pending jobs report
+        """
+        self.queue.append('job1', upload_time=0)
+        self.queue.append('job2', upload_time=500)
+        self.queue.append('job3', upload_time=600)
+        self.queue.record_checks([('job1', 1, 2000)], check_time=1000)
+
+        lines = queue_report(self.queue, stale_age=1000, now=1200)
+        self.assertEqual(lines[0], 'pending jobs: 3')
+        self.assertTrue(lines[1].startswith('- not checked: 2 '))
+        self.assertTrue(lines[2].startswith('- in process: 1 '))
+        self.assertEqual(lines[3:], [
+            'not checked yet: job2, job3',
+            'pending for more than 1000 secs: job1'
+        ])
+
+
+class FileChangeWatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_01(self):
+        watcher = FileChangeWatcher(self.path)
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+
+        with file(self.path, 'at') as fp:
+            fp.write('job01\n')
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+
+        os.remove(self.path)
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from pycstbox import devcfg
+from pycstbox.dwh.filters import DeviceMetadataCache
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+class DeviceMetadataCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved_home = devcfg.METADATA_HOME
+        devcfg.METADATA_HOME = self.home = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.home, 'x2d.d'))
+        self.path = os.path.join(self.home, 'x2d.d', 'd10')
+        with file(self.path, 'wt') as fp:
+            fp.write('{}')
+
+        self.loads = []
+
+        def _loader(devtype):
+            self.loads.append(devtype)
+            return {'devtype': devtype, 'load': len(self.loads)}
+
+        self.cache = DeviceMetadataCache(_loader)
+
+    def tearDown(self):
+        devcfg.METADATA_HOME = self.saved_home
+        shutil.rmtree(self.home)
+
+    def test_01(self):
+        cache = self.cache
+        meta = cache.get('x2d:d10')
+        self.assertIs(cache.get('x2d:d10'), meta)
+        self.assertEqual(self.loads, ['x2d:d10'])
+
+        # metadata file modified => reloaded
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(cache.get('x2d:d10')['load'], 2)
+        self.assertEqual(cache.get('x2d:d10')['load'], 2)
+
+        # no file found => cached anyway
+        cache.get('x2d:unknown')
+        cache.get('x2d:unknown')
+        self.assertEqual(self.loads, ['x2d:d10', 'x2d:d10', 'x2d:unknown'])
+
+        cache.clear()
+        cache.get('x2d:d10')
+        self.assertEqual(len(self.loads), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
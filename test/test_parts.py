@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import io
+import random
+import zipfile
+
+from pycstbox.dwh.parts import SplitArchiveWriter
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+def _series(count, size):
+    rnd = random.Random(count)
+    return [
+        ('var%03d.tsv' % i, ''.join('%d\t%.3f\n' % (n, rnd.random()) for n in xrange(size // 10)))
+        for i in xrange(count)
+    ]
+
+
+class SplitArchiveWriterTestCase(unittest.TestCase):
+    def _split(self, entries, max_size, **options):
+        def new_part(num):
+            return 'part%d' % num, io.BytesIO()
+
+        with SplitArchiveWriter(new_part, max_size, **options) as writer:
+            for name, content in entries:
+                writer.writestr(name, content)
+        return writer.parts
+
+    def _check_parts(self, parts, entries):
+        names = []
+        for _, buf in parts:
+            buf.seek(0)
+            with zipfile.ZipFile(buf) as archive:
+                self.assertIsNone(archive.testzip())
+                for name in archive.namelist():
+                    self.assertEqual(archive.read(name), dict(entries)[name])
+                names.extend(archive.namelist())
+        # all the entries are present once, in order
+        self.assertEqual(names, [name for name, _ in entries])
+
+    def test_01_split(self):
+        entries = _series(50, 20000)
+        for workers in (1, 2):
+            parts = self._split(entries, 64 * 1024, workers=workers)
+            self.assertGreater(len(parts), 1)
+            self.assertEqual([name for name, _ in parts], ['part%d' % (i + 1) for i in xrange(len(parts))])
+            for _, buf in parts:
+                self.assertLessEqual(len(buf.getvalue()), 64 * 1024)
+            self._check_parts(parts, entries)
+
+    def test_02_no_split(self):
+        entries = _series(5, 1000)
+        parts = self._split(entries, 1024 * 1024)
+        self.assertEqual(len(parts), 1)
+        self._check_parts(parts, entries)
+
+    def test_03_oversized(self):
+        """ Checks that a series bigger than the limit is stored alone in its part
+        """
+        entries = _series(3, 1000)
+        entries.insert(1, ('big.tsv', _series(1, 200000)[0][1]))
+        parts = self._split(entries, 4096, compression=zipfile.ZIP_STORED)
+        self.assertEqual(len(parts), 3)
+        self._check_parts(parts, entries)
+        parts[1][1].seek(0)
+        self.assertEqual(zipfile.ZipFile(parts[1][1]).namelist(), ['big.tsv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
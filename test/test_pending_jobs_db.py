@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+
+from pycstbox.dwh.pending_jobs_db import SQLitePendingJobsQueue
+from pycstbox.dwh.pending_jobs_queue import open_pending_jobs_queue, BACKEND_SQLITE
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+class SQLitePendingJobsQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.db')
+        self.queue = open_pending_jobs_queue(BACKEND_SQLITE, self.path)
+
+    def tearDown(self):
+        self.queue.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_01_list(self):
+        """ Checks the list interface, shared with the file based queue
+        """
+        queue = self.queue
+        for i in xrange(5):
+            queue.append('job%d' % i)
+        queue.remove('job1')
+        queue.remove_all(['job3', 'job4', 'unknown'])
+
+        self.assertEqual(queue.items(), ['job0', 'job2'])
+        self.assertEqual(len(queue), 2)
+        self.assertIn('job2', queue)
+        self.assertNotIn('job1', queue)
+        self.assertRaises(ValueError, queue.remove, 'job1')
+
+        other = SQLitePendingJobsQueue(self.path)
+        try:
+            self.assertEqual(other.items(), ['job0', 'job2'])
+        finally:
+            other.close()
+
+        queue.clear()
+        self.assertTrue(queue.is_empty())
+
+    def test_02_metadata(self):
+        """ Checks the storage of the job metadata, and the queries using them
+        """
+        queue = self.queue
+        queue.append('job0', archive_size=1000, upload_time=100)
+        queue.append('job1', archive_size=2000, upload_time=200)
+        queue.append('job2', upload_time=300)
+
+        info = queue.job_info('job1')
+        self.assertEqual((info.upload_time, info.archive_size, info.attempts), (200, 2000, 0))
+        self.assertIsNone(info.last_check)
+        self.assertIsNone(queue.job_info('unknown'))
+
+        queue.record_checks([('job0', 1, 500), ('job1', 1, 400)], check_time=350)
+        queue.record_checks([('job1', -3, None)], check_time=360)
+
+        info = queue.job_info('job1')
+        self.assertEqual((info.last_check, info.next_check, info.attempts, info.last_status), (360, None, 2, -3))
+
+        self.assertEqual(queue.due_jobs(1000), ['job0'])
+        self.assertEqual(queue.jobs_uploaded_before(250), ['job0', 'job1'])
+        self.assertEqual(queue.jobs_with_status(-3), ['job1'])
+        self.assertEqual(queue.jobs_with_status(None), ['job2'])
+        self.assertEqual(queue.status_summary(), [(None, 1, 300), (-3, 1, 200), (1, 1, 100)])
+
+    def test_03_batch_rollback(self):
+        """ Checks that the changes of a failed transaction are discarded
+        """
+        queue = self.queue
+        queue.append('job0')
+        try:
+            with queue.batch():
+                queue.clear()
+                queue.append('job1')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        self.assertEqual(queue.items(), ['job0'])
+
+    def test_04_first_check(self):
+        """ Checks the scheduling of the first check of new jobs
+        """
+        queue = self.queue
+        queue.append('job0', upload_time=100)
+        queue.append('job1', upload_time=200)
+        queue.record_checks([('job0', 1, 250)], check_time=110)
+
+        self.assertEqual(queue.due_jobs(215), [])
+        self.assertEqual(queue.due_jobs(215, first_check_delay=10), ['job1'])
+        self.assertEqual(queue.due_jobs(300, first_check_delay=10), ['job1', 'job0'])
+
+        self.assertEqual(queue.next_check_time(), 250)
+        self.assertEqual(queue.next_check_time(first_check_delay=10), 210)
+        queue.record_checks([('job1', 1, 400)], check_time=210)
+        self.assertEqual(queue.next_check_time(first_check_delay=10), 250)
+
+        queue.clear()
+        self.assertIsNone(queue.next_check_time(first_check_delay=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import tempfile
+import multiprocessing
+
+from pycstbox.dwh.pending_jobs_queue import PendingJobsQueue
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+def _add_jobs(path, prefix, count):
+    queue = PendingJobsQueue(path, fsync=False)
+    for i in xrange(count):
+        if i % 2:
+            queue.append('%s-%03d' % (prefix, i))
+        else:
+            with queue.batch():
+                queue.append('%s-%03d' % (prefix, i))
+                queue.append('%s-tmp' % prefix)
+                queue.remove('%s-tmp' % prefix)
+
+
+class PendingJobsQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.jobs')
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.lock'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _records(self):
+        with file(self.path) as fp:
+            return fp.read().splitlines()
+
+    def test_01_journal(self):
+        """ Checks that changes are appended to the file, and replayed when loading it
+        """
+        queue = PendingJobsQueue(self.path, fsync=False)
+        for i in xrange(5):
+            queue.append('job%d' % i)
+        queue.remove('job1')
+        queue.remove_all(['job3', 'job4', 'unknown'])
+
+        self.assertEqual(self._records(), ['+job0', '+job1', '+job2', '+job3', '+job4', '-job1', '-job3', '-job4'])
+        self.assertEqual(queue.items(), ['job0', 'job2'])
+        self.assertIn('job2', queue)
+        self.assertNotIn('job1', queue)
+        self.assertRaises(ValueError, queue.remove, 'job1')
+
+        self.assertEqual(PendingJobsQueue(self.path).items(), ['job0', 'job2'])
+
+    def test_02_compaction(self):
+        """ Checks that the journal is compacted when it grows too much
+        """
+        queue = PendingJobsQueue(self.path, fsync=False)
+        job_ids = ['job%03d' % i for i in xrange(300)]
+        for job_id in job_ids:
+            queue.append(job_id)
+        queue.remove_all(job_ids[:-10])
+
+        self.assertEqual(self._records(), job_ids[-10:])
+        self.assertEqual(PendingJobsQueue(self.path).items(), job_ids[-10:])
+
+    def test_03_legacy_format(self):
+        """ Checks that files written by previous versions are read and can be appended to
+        """
+        with file(self.path, 'wt') as fp:
+            fp.write('job0\njob1')
+
+        queue = PendingJobsQueue(self.path, fsync=False)
+        self.assertEqual(queue.items(), ['job0', 'job1'])
+        queue.append('job2')
+        self.assertEqual(PendingJobsQueue(self.path).items(), ['job0', 'job1', 'job2'])
+
+    def test_04_batch(self):
+        """ Checks that transactions are written at once, and merged with concurrent changes
+        """
+        queue = PendingJobsQueue(self.path, fsync=False)
+        queue.append('job0')
+        other = PendingJobsQueue(self.path, fsync=False)
+
+        with queue.batch():
+            queue.append('job1')
+            queue.append('job2')
+            queue.remove('job0')
+            self.assertEqual(queue.items(), ['job1', 'job2'])
+            # nothing written yet
+            self.assertEqual(self._records(), ['+job0'])
+
+            other.append('job3')
+
+        self.assertEqual(self._records(), ['job3', 'job1', 'job2'])
+        self.assertEqual(PendingJobsQueue(self.path).items(), ['job3', 'job1', 'job2'])
+
+    def test_05_batch_rollback(self):
+        """ Checks that the changes of a failed transaction are discarded
+        """
+        queue = PendingJobsQueue(self.path, fsync=False)
+        queue.append('job0')
+        try:
+            with queue.batch():
+                queue.clear()
+                queue.append('job1')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        self.assertEqual(queue.items(), ['job0'])
+        self.assertEqual(PendingJobsQueue(self.path).items(), ['job0'])
+
+    def test_06_concurrent_processes(self):
+        """ Checks that no change is lost when several processes update the queue
+        """
+        PendingJobsQueue(self.path, fsync=False)
+        processes = [
+            multiprocessing.Process(target=_add_jobs, args=(self.path, 'p%d' % i, 100))
+            for i in xrange(4)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+
+        expected = set('p%d-%03d' % (p, i) for p in xrange(4) for i in xrange(100))
+        self.assertSetEqual(set(PendingJobsQueue(self.path).items()), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
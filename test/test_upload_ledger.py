@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import datetime
+import io
+import os
+import tempfile
+import time
+import zipfile
+
+from pycstbox.dwh.compression import CompressingZipFile
+from pycstbox.dwh.upload_ledger import UploadLedger, archive_content_hash
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+DAY1 = datetime.date(2015, 11, 3)
+DAY2 = datetime.date(2015, 11, 4)
+
+
+def _make_archive(entries, **options):
+    buf = io.BytesIO()
+    with CompressingZipFile(buf, 'w', **options) as archive:
+        for name, content in entries:
+            archive.writestr(name, content)
+    buf.seek(0)
+    return buf
+
+
+class ContentHashTestCase(unittest.TestCase):
+    def test_01(self):
+        entries = [('var1.tsv', 'a\t1\n' * 100), ('var2.tsv', 'b\t2\n' * 100)]
+        ref = archive_content_hash(_make_archive(entries))
+
+        # independent of the build time, of the compression settings and of the entries order
+        time.sleep(2)
+        self.assertEqual(archive_content_hash(_make_archive(entries, level=9)), ref)
+        self.assertEqual(archive_content_hash(_make_archive(entries, compression=zipfile.ZIP_STORED)), ref)
+        self.assertEqual(archive_content_hash(_make_archive(entries[::-1])), ref)
+
+        # content dependent
+        self.assertNotEqual(archive_content_hash(_make_archive(entries[:1])), ref)
+        self.assertNotEqual(archive_content_hash(_make_archive([entries[0], ('var2.tsv', 'b\t3\n' * 100)])), ref)
+
+        # position of the buffer preserved
+        buf = _make_archive(entries)
+        buf.seek(10)
+        archive_content_hash(buf)
+        self.assertEqual(buf.tell(), 10)
+
+
+class UploadLedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.json')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_01(self):
+        ledger = UploadLedger(self.path)
+        self.assertIsNone(ledger.lookup('h1', [DAY1]))
+        ledger.record('h1', [DAY1], 'job1')
+        ledger.record('h2', [DAY2, DAY1], 'job2')
+
+        ledger = UploadLedger(self.path)
+        self.assertEqual(ledger.lookup('h1', [DAY1]), 'job1')
+        self.assertIsNone(ledger.lookup('h1', [DAY2]))
+        self.assertEqual(ledger.lookup('h2', [DAY1, DAY2]), 'job2')
+
+    def test_02_retention(self):
+        ledger = UploadLedger(self.path, retention=3600)
+        now = time.time()
+        ledger.record('h1', [DAY1], 'job1', upload_time=now - 3000)
+        ledger.record('h2', [DAY1], 'job2', upload_time=now - 60)
+        self.assertEqual(len(ledger), 2)
+        ledger.prune(now + 1000)
+        self.assertEqual(len(ledger), 1)
+        self.assertIsNone(ledger.lookup('h1', [DAY1]))
+        self.assertEqual(ledger.lookup('h2', [DAY1]), 'job2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+import tempfile
+
+from pycstbox.dwh.vardefs_state import UploadedDefinitions
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+
+class UploadedDefinitionsTestCase(unittest.TestCase):
+    vardefs = [
+        {'varname': 'temp_living', 'label': 'living', 'type': 'temperature', 'unit': 'degC'},
+        {'varname': 'temp_garden', 'label': 'garden', 'type': 'temperature', 'unit': 'degC'}
+    ]
+
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.json')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_01(self):
+        uploaded = UploadedDefinitions(self.path)
+        self.assertEqual(uploaded.changed(self.vardefs), self.vardefs)
+
+        uploaded.set_uploaded(self.vardefs)
+        uploaded = UploadedDefinitions(self.path)
+        self.assertEqual(len(uploaded), 2)
+        self.assertEqual(uploaded.changed(self.vardefs), [])
+
+        # key order does not matter
+        modified = [dict(reversed(vdef.items())) for vdef in self.vardefs]
+        modified[1]['unit'] = 'K'
+        added = {'varname': 'energy', 'label': 'energy', 'type': 'energy', 'unit': 'kWh'}
+        modified.append(added)
+        self.assertEqual(uploaded.changed(modified), [modified[1], added])
+
+        uploaded.clear()
+        self.assertEqual(uploaded.changed(self.vardefs), self.vardefs)
+
+    def test_02_target(self):
+        """ Checks that the state is ignored when uploading to another server or site
+        """
+        uploaded = UploadedDefinitions(self.path, host='dwh.example.org', site_code='SITE1')
+        uploaded.set_uploaded(self.vardefs)
+
+        uploaded = UploadedDefinitions(self.path, host='dwh.example.org', site_code='SITE1')
+        self.assertEqual(uploaded.changed(self.vardefs), [])
+        uploaded = UploadedDefinitions(self.path, host='dwh.example.org', site_code='SITE2')
+        self.assertEqual(uploaded.changed(self.vardefs), self.vardefs)
+        uploaded = UploadedDefinitions(self.path, host='other.example.org', site_code='SITE1')
+        self.assertEqual(uploaded.changed(self.vardefs), self.vardefs)
+
+        # state stored without its target
+        with file(self.path, 'wt') as fp:
+            json.dump({'temp_living': 'x', 'temp_garden': 'y'}, fp)
+        uploaded = UploadedDefinitions(self.path, host='dwh.example.org', site_code='SITE1')
+        self.assertEqual(uploaded.changed(self.vardefs), self.vardefs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import datetime
+import os
+import tempfile
+
+from pycstbox.events import TimedEvent
+from pycstbox.dwh.watermarks import ExportWatermarks
+
+__author__ = 'Eric Pascual - CSTB (eric.pascual@cstb.fr)'
+
+T0 = datetime.datetime(2015, 11, 3, 10, 0)
+
+
+def _event(minutes, var_name):
+    return TimedEvent(T0 + datetime.timedelta(minutes=minutes), 'type1', var_name, {'value': minutes})
+
+
+class ExportWatermarksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.json')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_01_new_events(self):
+        marks = ExportWatermarks(self.path)
+        self.assertIsNone(marks.read_start(datetime.timedelta(hours=2)))
+
+        exported = {}
+        events = [_event(m, 'var%d' % (m % 2)) for m in xrange(10)]
+        self.assertEqual(list(marks.new_events(events, exported)), events)
+        self.assertEqual(exported, {'var0': T0 + datetime.timedelta(minutes=8), 'var1': T0 + datetime.timedelta(minutes=9)})
+        marks.update(exported, T0 + datetime.timedelta(minutes=10))
+
+        # persisted
+        marks = ExportWatermarks(self.path)
+        self.assertEqual(marks.get('var0'), T0 + datetime.timedelta(minutes=8))
+        self.assertEqual(marks.end, T0 + datetime.timedelta(minutes=10))
+
+        # only the events more recent than the watermark of their series are kept
+        events = [_event(7, 'var0'), _event(8, 'var0'), _event(8.5, 'var1'), _event(9, 'var0'), _event(5, 'var2')]
+        exported = {}
+        self.assertEqual(list(marks.new_events(events, exported)), events[3:])
+        self.assertEqual(set(exported), {'var0', 'var2'})
+
+    def test_02_read_start(self):
+        marks = ExportWatermarks(self.path)
+        end = T0 + datetime.timedelta(hours=5)
+        marks.update({}, end)
+        self.assertEqual(marks.read_start(datetime.timedelta(hours=2)), end)
+
+        # the oldest watermark, but not older than the look-back period
+        marks.update({'var0': T0 + datetime.timedelta(hours=4), 'var1': T0 + datetime.timedelta(hours=4.5)}, end)
+        self.assertEqual(marks.read_start(datetime.timedelta(hours=2)), T0 + datetime.timedelta(hours=4))
+        self.assertEqual(marks.read_start(datetime.timedelta(minutes=30)), T0 + datetime.timedelta(hours=4.5))
+
+
+if __name__ == '__main__':
+    unittest.main()